@@ -1,37 +1,115 @@
 # backend/app.py
-from fastapi import FastAPI, Depends, HTTPException
+from fastapi import FastAPI, Depends, HTTPException, Request, Response, Query
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse, PlainTextResponse, JSONResponse
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
-from collections import Counter, defaultdict
+from pydantic import ValidationError
+from collections import Counter
+from contextlib import asynccontextmanager
 import os
-
-from database import Base, engine, get_db
-from models import Favorite
-from schemas import SearchResponse, FavoriteIn, FavoriteOut, RecoResponse, Movie
+import io
+import re
+import csv
+import json
+import time
+import asyncio
+import logging
+import numpy as np
+import httpx
+
+from database import get_db, SessionLocal, dialect_insert
+from models import Favorite, FavoriteGenre
+from migrations import upgrade
+from schemas import (SearchResponse, FavoriteIn, FavoriteOut, RecoResponse, Movie, TrainingStatus,
+                     MovieRef, FavoritesBulkOut, BulkError)
 from tmdb import (
     search_movies,
     popular_movies,
     movie_details,
-    discover_by_genres,
     movie_enriched,
+    discover_by_genres,
     collection_movies,
     discover_by_keywords,
     person_directed_movies,
+    fetch_many,
+    close_client,
+    client as tmdb_client,
 )
-from ml import train_user_model, load_user_model, score_movies_for_user
+from tmdb_client import priority, current_priority, HIGH, NORMAL, LOW, TMDbUnavailable
+from catalog import enrich_many, load_movies, store_movies, minimal_movie, fallback_favorite
+from candidate_index import index as candidate_index, user_feature_weights
+from similar_index import index as similar_index, build as build_similar_index
+from title_index import index as title_index, search_cache, normalize_query, SEARCH_MIN_LOCAL
+from ml import train_user_model, load_user_model, score_movies_for_user, model_version
+from training import TrainingQueue
+import global_model
+from reco_cache import reco_cache, make_key as reco_key
+from ranking import rank, blend_scores, top_order
+from recommender import rank_candidates, cosine_scores
+import metrics
 
 # Parámetros de control para diversidad y ranking
 MAX_PER_COLLECTION_CANDIDATES = 3   # cuántas cogemos por saga como candidatas
 MAX_PER_COLLECTION_FINAL = 2        # cuántas pueden aparecer en el top final
 MIN_VOTE_COUNT_FOR_RATING = 150     # ignora notas con pocos votos
-RATING_WEIGHT = 0.15                # peso del rating TMDb en el score final
-ML_WEIGHT = 0.85                    # peso del modelo ML en el score final
+ML_WEIGHT = 0.85                    # peso del modelo ML en el score final (el rating TMDb pesa 1 - ML_WEIGHT)
+TOP_K = 20                          # recomendaciones devueltas
+MIN_FAVORITES = 5                   # mínimo para el modelo por usuario
+RECO_MODEL = os.getenv("RECO_MODEL", "user")  # "user": regresión por usuario; "global": embeddings compartidos
+TRAIN_WORKERS = int(os.getenv("TRAIN_WORKERS", "2"))  # reentrenamientos simultáneos
+LOCAL_CANDIDATES = 300              # candidatas sacadas del índice local
+MIN_LOCAL_CANDIDATES = 60           # por debajo, se completan con TMDb
+REMOTE_ENRICH_LIMIT = int(os.getenv("REMOTE_ENRICH_LIMIT", "60"))  # candidatas TMDb que pasan al 2º nivel
+BULK_MAX_FAVORITES = int(os.getenv("BULK_MAX_FAVORITES", "1000"))  # por petición a /favorites/bulk
+SIMILAR_REBUILD_GROWTH = float(os.getenv("SIMILAR_REBUILD_GROWTH", "0.1"))  # ver _refresh_similar_index
+SIMILAR_RETRY_AFTER = 5   # segundos sugeridos (Retry-After) mientras se carga el índice de similares
+PREFILTER_RATING_WEIGHT = 0.1       # peso del rating en el pre-filtro (el coseno de géneros pesa 1)
+
+# Métricas (GET /metrics): duración por ruta y por etapa del pipeline de recomendación
+HTTP_SECONDS = metrics.Histogram("http_request_seconds", "Duración de las peticiones a la API",
+                                 ("method", "route", "status"))
+STAGE_SECONDS = metrics.Histogram("reco_stage_seconds", "Duración de cada etapa de las recomendaciones", ("stage",))
+SEARCH_REQUESTS = metrics.Counter("search_requests_total", "Búsquedas por origen de la respuesta (cache, local, tmdb)",
+                                  ("source",))
+
+log = logging.getLogger(__name__)
 
 os.makedirs("models", exist_ok=True)
 
-Base.metadata.create_all(bind=engine)
-
-app = FastAPI(title="Movie Recommender API")
+upgrade()  # tablas nuevas + migraciones pendientes (ver migrations.py)
+
+# Tareas de fondo: se guarda la referencia (asyncio solo guarda una débil) y un
+# fallo se registra al terminar en vez de perderse sin que nadie lo mire
+_tasks = set()
+
+def _task_done(task: asyncio.Task) -> None:
+    _tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        log.error("La tarea de fondo %s falló", task.get_name(), exc_info=task.exception())
+
+def _background(coro, name: str) -> asyncio.Task:
+    task = asyncio.create_task(coro, name=name)
+    _tasks.add(task)
+    task.add_done_callback(_task_done)
+    return task
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    training_queue.start()
+    # El índice de candidatas se construye en segundo plano desde el catálogo
+    app.state.index_task = _background(run_in_threadpool(candidate_index.build_from_db), "candidate_index")
+    # Índice de títulos para /search, también desde el catálogo
+    app.state.title_task = _background(run_in_threadpool(title_index.build_from_db), "title_index")
+    # Índice de similares: se abre con mmap si existe; si no, se construye
+    app.state.similar_task = _background(run_in_threadpool(_load_similar_index), "similar_index")
+    yield
+    for task in list(_tasks):
+        task.cancel()
+    await training_queue.stop()
+    await close_client()
+
+app = FastAPI(title="Movie Recommender API", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -41,59 +119,160 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+def _load_similar_index():
+    if not similar_index.reload():
+        build_similar_index()
+    _similar_state["catalog"] = max(_similar_state["catalog"], len(similar_index))
+
+# El índice de similares es una foto del catálogo: se reconstruye en segundo plano
+# cuando el catálogo (que crece con cada enriquecimiento) supera en
+# SIMILAR_REBUILD_GROWTH lo que había al construirlo
+_similar_state = {"catalog": 0, "task": None}
+
+def _refresh_similar_index() -> None:
+    task = _similar_state["task"]
+    if not candidate_index.ready or (task is not None and not task.done()):
+        return
+    size = len(candidate_index)
+    if size > _similar_state["catalog"] * (1 + SIMILAR_REBUILD_GROWTH):
+        _similar_state["catalog"] = size
+        _similar_state["task"] = _background(run_in_threadpool(build_similar_index), "similar_rebuild")
+
+@app.exception_handler(TMDbUnavailable)
+async def tmdb_unavailable(request: Request, exc: TMDbUnavailable):
+    # Breaker abierto y nada en caché: 503 con el tiempo hasta la próxima prueba, no un 500
+    return JSONResponse({"detail": "TMDb no disponible temporalmente"}, status_code=503,
+                        headers={"Retry-After": str(max(1, round(exc.retry_after)))})
+
+@app.middleware("http")
+async def timing(request, call_next):
+    t0 = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # Plantilla de la ruta ("/movies/{movie_id}/similar"), no la URL: cardinalidad acotada
+        route = request.scope.get("route")
+        HTTP_SECONDS.observe(time.perf_counter() - t0, method=request.method,
+                             route=route.path if route is not None else "other", status=status)
+
 @app.middleware("http")
 async def no_cache(request, call_next):
     response = await call_next(request)
-    if request.url.path in ("/recommendations", "/favorites", "/search"):
+    if request.url.path == "/recommendations":
+        # Cacheable en el navegador pero siempre revalidado con ETag (304 si no cambió)
+        response.headers["Cache-Control"] = "private, no-cache"
+    elif request.url.path in ("/favorites", "/search", "/recommendations/stream"):
         response.headers["Cache-Control"] = "no-store, no-cache, must-revalidate, max-age=0"
         response.headers["Pragma"] = "no-cache"
     return response
 
 @app.get("/health")
 async def health():
-    return {"ok": True, "build": "ml-logreg-v2-retrain"}
+    return {"ok": True, "build": "ml-logreg-v2-retrain", "tmdb": tmdb_client.stats()}
+
+@app.get("/metrics", include_in_schema=False)
+def metrics_endpoint():
+    return PlainTextResponse(metrics.render(), media_type=metrics.CONTENT_TYPE)
 
 @app.get("/search", response_model=SearchResponse)
-async def search(q: str):
+async def search(q: str, k: int = Query(20, ge=1, le=20)):
     if not q or len(q) < 2:
         raise HTTPException(status_code=400, detail="Consulta demasiado corta")
-    results = search_movies(q)
-    return {"results": results}
+    key = normalize_query(q)
+    if not key:
+        return {"results": []}
+    results = search_cache.get(key)
+    if results is not None:
+        SEARCH_REQUESTS.inc(source="cache")
+        return {"results": results[:k]}
+    # Índice local de títulos; TMDb solo si no da suficientes, y lo que devuelve se indexa
+    results = await run_in_threadpool(title_index.search, key)
+    if len(results) >= SEARCH_MIN_LOCAL:
+        SEARCH_REQUESTS.inc(source="local")
+    else:
+        try:
+            remote = await search_movies(q)
+        except (TMDbUnavailable, httpx.HTTPError) as e:
+            if results:
+                return {"results": results[:k]}  # TMDb no responde: lo local, sin guardarlo en caché
+            if isinstance(e, TMDbUnavailable):
+                raise  # su handler: 503 con Retry-After
+            raise HTTPException(status_code=503, detail="TMDb no disponible temporalmente") from e
+        SEARCH_REQUESTS.inc(source="tmdb")
+        await run_in_threadpool(title_index.add_many, remote)
+        seen = {m["id"] for m in results}
+        results += [m for m in remote if m["id"] not in seen][:20 - len(results)]
+    search_cache.put(key, results)
+    return {"results": results[:k]}
+
+@app.get("/movies/{movie_id}/similar", response_model=SearchResponse)
+async def similar_movies(movie_id: int, k: int = Query(10, ge=1, le=50)):
+    """Películas parecidas por tokens (MinHash + LSH, ver similar_index.py)."""
+    task = getattr(app.state, "similar_task", None)
+    if task is None or not task.done():
+        # Sin índice todas las películas parecerían no indexadas: mejor reintentar
+        raise HTTPException(status_code=503, detail="Índice de similares en construcción",
+                            headers={"Retry-After": str(SIMILAR_RETRY_AFTER)})
+    similar_index.reload()
+    _refresh_similar_index()
+    hits = similar_index.similar(movie_id, k)
+    if not hits and similar_index.signature_of(movie_id) is None:
+        # Película aún no indexada: firma calculada al vuelo desde el catálogo/TMDb
+        movie = await _movie_for_similar(movie_id)
+        hits = similar_index.similar(movie_id, k, movie=movie)
+    local = await run_in_threadpool(load_movies, [mid for mid, _ in hits])
+    return {"results": [local[mid][0] for mid, _ in hits if mid in local]}
+
+async def _movie_for_similar(movie_id: int) -> dict:
+    """Catálogo local o TMDb. Solo un 404 de TMDb es "no encontrada"; si TMDb falla,
+    503 (TMDbUnavailable llega a su handler) en vez de un 404 falso."""
+    local = await run_in_threadpool(load_movies, [movie_id])
+    if movie_id in local:
+        return local[movie_id][0]
+    try:
+        movie = await movie_enriched(movie_id)
+    except httpx.HTTPStatusError as e:
+        if e.response.status_code == 404:
+            raise HTTPException(status_code=404, detail="Película no encontrada")
+        raise HTTPException(status_code=503, detail="TMDb no disponible temporalmente")
+    except httpx.TransportError:
+        raise HTTPException(status_code=503, detail="TMDb no disponible temporalmente")
+    await run_in_threadpool(store_movies, [movie])
+    return movie
+
+# ---------- Helpers: datos mínimos de películas que no están en el catálogo y TMDb falla ----------
+def _fallback_candidate(c: dict) -> dict:
+    return minimal_movie(c["id"], c.get("title"), c.get("poster_path"), c.get("genre_ids", []),
+                         c.get("vote_average", 0.0), c.get("vote_count", 0))
+
+def _user_favorites(db: Session, user_id: str) -> list[Favorite]:
+    with STAGE_SECONDS.time(stage="favorites_load"):
+        return db.query(Favorite).filter(Favorite.user_id == user_id).all()
 
 # ---------- Helper: reentrenar tras añadir favorito ----------
-def _retrain_after_favorite(user_id: str, db: Session):
-    """Reentrena el modelo del usuario si ya tiene ≥5 favoritos."""
-    fav_rows = db.query(Favorite).filter(Favorite.user_id == user_id).all()
+async def _retrain_after_favorite(user_id: str, db: Session):
+    """Reentrena el modelo del usuario si ya tiene ≥5 favoritos.
+    Devuelve el resumen del entrenamiento (con la versión nueva) o None."""
+    fav_rows = await run_in_threadpool(_user_favorites, db, user_id)
     if len(fav_rows) < 5:
-        return
+        return None
 
     # Enriquecer favoritos (positivos)
-    favs = []
-    for f in fav_rows:
-        try:
-            favs.append(movie_enriched(f.movie_id))
-        except Exception:
-            favs.append({
-                "id": f.movie_id,
-                "title": f.movie_title,
-                "poster_path": f.poster_path,
-                "genre_ids": [int(x) for x in (f.genre_ids or '').split(',') if x],
-                "keyword_ids": [],
-                "director_ids": [],
-                "collection_id": None,
-                "vote_average": 0.0,
-                "vote_count": 0,
-            })
+    enriched = await enrich_many([f.movie_id for f in fav_rows])
+    favs = [e if e is not None else fallback_favorite(f) for f, e in zip(fav_rows, enriched)]
 
     # Negativos: candidatas por géneros principales + populares
     genre_counts = Counter(g for m in favs for g in (m.get("genre_ids") or []))
     top_genres = [g for g, _ in genre_counts.most_common(3)]
 
+    calls = [(discover_by_genres, top_genres, p) for p in (1, 2)] if top_genres else []
+    calls.append((popular_movies, 1))
     candidates = []
-    if top_genres:
-        for p in (1, 2):
-            candidates.extend(discover_by_genres(top_genres, page=p))
-    candidates.extend(popular_movies(page=1))
+    for movies in await fetch_many(calls):
+        candidates.extend(movies or [])
 
     # Deduplicar y quitar favoritas
     fav_ids = {m["id"] for m in favs}
@@ -106,123 +285,404 @@ def _retrain_after_favorite(user_id: str, db: Session):
         seen.add(cid)
         negatives_pool.append(c)
 
-    # Entrenar (se guarda en /models)
-    train_user_model(user_id, positives=favs, negatives_pool=negatives_pool)
+    # Entrenar (se guarda en /models); CPU fuera del event loop
+    info = await run_in_threadpool(train_user_model, user_id, positives=favs, negatives_pool=negatives_pool)
+    if info is None:
+        return None
+    return {**info, "version": model_version(user_id)}
+
+async def _retrain_user(user_id: str):
+    db = SessionLocal()
+    try:
+        with priority(LOW):  # las peticiones de usuarios pasan antes
+            return await _retrain_after_favorite(user_id, db)
+    finally:
+        db.close()
+
+# Reentrenos fuera del camino de la petición (ver training.py)
+training_queue = TrainingQueue(_retrain_user, workers=TRAIN_WORKERS)
+metrics.Callback("training_queue_users", "Usuarios en la cola de reentreno",
+                 lambda: {(k,): v for k, v in training_queue.stats().items()}, labelnames=("state",))
+
+async def _prewarm_recommendations(user_id: str, result: dict):
+    """Tras un reentreno, deja calculadas las recomendaciones con el modelo nuevo."""
+    db = SessionLocal()
+    try:
+        fav_rows = await run_in_threadpool(_user_favorites, db, user_id)
+    finally:
+        db.close()
+    if len(fav_rows) < 5:
+        return
+    ranking = _ranking_params()
+    with priority(LOW):
+        payload = await _compute_recommendations(user_id, fav_rows, ranking)
+    reco_cache.put(user_id, reco_key([f.movie_id for f in fav_rows], result["version"], *ranking.values()), payload)
+
+training_queue.on_trained(_prewarm_recommendations)
 
 # ---------- Favoritos CRUD ----------
 
+def _upsert_row(db: Session, user_id: str, movie_id: int, title: str | None, poster_path: str | None,
+                genres: list[int]) -> tuple[int, str]:
+    """Inserta o completa un favorito sin hacer commit. Devuelve (id, "inserted" | "updated" | "unchanged")."""
+    fav_id = db.execute(
+        dialect_insert(Favorite)
+        .values(user_id=user_id, movie_id=movie_id, movie_title=title, poster_path=poster_path)
+        .on_conflict_do_nothing(index_elements=["user_id", "movie_id"])
+        .returning(Favorite.id)
+    ).scalar()
+    state = "unchanged" if fav_id is None else "inserted"
+    if fav_id is None:
+        # Ya existía: backfill de lo que faltara (título nuevo, póster, géneros)
+        where = (Favorite.user_id == user_id) & (Favorite.movie_id == movie_id)
+        changed = False
+        if title:
+            changed |= db.query(Favorite).filter(where, Favorite.movie_title.is_distinct_from(title)) \
+                .update({Favorite.movie_title: title}, synchronize_session=False) > 0
+        if poster_path:
+            changed |= db.query(Favorite).filter(where, (Favorite.poster_path.is_(None)) | (Favorite.poster_path == "")) \
+                .update({Favorite.poster_path: poster_path}, synchronize_session=False) > 0
+        fav_id = db.query(Favorite.id).filter(where).scalar()
+        if genres and db.query(FavoriteGenre).filter(FavoriteGenre.favorite_id == fav_id).first() is not None:
+            genres = []
+        if changed or genres:
+            state = "updated"
+    if genres:
+        db.add_all(FavoriteGenre(favorite_id=fav_id, genre_id=g) for g in dict.fromkeys(genres))
+    return fav_id, state
+
+def _upsert_favorite(db: Session, payload: FavoriteIn, genres: list[int]) -> tuple[Favorite, bool]:
+    """Inserta o completa el favorito. Devuelve (fila, si cambió algo).
+    La transacción empieza con una escritura (INSERT ... ON CONFLICT): en SQLite
+    toma el bloqueo de escritura desde el principio y espera con busy_timeout
+    en vez de fallar con "database is locked" al pasar de lectura a escritura."""
+    movie = payload.movie
+    fav_id, state = _upsert_row(db, payload.user_id, movie.id, movie.title, movie.poster_path, genres)
+    db.commit()
+    return db.get(Favorite, fav_id, populate_existing=True), state != "unchanged"
+
 @app.post("/favorites", response_model=FavoriteOut)
 async def add_favorite(payload: FavoriteIn, db: Session = Depends(get_db)):
     # Garantiza genre_ids: si no vienen, los obtenemos de TMDb
     genres = payload.movie.genre_ids or []
     if not genres:
         try:
-            details = movie_details(payload.movie.id)
+            details = await movie_details(payload.movie.id)
             genres = details.get("genre_ids") or []
         except Exception:
             genres = []
 
-    f = Favorite(
-        user_id=payload.user_id,
-        movie_id=payload.movie.id,
-        movie_title=payload.movie.title,
-        poster_path=payload.movie.poster_path,
-        genre_ids=",".join(map(str, genres)),
-    )
-
-    # evitar duplicados (con backfill si faltaban datos)
-    existing = db.query(Favorite).filter(
-        Favorite.user_id == f.user_id,
-        Favorite.movie_id == f.movie_id
-    ).first()
-    if existing:
-        updated = False
-        if (not existing.genre_ids or not existing.genre_ids.strip()) and genres:
-            existing.genre_ids = ",".join(map(str, genres))
-            updated = True
-        if not existing.poster_path and payload.movie.poster_path:
-            existing.poster_path = payload.movie.poster_path
-            updated = True
-        if payload.movie.title and payload.movie.title != existing.movie_title:
-            existing.movie_title = payload.movie.title
-            updated = True
-        if updated:
-            db.commit()
-            db.refresh(existing)
-
-        # Reentrenar si ya hay suficientes favoritos
-        _retrain_after_favorite(payload.user_id, db)
-
-        return Movie(
-            id=existing.movie_id,
-            title=existing.movie_title,
-            poster_path=existing.poster_path,
-            genre_ids=[int(x) for x in (existing.genre_ids or '').split(',') if x]
-        )
-
-    db.add(f)
-    db.commit()
-    db.refresh(f)
+    row, changed = await run_in_threadpool(_upsert_favorite, db, payload, genres)
 
-    # Reentrenar si ya hay suficientes favoritos
-    _retrain_after_favorite(payload.user_id, db)
+    # Reentrenar en segundo plano (solo si el favorito es nuevo o cambió)
+    if changed:
+        reco_cache.invalidate(payload.user_id)
+        if RECO_MODEL == "user":
+            training_queue.enqueue(payload.user_id)
 
     return Movie(
-        id=f.movie_id,
-        title=f.movie_title,
-        poster_path=f.poster_path,
-        genre_ids=[int(x) for x in (f.genre_ids or '').split(',') if x]
+        id=row.movie_id,
+        title=row.movie_title,
+        poster_path=row.poster_path,
+        genre_ids=row.genre_ids
     )
 
+def _parse_csv(text: str) -> list[tuple[int, int, dict]]:
+    """Filas (nº de fila, línea del CSV, campos) de un CSV con cabecera id|movie_id|tmdb_id[,title,poster_path,genre_ids].
+    Sin cabecera, la primera columna es el id. genre_ids separados por "|", "," o espacios."""
+    reader = csv.reader(io.StringIO(text))
+    records = []  # (línea donde empieza el registro, valores); un campo entre comillas puede ocupar varias
+    line = 1
+    for values in reader:
+        records.append((line, values))
+        line = reader.line_num + 1
+    if not records:
+        return []
+    header = [h.strip().lower() for h in records[0][1]]
+    if header and header[0].isdigit():
+        header = ["id"]
+    else:
+        header = ["id" if h in ("movie_id", "tmdb_id") else h for h in header]
+        if "id" not in header:
+            raise HTTPException(status_code=422, detail="El CSV necesita una columna id, movie_id o tmdb_id")
+        records = records[1:]
+    rows = []
+    for line, values in records:
+        if not any(v.strip() for v in values):
+            continue
+        row = {h: v.strip() for h, v in zip(header, values) if v.strip()}
+        if "genre_ids" in row:
+            row["genre_ids"] = [g for g in re.split(r"[|,\s]+", row["genre_ids"]) if g]
+        rows.append((len(rows) + 1, line, row))
+    return rows
+
+async def _bulk_rows(request: Request, user_id: str | None) -> tuple[str, list[tuple[int, int | None, dict]]]:
+    """(user_id, [(fila, línea, campos)]) desde JSON ({"user_id", "movies": [...]} o una lista) o CSV.
+    La línea solo existe en CSV."""
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    body = await request.body()
+    if content_type in ("text/csv", "application/csv"):
+        rows = _parse_csv(body.decode("utf-8-sig", errors="replace"))
+    elif content_type in ("application/json", ""):
+        try:
+            data = json.loads(body or b"null")
+        except ValueError:
+            raise HTTPException(status_code=422, detail="JSON no válido")
+        if isinstance(data, dict):
+            user_id = user_id or data.get("user_id")
+            data = data.get("movies")
+        if not isinstance(data, list):
+            raise HTTPException(status_code=422, detail='Se espera {"user_id": ..., "movies": [...]} o una lista')
+        rows = [(n, None, m if isinstance(m, dict) else {"id": m}) for n, m in enumerate(data, start=1)]
+    else:
+        raise HTTPException(status_code=415, detail="Usa application/json o text/csv")
+    if not user_id:
+        raise HTTPException(status_code=422, detail="Falta user_id")
+    if len(rows) > BULK_MAX_FAVORITES:
+        raise HTTPException(status_code=413, detail=f"Como máximo {BULK_MAX_FAVORITES} favoritos por petición")
+    return user_id, rows
+
+async def _resolve_movies(refs: list[MovieRef]) -> dict[int, dict]:
+    """Metadatos (título, póster, géneros) de las películas a las que les falta algo,
+    vía enrich_many: catálogo local y, para lo que falta, movie_enriched (que lo guarda)."""
+    missing = [r.id for r in refs if not r.title or not r.genre_ids]
+    if not missing:
+        return {}
+    with priority(HIGH):
+        movies = await enrich_many(missing)
+    return {m["id"]: m for m in movies if m is not None}
+
+def _row_id(row: dict) -> int | None:
+    """Id de una fila que no validó, si al menos el id es un entero (en CSV llega como texto)."""
+    value = row.get("id")
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, int):
+        return value
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+def _upsert_bulk(db: Session, user_id: str, movies: list[dict]) -> Counter:
+    """Todos los favoritos en una sola transacción."""
+    counts = Counter()
+    try:
+        for m in movies:
+            _, state = _upsert_row(db, user_id, m["id"], m["title"], m["poster_path"], m["genre_ids"])
+            counts[state] += 1
+        db.commit()
+    except BaseException:
+        db.rollback()
+        raise
+    return counts
+
+@app.post("/favorites/bulk", response_model=FavoritesBulkOut)
+async def add_favorites_bulk(request: Request, user_id: str | None = None, db: Session = Depends(get_db)):
+    """Importa muchos favoritos de una vez (JSON o CSV) y reentrena una sola vez al final."""
+    user_id, rows = await _bulk_rows(request, user_id)
+
+    # Validación por fila: las filas erróneas se informan y se omiten
+    errors, refs, seen = [], [], set()
+    for n, line, row in rows:
+        try:
+            ref = MovieRef.model_validate(row)
+        except ValidationError as e:
+            first = e.errors()[0]
+            field = ".".join(map(str, first["loc"]))
+            errors.append(BulkError(row=n, line=line, id=_row_id(row), error=f"{field}: {first['msg']}"))
+            continue
+        if ref.id not in seen:  # duplicados: cuenta la primera aparición
+            seen.add(ref.id)
+            refs.append((n, line, ref))
+
+    meta = await _resolve_movies([r for _, _, r in refs])
+    movies = []
+    for n, line, ref in refs:
+        known = meta.get(ref.id, {})
+        title = ref.title or known.get("title")
+        if not title:
+            errors.append(BulkError(row=n, line=line, id=ref.id, error="Película no encontrada"))
+            continue
+        movies.append({"id": ref.id, "title": title, "poster_path": ref.poster_path or known.get("poster_path"),
+                       "genre_ids": ref.genre_ids or known.get("genre_ids") or []})
+
+    counts = await run_in_threadpool(_upsert_bulk, db, user_id, movies)
+
+    training = "skipped"
+    if counts["inserted"] or counts["updated"]:
+        reco_cache.invalidate(user_id)
+        if RECO_MODEL == "user":
+            training_queue.enqueue(user_id)
+            training = "queued"
+    return FavoritesBulkOut(user_id=user_id, received=len(rows), inserted=counts["inserted"],
+                            updated=counts["updated"], unchanged=counts["unchanged"],
+                            errors=sorted(errors, key=lambda e: e.row), training=training)
+
 @app.get("/favorites", response_model=list[FavoriteOut])
-async def list_favorites(user_id: str, db: Session = Depends(get_db)):
+def list_favorites(user_id: str, db: Session = Depends(get_db)):
     rows = db.query(Favorite).filter(Favorite.user_id == user_id).all()
+    # Completar con el catálogo local los favoritos guardados sin póster/géneros
+    local = load_movies([r.movie_id for r in rows], db=db)
     out = []
     for r in rows:
+        known = local[r.movie_id][0] if r.movie_id in local else {}
         out.append(Movie(
             id=r.movie_id,
             title=r.movie_title,
-            poster_path=r.poster_path,
-            genre_ids=[int(x) for x in (r.genre_ids or '').split(',') if x]
+            poster_path=r.poster_path or known.get("poster_path"),
+            genre_ids=r.genre_ids or known.get("genre_ids") or []
         ))
     return out
 
 @app.delete("/favorites/{movie_id}")
-async def delete_favorite(movie_id: int, user_id: str, db: Session = Depends(get_db)):
+def delete_favorite(movie_id: int, user_id: str, db: Session = Depends(get_db)):
     row = db.query(Favorite).filter(Favorite.user_id == user_id, Favorite.movie_id == movie_id).first()
     if not row:
         raise HTTPException(status_code=404, detail="No encontrado")
     db.delete(row)
     db.commit()
+    reco_cache.invalidate(user_id)
+    if RECO_MODEL == "user":
+        training_queue.enqueue(user_id)
     return {"deleted": True}
 
+@app.get("/training/status", response_model=TrainingStatus)
+async def training_status(user_id: str):
+    st = training_queue.status(user_id) or {"state": "idle"}
+    if st.get("version") is None:
+        st["version"] = await run_in_threadpool(model_version, user_id)
+    return {"user_id": user_id, **st}
+
 # ----------------- Recomendaciones con ML + diversidad -----------------
 
+def _ml_scores(user_id: str, favs: list[dict], candidates: list[dict]) -> list[float]:
+    with STAGE_SECONDS.time(stage="model_load"):
+        ids, weights = load_user_model(user_id)
+    if ids is None:
+        with STAGE_SECONDS.time(stage="training"):
+            train_user_model(user_id, positives=favs, negatives_pool=candidates)
+    with STAGE_SECONDS.time(stage="scoring"):
+        return score_movies_for_user(user_id, candidates)
+
+def _use_global(fav_rows: list[Favorite]) -> bool:
+    """Modo global si así está configurado, o para usuarios con pocos favoritos
+    (siempre que exista el modelo global). Sin él, exige MIN_FAVORITES."""
+    if fav_rows and global_model.available() and (RECO_MODEL == "global" or len(fav_rows) < MIN_FAVORITES):
+        return True
+    if len(fav_rows) < MIN_FAVORITES:
+        raise HTTPException(status_code=400, detail="Necesitas al menos 5 favoritos para ver recomendaciones")
+    return False
+
+def _reco_version(user_id: str, use_global: bool):
+    return f"g{global_model.version()}" if use_global else model_version(user_id)
+
+def _ranking_params(k: int = TOP_K,
+                    ml_weight: float = ML_WEIGHT,
+                    min_votes: int = MIN_VOTE_COUNT_FOR_RATING,
+                    max_per_collection: int = MAX_PER_COLLECTION_FINAL) -> dict:
+    return {"k": k, "ml_weight": ml_weight, "min_votes": min_votes, "max_per_collection": max_per_collection}
+
 @app.get("/recommendations", response_model=RecoResponse)
-async def recommendations(user_id: str, db: Session = Depends(get_db)):
+async def recommendations(user_id: str,
+                          request: Request,
+                          response: Response,
+                          k: int = Query(TOP_K, ge=1, le=100),
+                          ml_weight: float = Query(ML_WEIGHT, ge=0.0, le=1.0),
+                          min_votes: int = Query(MIN_VOTE_COUNT_FOR_RATING, ge=0),
+                          max_per_collection: int = Query(MAX_PER_COLLECTION_FINAL, ge=1),
+                          db: Session = Depends(get_db)):
+    ranking = _ranking_params(k, ml_weight, min_votes, max_per_collection)
+
     # Favoritos del usuario
-    fav_rows = db.query(Favorite).filter(Favorite.user_id == user_id).all()
-    if len(fav_rows) < 5:
-        raise HTTPException(status_code=400, detail="Necesitas al menos 5 favoritos para ver recomendaciones")
+    fav_rows = await run_in_threadpool(_user_favorites, db, user_id)
+    use_global = _use_global(fav_rows)
+
+    # Resultado cacheado si no cambiaron ni los favoritos ni el modelo
+    fav_ids = [f.movie_id for f in fav_rows]
+    version = await run_in_threadpool(_reco_version, user_id, use_global)
+    hit = reco_cache.get(user_id, reco_key(fav_ids, version, *ranking.values()))
+    if hit is None:
+        payload = await _compute_recommendations(user_id, fav_rows, ranking, use_global)
+        # El cálculo puede haber entrenado el primer modelo: la clave usa la versión final
+        version = await run_in_threadpool(_reco_version, user_id, use_global)
+        key = reco_key(fav_ids, version, *ranking.values())
+        hit = reco_cache.put(user_id, key, payload), payload
+    etag, payload = hit
+
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+    return payload
+
+def _provisional_recommendations(fav_rows: list[Favorite], k: int) -> dict:
+    """Ranking rápido solo con datos locales (catálogo + índice): coseno de géneros."""
+    local = load_movies([f.movie_id for f in fav_rows])
+    favs = [local[f.movie_id][0] if f.movie_id in local else fallback_favorite(f) for f in fav_rows]
+    ids = candidate_index.candidates(user_feature_weights(favs),
+                                     exclude={f.movie_id for f in fav_rows}, k=LOCAL_CANDIDATES)
+    movies = load_movies(ids)
+    top = rank_candidates(favs, [movies[i][0] for i in ids if i in movies])[:k]
+    return {"count": len(top), "results": top}
 
-    # Enriquecer favoritos (géneros + keywords + directores + colección + voto)
-    favs = []
-    for f in fav_rows:
+@app.get("/recommendations/stream")
+async def recommendations_stream(user_id: str,
+                                 k: int = Query(TOP_K, ge=1, le=100),
+                                 ml_weight: float = Query(ML_WEIGHT, ge=0.0, le=1.0),
+                                 min_votes: int = Query(MIN_VOTE_COUNT_FOR_RATING, ge=0),
+                                 max_per_collection: int = Query(MAX_PER_COLLECTION_FINAL, ge=1),
+                                 db: Session = Depends(get_db)):
+    """NDJSON: primero un ranking provisional local ("provisional"), luego el de ML ("final")."""
+    ranking = _ranking_params(k, ml_weight, min_votes, max_per_collection)
+    fav_rows = await run_in_threadpool(_user_favorites, db, user_id)
+    use_global = _use_global(fav_rows)
+    fav_ids = [f.movie_id for f in fav_rows]
+
+    def line(stage: str, payload: dict) -> str:
+        return json.dumps({"stage": stage, **payload}) + "\n"
+
+    async def stream():
+        version = await run_in_threadpool(_reco_version, user_id, use_global)
+        hit = reco_cache.get(user_id, reco_key(fav_ids, version, *ranking.values()))
+        if hit is not None:
+            yield line("final", hit[1])
+            return
+        provisional = await run_in_threadpool(_provisional_recommendations, fav_rows, k)
+        if provisional["results"]:
+            yield line("provisional", provisional)
         try:
-            enriched = movie_enriched(f.movie_id)
-        except Exception:
-            enriched = {
-                "id": f.movie_id,
-                "title": f.movie_title,
-                "poster_path": f.poster_path,
-                "genre_ids": [int(x) for x in (f.genre_ids or '').split(',') if x],
-                "keyword_ids": [],
-                "director_ids": [],
-                "collection_id": None,
-                "vote_average": 0.0,
-                "vote_count": 0,
-            }
-        favs.append(enriched)
+            payload = await _compute_recommendations(user_id, fav_rows, ranking, use_global)
+        except Exception as exc:
+            # El estado ya es 200: el fallo va en su propia línea para que el cliente
+            # no tome el ranking provisional por definitivo
+            detail = "TMDb no disponible temporalmente" if isinstance(exc, TMDbUnavailable) else "No se pudo recomendar"
+            yield line("error", {"detail": detail})
+            return
+        version = await run_in_threadpool(_reco_version, user_id, use_global)
+        reco_cache.put(user_id, reco_key(fav_ids, version, *ranking.values()), payload)
+        yield line("final", payload)
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+async def _timed(stage: str, fn, *args):
+    with STAGE_SECONDS.time(stage=stage):
+        return await fn(*args)
+
+def _prefilter(favs: list[dict], candidates: list[dict], n: int) -> list[dict]:
+    if len(candidates) <= n:
+        return candidates
+    scores = cosine_scores(favs, candidates) + PREFILTER_RATING_WEIGHT * blend_scores(
+        candidates, np.zeros(len(candidates)), 0.0, MIN_VOTE_COUNT_FOR_RATING)
+    return [candidates[i] for i in top_order(scores, n)[:n]]
+
+async def _compute_recommendations(user_id: str, fav_rows: list[Favorite], ranking: dict,
+                                   use_global: bool = False) -> dict:
+    # Enriquecer favoritos (géneros + keywords + directores + colección + voto);
+    # pasan antes que las candidatas en el limitador de TMDb (salvo en tareas de fondo)
+    with priority(HIGH if current_priority() == NORMAL else current_priority()), \
+            STAGE_SECONDS.time(stage="favorites_enrich"):
+        enriched = await enrich_many([f.movie_id for f in fav_rows])
+    favs = [e if e is not None else fallback_favorite(f) for f, e in zip(fav_rows, enriched)]
 
     # Señales del usuario
     genre_counts = Counter(g for m in favs for g in (m.get("genre_ids") or []))
@@ -235,46 +695,54 @@ async def recommendations(user_id: str, db: Session = Depends(get_db)):
     top_directors = [d for d, _ in director_counts.most_common(3)]
     top_collections = list(dict.fromkeys(collections))  # orden estable sin duplicados
 
-    # Candidatas (colección > director > keywords > género) con límite por saga
-    candidates = []
     fav_ids_set = {f.movie_id for f in fav_rows}
 
-    # Colecciones: mejor valoradas y límite por saga
-    for cid in top_collections:
-        coll = collection_movies(cid)
-        coll = [m for m in coll if m["id"] not in fav_ids_set]
-        coll = sorted(
-            coll,
-            key=lambda m: ((m.get("vote_average") or 0.0), (m.get("vote_count") or 0)),
-            reverse=True
-        )
-        candidates.extend(coll[:MAX_PER_COLLECTION_CANDIDATES])
-
-    # Directores
-    for d in top_directors:
-        movies = person_directed_movies(d)
-        movies = [m for m in movies if m["id"] not in fav_ids_set]
-        candidates.extend(movies)
-
-    # Keywords
-    if top_keywords:
-        for p in (1, 2):
-            kws = discover_by_keywords(top_keywords, page=p)
-            kws = [m for m in kws if m["id"] not in fav_ids_set]
-            candidates.extend(kws)
-
-    # Géneros
-    if top_genres:
-        for p in (1, 2):
-            gens = discover_by_genres(top_genres, page=p)
-            gens = [m for m in gens if m["id"] not in fav_ids_set]
-            candidates.extend(gens)
-
-    if not candidates:
-        candidates.extend(popular_movies())
-
-    # Deduplicar
-    seen = set()
+    # Candidatas locales: índice invertido sobre el catálogo (sin red, ya enriquecidas)
+    with STAGE_SECONDS.time(stage="candidates_local"):
+        local_ids = await run_in_threadpool(candidate_index.candidates, user_feature_weights(favs),
+                                            exclude=fav_ids_set, k=LOCAL_CANDIDATES)
+        local = await run_in_threadpool(load_movies, local_ids)
+    local_candidates = [local[i][0] for i in local_ids if i in local]
+
+    # Modo global: vecinos del usuario en el espacio de embeddings (catálogo primero)
+    if use_global:
+        with STAGE_SECONDS.time(stage="candidates_global"):
+            neighbor_ids = await run_in_threadpool(global_model.neighbors, list(fav_ids_set), LOCAL_CANDIDATES)
+            neighbor_ids = [i for i in neighbor_ids if i not in local]
+            local_candidates += [m for m in await enrich_many(neighbor_ids) if m is not None]
+
+    # Candidatas TMDb (colección > director > keywords > género) con límite por saga,
+    # solo mientras el catálogo local no dé suficientes
+    candidates = []
+    if len(local_candidates) < MIN_LOCAL_CANDIDATES:
+        # Todas las fuentes en paralelo; el orden de los resultados se conserva
+        calls = [(_timed, "candidates_collection", collection_movies, cid) for cid in top_collections]
+        n_collections = len(calls)
+        calls += [(_timed, "candidates_director", person_directed_movies, d) for d in top_directors]
+        if top_keywords:
+            calls += [(_timed, "candidates_keywords", discover_by_keywords, top_keywords, p) for p in (1, 2)]
+        if top_genres:
+            calls += [(_timed, "candidates_genres", discover_by_genres, top_genres, p) for p in (1, 2)]
+
+        for i, movies in enumerate(await fetch_many(calls)):
+            movies = [m for m in (movies or []) if m["id"] not in fav_ids_set]
+            if i < n_collections:
+                # Colecciones: mejor valoradas y límite por saga
+                movies = sorted(
+                    movies,
+                    key=lambda m: ((m.get("vote_average") or 0.0), (m.get("vote_count") or 0)),
+                    reverse=True
+                )
+                movies = movies[:MAX_PER_COLLECTION_CANDIDATES]
+            candidates.extend(movies)
+
+        if not candidates and not local_candidates:
+            # También vía fetch_many: si TMDb no responde, sin candidatas en vez de un 500
+            popular, = await fetch_many([(_timed, "candidates_popular", popular_movies)])
+            candidates.extend(popular or [])
+
+    # Deduplicar (las locales ya están enriquecidas)
+    seen = {c["id"] for c in local_candidates}
     unique = []
     for c in candidates:
         cid = c["id"]
@@ -283,59 +751,34 @@ async def recommendations(user_id: str, db: Session = Depends(get_db)):
         seen.add(cid)
         unique.append(c)
 
-    # Enriquecer un subconjunto de candidatas (para features y voto)
-    to_enrich = unique[:60]  # aumenta si quieres más señal
-    enriched_candidates = []
-    for c in to_enrich:
-        try:
-            e = movie_enriched(c["id"])
-            if e.get("vote_average") is None:
-                e["vote_average"] = c.get("vote_average", 0.0)
-            if e.get("vote_count") is None:
-                e["vote_count"] = c.get("vote_count", 0)
-            enriched_candidates.append(e)
-        except Exception:
-            enriched_candidates.append({
-                "id": c["id"],
-                "title": c.get("title"),
-                "poster_path": c.get("poster_path"),
-                "genre_ids": c.get("genre_ids", []),
-                "keyword_ids": [],
-                "director_ids": [],
-                "collection_id": None,
-                "vote_average": c.get("vote_average", 0.0),
-                "vote_count": c.get("vote_count", 0),
-            })
+    # Primer nivel barato: coseno de géneros + rating sobre todo el pool TMDb
+    # (solo datos de discover); solo el top-N se enriquece y pasa por el modelo
+    to_enrich = _prefilter(favs, unique, REMOTE_ENRICH_LIMIT)
+    enriched_candidates = list(local_candidates)
+    with STAGE_SECONDS.time(stage="candidates_enrich"):
+        enriched = await enrich_many([c["id"] for c in to_enrich])
+    for c, e in zip(to_enrich, enriched):
+        if e is None:
+            enriched_candidates.append(_fallback_candidate(c))
+            continue
+        if e.get("vote_average") is None:
+            e["vote_average"] = c.get("vote_average", 0.0)
+        if e.get("vote_count") is None:
+            e["vote_count"] = c.get("vote_count", 0)
+        enriched_candidates.append(e)
 
     # ML: entrenar si no hay modelo del usuario, luego puntuar candidatas
-    w, vocab = load_user_model(user_id)
-    if w is None or vocab is None:
-        train_user_model(user_id, positives=favs, negatives_pool=enriched_candidates)
-    ml_scores = score_movies_for_user(user_id, enriched_candidates)
+    # (en modo global: un producto matriz-vector con los embeddings compartidos)
+    if use_global:
+        with STAGE_SECONDS.time(stage="scoring"):
+            ml_scores = await run_in_threadpool(
+                global_model.score, list(fav_ids_set), [c["id"] for c in enriched_candidates])
+    else:
+        ml_scores = await run_in_threadpool(_ml_scores, user_id, favs, enriched_candidates)
     if not ml_scores or len(ml_scores) != len(enriched_candidates):
         ml_scores = [0.0] * len(enriched_candidates)
 
-    # Ranking: ML + boost por rating; diversidad por colección
-    scored = []
-    for c, ml in zip(enriched_candidates, ml_scores):
-        rating = float(c.get("vote_average") or 0.0)
-        votes = int(c.get("vote_count") or 0)
-        rating_norm = (rating / 10.0) if votes >= MIN_VOTE_COUNT_FOR_RATING else 0.0
-        final = ML_WEIGHT * ml + (1.0 - ML_WEIGHT) * rating_norm
-        scored.append((final, c))
-
-    scored.sort(key=lambda x: x[0], reverse=True)
-
-    per_collection = defaultdict(int)
-    top = []
-    for s, c in scored:
-        col = c.get("collection_id")
-        if col and per_collection[col] >= MAX_PER_COLLECTION_FINAL:
-            continue
-        if col:
-            per_collection[col] += 1
-        top.append(c)
-        if len(top) >= 20:
-            break
-
+    # Ranking: ML + boost por rating; diversidad por colección (ver ranking.py)
+    with STAGE_SECONDS.time(stage="ranking"):
+        top = rank(enriched_candidates, ml_scores, **ranking)
     return {"count": len(top), "results": top}
@@ -0,0 +1,8 @@
+"""
+Benchmarks reproducibles sin clave de TMDb (ver run.py y fake_tmdb.py).
+
+    cd backend
+    python -m bench.run                              # escenarios por defecto
+    python -m bench.run --out base.json              # guarda la línea base
+    python -m bench.run --baseline base.json         # compara con ella
+"""
@@ -0,0 +1,159 @@
+"""
+Sustituto local de TMDb para benchmarks: respuestas sintéticas pero deterministas
+(la misma película siempre tiene los mismos géneros, keywords, director...).
+
+    python -m bench.fake_tmdb --port 8765 --latency 40 --jitter 20 --error-rate 0.01
+
+La app lo usa con TMDB_BASE=http://127.0.0.1:8765 y cualquier TMDB_API_KEY.
+Latencia y errores se configuran por variables de entorno (las fija run.py):
+BENCH_TMDB_LATENCY_MS, BENCH_TMDB_JITTER_MS, BENCH_TMDB_ERROR_RATE (503),
+BENCH_TMDB_THROTTLE_RATE (429 con Retry-After) y BENCH_SEED.
+GET /__stats devuelve las peticiones recibidas por tipo de endpoint.
+"""
+import os
+import random
+import asyncio
+import argparse
+import zlib
+from collections import Counter
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+LATENCY_MS = float(os.getenv("BENCH_TMDB_LATENCY_MS", "40"))
+JITTER_MS = float(os.getenv("BENCH_TMDB_JITTER_MS", "20"))
+ERROR_RATE = float(os.getenv("BENCH_TMDB_ERROR_RATE", "0"))
+THROTTLE_RATE = float(os.getenv("BENCH_TMDB_THROTTLE_RATE", "0"))
+SEED = os.getenv("BENCH_SEED", "1")
+
+CATALOG_SIZE = 20_000
+PAGE_SIZE = 20
+GENRES = [28, 12, 16, 35, 80, 99, 18, 10751, 14, 36, 27, 10402, 9648, 10749, 878, 53, 10752, 37]
+WORDS = ["noche", "ciudad", "sombra", "regreso", "guerra", "verano", "último", "secreto",
+         "camino", "fuego", "silencio", "destino", "frontera", "memoria", "tormenta", "jardín"]
+
+app = FastAPI()
+calls = Counter()
+_faults = random.Random(f"{SEED}:faults")
+
+
+def _rng(kind: str, key) -> random.Random:
+    # Semilla de texto: determinista entre procesos (no depende de PYTHONHASHSEED)
+    return random.Random(f"{SEED}:{kind}:{key}")
+
+
+def movie(movie_id: int) -> dict:
+    r = _rng("movie", movie_id)
+    return {
+        "id": movie_id,
+        "title": " ".join(r.sample(WORDS, r.randint(1, 3))).capitalize() + f" {movie_id}",
+        "poster_path": f"/p{movie_id}.jpg",
+        "genre_ids": r.sample(GENRES, r.randint(1, 3)),
+        "vote_average": round(r.uniform(3, 9), 1),
+        "vote_count": int(r.paretovariate(1.2) * 50),
+        "popularity": round(r.uniform(1, 200), 2),
+    }
+
+
+def _page(kind: str, key, page: int) -> dict:
+    r = _rng(kind, f"{key}:{page}")
+    return {"page": page, "total_pages": 50,
+            "results": [movie(r.randrange(1, CATALOG_SIZE)) for _ in range(PAGE_SIZE)]}
+
+
+def _kind(path: str) -> str:
+    parts = path.strip("/").split("/")
+    if parts[0] == "movie" and len(parts) > 1 and not parts[1].isdigit():
+        return parts[1]  # popular, changes
+    return parts[0]
+
+
+@app.middleware("http")
+async def simulate(request: Request, call_next):
+    if request.url.path.startswith("/__"):
+        return await call_next(request)
+    calls[_kind(request.url.path)] += 1
+    await asyncio.sleep(max(0.0, LATENCY_MS + _faults.uniform(-JITTER_MS, JITTER_MS)) / 1000)
+    roll = _faults.random()
+    if roll < THROTTLE_RATE:
+        return JSONResponse({"status_code": 25}, status_code=429, headers={"Retry-After": "1"})
+    if roll < THROTTLE_RATE + ERROR_RATE:
+        return JSONResponse({"status_code": 11}, status_code=503)
+    return await call_next(request)
+
+
+@app.get("/__stats")
+def stats():
+    return dict(calls)
+
+
+@app.post("/__reset")
+def reset():
+    calls.clear()
+    return {"ok": True}
+
+
+@app.get("/search/movie")
+def search(query: str, page: int = 1):
+    return _page("search", query.casefold(), page)
+
+
+@app.get("/movie/popular")
+def popular(page: int = 1):
+    return _page("popular", "", page)
+
+
+@app.get("/movie/changes")
+def changes(page: int = 1, start_date: str = ""):
+    return {"page": page, "total_pages": 1, "results": []}
+
+
+@app.get("/movie/{movie_id}")
+def movie_details(movie_id: int):
+    m = movie(movie_id)
+    r = _rng("details", movie_id)
+    return {
+        **{k: v for k, v in m.items() if k != "genre_ids"},
+        "genres": [{"id": g} for g in m["genre_ids"]],
+        "keywords": {"keywords": [{"id": r.randint(1, 300)} for _ in range(r.randint(2, 8))]},
+        "credits": {"crew": [{"id": 10_000 + r.randrange(400), "job": "Director"},
+                             {"id": 20_000 + r.randrange(400), "job": "Writer"}]},
+        "belongs_to_collection": {"id": 1_000 + movie_id % 500} if movie_id % 4 == 0 else None,
+    }
+
+
+@app.get("/discover/movie")
+def discover(page: int = 1, with_genres: str = "", with_keywords: str = ""):
+    return _page("discover", zlib.crc32(f"{with_genres}|{with_keywords}".encode()), page)
+
+
+@app.get("/collection/{collection_id}")
+def collection(collection_id: int):
+    base = (collection_id - 1_000) or 500
+    return {"id": collection_id, "parts": [movie(base + 500 * i) for i in range(4) if base + 500 * i < CATALOG_SIZE]}
+
+
+@app.get("/person/{person_id}/movie_credits")
+def person(person_id: int):
+    r = _rng("person", person_id)
+    return {"crew": [{**movie(r.randrange(1, CATALOG_SIZE)), "job": "Director"} for _ in range(r.randint(3, 10))]}
+
+
+def main(argv=None) -> None:
+    global LATENCY_MS, JITTER_MS, ERROR_RATE, THROTTLE_RATE
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="TMDb falso para benchmarks")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=LATENCY_MS, help="ms de latencia media")
+    parser.add_argument("--jitter", type=float, default=JITTER_MS, help="± ms de variación")
+    parser.add_argument("--error-rate", type=float, default=ERROR_RATE, help="fracción de respuestas 503")
+    parser.add_argument("--throttle-rate", type=float, default=THROTTLE_RATE, help="fracción de respuestas 429")
+    args = parser.parse_args(argv)
+    LATENCY_MS, JITTER_MS = args.latency, args.jitter
+    ERROR_RATE, THROTTLE_RATE = args.error_rate, args.throttle_rate
+    uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+"""
+Benchmark de la API contra el TMDb falso (fake_tmdb.py), sin red ni clave.
+
+    python -m bench.run [--users 20] [--requests 200] [--concurrency 16]
+                        [--latency 40] [--error-rate 0.01] [--out res.json] [--baseline base.json]
+
+Arranca el TMDb falso y la app (uvicorn) como subprocesos, la app en un
+directorio temporal (movies.db, tmdb_cache.db y models/ vacíos: siempre se
+parte del mismo estado), y lanza los escenarios en orden:
+
+  favorites             POST /favorites (incluye los reentrenos en segundo plano
+                        en las peticiones a TMDb)
+  search                GET /search con consultas variadas
+  recommendations_cold  GET /recommendations con la caché de recomendaciones fría
+  recommendations       GET /recommendations repetido (aciertos de caché)
+
+Por escenario: latencias p50/p95/p99, peticiones/s, errores y peticiones a TMDb
+por tipo de endpoint. Con --baseline se muestra la variación respecto a otra ejecución.
+"""
+import os
+import sys
+import json
+import time
+import random
+import socket
+import asyncio
+import argparse
+import tempfile
+import subprocess
+
+import httpx
+import numpy as np
+
+from bench.fake_tmdb import WORDS
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCENARIOS = ["favorites", "search", "recommendations_cold", "recommendations"]
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _spawn(target: str, port: int, cwd: str, env: dict, workers: int = 1) -> subprocess.Popen:
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", target, "--app-dir", BACKEND_DIR, "--host", "127.0.0.1",
+         "--port", str(port), "--workers", str(workers), "--log-level", "warning"],
+        cwd=cwd, env={**os.environ, **env})
+
+
+async def _wait_ready(http: httpx.AsyncClient, url: str, proc: subprocess.Popen, timeout: float = 60) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"{url}: el proceso terminó con código {proc.returncode}")
+        try:
+            if (await http.get(url)).status_code < 500:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError(f"{url}: no responde tras {timeout}s")
+
+
+# ---------- Carga ----------
+
+async def _drive(http: httpx.AsyncClient, requests: list[tuple], concurrency: int) -> dict:
+    """Lanza [(método, url, kwargs)] con `concurrency` clientes a la vez."""
+    latencies, errors = [], 0
+    queue = list(reversed(requests))
+
+    async def worker():
+        nonlocal errors
+        while queue:
+            method, url, kwargs = queue.pop()
+            t0 = time.perf_counter()
+            try:
+                r = await http.request(method, url, **kwargs)
+                ok = r.status_code < 400
+            except httpx.HTTPError:
+                ok = False
+            latencies.append(time.perf_counter() - t0)
+            errors += not ok
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(max(1, concurrency))))
+    elapsed = time.perf_counter() - t0
+    ms = np.array(latencies) * 1000
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "p50_ms": round(float(np.percentile(ms, 50)), 2) if len(ms) else None,
+        "p95_ms": round(float(np.percentile(ms, 95)), 2) if len(ms) else None,
+        "p99_ms": round(float(np.percentile(ms, 99)), 2) if len(ms) else None,
+        "rps": round(len(latencies) / elapsed, 1) if elapsed > 0 else None,
+        "seconds": round(elapsed, 3),
+    }
+
+
+async def _upstream(http: httpx.AsyncClient, tmdb_url: str) -> dict:
+    return (await http.get(f"{tmdb_url}/__stats")).json()
+
+
+async def _wait_training(http: httpx.AsyncClient, api: str, users: list[str], timeout: float = 300) -> None:
+    deadline = time.monotonic() + timeout
+    pending = set(users)
+    while pending and time.monotonic() < deadline:
+        for u in list(pending):
+            st = (await http.get(f"{api}/training/status", params={"user_id": u})).json()
+            if st.get("state") not in ("queued", "running"):
+                pending.discard(u)
+        if pending:
+            await asyncio.sleep(0.2)
+
+
+def _workload(args) -> dict:
+    """Peticiones de cada escenario; deterministas para una misma semilla."""
+    rng = random.Random(args.seed)
+    users = [f"bench-{i}" for i in range(args.users)]
+    favorites = []
+    for u in users:
+        for movie_id in rng.sample(range(1, 20_000), args.favorites):
+            # Sin genre_ids: la app los pide a TMDb como cuando el cliente no los envía
+            favorites.append(("POST", "/favorites", {"json": {"user_id": u, "movie": {"id": movie_id, "title": f"Película {movie_id}"}}}))
+    rng.shuffle(favorites)
+    queries = [" ".join(rng.sample(WORDS, rng.randint(1, 2))) for _ in range(max(1, args.requests // 4))]
+    return {
+        "users": users,
+        "favorites": favorites,
+        "search": [("GET", "/search", {"params": {"q": rng.choice(queries)}}) for _ in range(args.requests)],
+        # k distinto del de la precarga tras reentrenar: la caché de recomendaciones no acierta
+        "recommendations_cold": [("GET", "/recommendations", {"params": {"user_id": u, "k": 25}}) for u in users],
+        "recommendations": [("GET", "/recommendations", {"params": {"user_id": rng.choice(users)}})
+                            for _ in range(args.requests)],
+    }
+
+
+async def _bench(args, api: str, tmdb_url: str) -> dict:
+    work = _workload(args)
+    results = {}
+    async with httpx.AsyncClient(base_url=api, timeout=args.timeout) as http:
+        for name in args.scenarios:
+            before = await _upstream(http, tmdb_url)
+            stats = await _drive(http, work[name], args.concurrency)
+            if name == "favorites":
+                await _wait_training(http, api, work["users"])
+            after = await _upstream(http, tmdb_url)
+            stats["upstream"] = {k: after[k] - before.get(k, 0) for k in sorted(after) if after[k] != before.get(k, 0)}
+            results[name] = stats
+            _print_row(name, stats)
+        results["_health"] = (await http.get("/health")).json()
+    return results
+
+
+# ---------- Informe ----------
+
+_HEADER = f"{'escenario':<22}{'n':>6}{'err':>5}{'p50':>9}{'p95':>9}{'p99':>9}{'req/s':>9}  TMDb"
+
+
+def _print_row(name: str, s: dict) -> None:
+    upstream = " ".join(f"{k}={v}" for k, v in s["upstream"].items()) or "-"
+    print(f"{name:<22}{s['requests']:>6}{s['errors']:>5}{s['p50_ms']:>9}{s['p95_ms']:>9}{s['p99_ms']:>9}"
+          f"{s['rps']:>9}  {upstream}", flush=True)
+
+
+def _delta(new, old) -> str:
+    if not old or new is None:
+        return "-"
+    return f"{(new - old) / old * 100:+.0f}%"
+
+
+def compare(results: dict, baseline: dict) -> None:
+    print(f"\nFrente a la línea base ({baseline.get('config', {}).get('started', '?')}):")
+    print(f"{'escenario':<22}{'p50':>8}{'p95':>8}{'p99':>8}{'req/s':>8}{'TMDb':>8}")
+    for name, s in results["results"].items():
+        b = baseline.get("results", {}).get(name)
+        if name.startswith("_") or b is None:
+            continue
+        up, up_b = sum(s["upstream"].values()), sum(b["upstream"].values())
+        print(f"{name:<22}" + "".join(f"{_delta(s[k], b[k]):>8}" for k in ("p50_ms", "p95_ms", "p99_ms", "rps"))
+              + f"{_delta(up, up_b):>8}")
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Benchmark de la API con un TMDb falso")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--favorites", type=int, default=6, help="favoritos por usuario")
+    parser.add_argument("--requests", type=int, default=200, help="peticiones de search y recommendations")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--workers", type=int, default=1, help="workers de uvicorn para la app")
+    parser.add_argument("--latency", type=float, default=40, help="ms de latencia media de TMDb")
+    parser.add_argument("--jitter", type=float, default=20)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fracción de 503 de TMDb")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="fracción de 429 de TMDb")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--scenarios", nargs="*", default=SCENARIOS, choices=SCENARIOS)
+    parser.add_argument("--out", help="guarda los resultados en JSON")
+    parser.add_argument("--baseline", help="JSON de una ejecución anterior para comparar")
+    args = parser.parse_args(argv)
+
+    tmdb_port, api_port = _free_port(), _free_port()
+    tmdb_url, api = f"http://127.0.0.1:{tmdb_port}", f"http://127.0.0.1:{api_port}"
+    with tempfile.TemporaryDirectory(prefix="bench-") as workdir:
+        fake = _spawn("bench.fake_tmdb:app", tmdb_port, workdir, {
+            "BENCH_TMDB_LATENCY_MS": str(args.latency), "BENCH_TMDB_JITTER_MS": str(args.jitter),
+            "BENCH_TMDB_ERROR_RATE": str(args.error_rate), "BENCH_TMDB_THROTTLE_RATE": str(args.throttle_rate),
+            "BENCH_SEED": str(args.seed)})
+        server = _spawn("app:app", api_port, workdir, {"TMDB_BASE": tmdb_url, "TMDB_API_KEY": "bench"},
+                        workers=args.workers)
+        try:
+            async def run():
+                async with httpx.AsyncClient() as http:
+                    await _wait_ready(http, f"{tmdb_url}/__stats", fake)
+                    await _wait_ready(http, f"{api}/health", server)
+                print(_HEADER)
+                return await _bench(args, api, tmdb_url)
+            results = asyncio.run(run())
+        finally:
+            for proc in (server, fake):
+                proc.terminate()
+            for proc in (server, fake):
+                proc.wait(timeout=30)
+
+    config = {k: v for k, v in vars(args).items() if k not in ("out", "baseline")}
+    config["started"] = time.strftime("%Y-%m-%d %H:%M:%S")
+    output = {"config": config, "results": results}
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(output, f, indent=2, ensure_ascii=False)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            compare(output, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
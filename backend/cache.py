@@ -0,0 +1,162 @@
+import os
+import copy
+import json
+import time
+import asyncio
+import sqlite3
+import threading
+from collections import OrderedDict
+from functools import wraps
+
+from metrics import Counter
+
+# Caché de metadatos TMDb: LRU en memoria delante de un almacén SQLite en disco.
+# Cada tipo de endpoint tiene su propio TTL: los detalles de película y las
+# colecciones casi no cambian; discover/populares cambian a menudo.
+# Las entradas caducadas siguen en disco hasta la purga: si TMDb falla (o el
+# circuit breaker está abierto) se sirven caducadas antes que devolver un error.
+
+CACHE_PATH = os.getenv("TMDB_CACHE_PATH", "tmdb_cache.db")
+CACHE_MEMORY_ITEMS = int(os.getenv("TMDB_CACHE_MEMORY_ITEMS", "5000"))
+
+TTL_SECONDS = {
+    "movie": 7 * 24 * 3600,
+    "collection": 7 * 24 * 3600,
+    "person": 3 * 24 * 3600,
+    "search": 24 * 3600,
+    "discover": 6 * 3600,
+    "popular": 6 * 3600,
+}
+
+PURGE_EVERY_N_SETS = 1000
+
+_MISS = object()
+
+CACHE_REQUESTS = Counter("tmdb_cache_requests_total",
+                         "Consultas a la caché de TMDb (hit, miss, stale = caducada servida por fallo de TMDb)",
+                         ("fetcher", "result"))
+
+
+class TTLCache:
+    """LRU en memoria + SQLite en disco, ambos con expiración por entrada."""
+
+    def __init__(self, path: str = CACHE_PATH, max_items: int = CACHE_MEMORY_ITEMS):
+        self.max_items = max_items
+        self._mem = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()      # LRU en memoria
+        self._db_lock = threading.Lock()   # conexión SQLite: un acierto en memoria no espera al disco
+        self._sets = 0
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            " key TEXT PRIMARY KEY,"
+            " value TEXT NOT NULL,"
+            " expires_at REAL NOT NULL)"
+        )
+
+    def get_memory(self, key: str, default=None, allow_stale: bool = False):
+        """Solo el LRU en memoria: sin E/S, se puede llamar desde el event loop."""
+        now = float("-inf") if allow_stale else time.time()
+        with self._lock:
+            item = self._mem.get(key)
+            if item is None:
+                return default
+            expires_at, value = item
+            if expires_at <= now:
+                del self._mem[key]
+                return default
+            self._mem.move_to_end(key)
+        return copy.deepcopy(value)
+
+    def get(self, key: str, default=None, allow_stale: bool = False):
+        value = self.get_memory(key, _MISS, allow_stale)
+        if value is not _MISS:
+            return value
+        with self._db_lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM cache WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None or (not allow_stale and row[1] <= time.time()):
+            return default
+        value = json.loads(row[0])
+        with self._lock:
+            self._remember(key, row[1], value)
+        return copy.deepcopy(value)
+
+    def set(self, key: str, value, ttl: float) -> None:
+        expires_at = time.time() + ttl
+        payload = json.dumps(value)
+        with self._lock:
+            self._remember(key, expires_at, copy.deepcopy(value))
+        with self._db_lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, payload, expires_at),
+            )
+            self._sets += 1
+            if self._sets % PURGE_EVERY_N_SETS == 0:
+                self._conn.execute("DELETE FROM cache WHERE expires_at <= ?", (time.time(),))
+
+    def clear(self) -> None:
+        with self._lock, self._db_lock:
+            self._mem.clear()
+            self._conn.execute("DELETE FROM cache")
+
+    def _remember(self, key, expires_at, value):
+        self._mem[key] = (expires_at, value)
+        self._mem.move_to_end(key)
+        while len(self._mem) > self.max_items:
+            self._mem.popitem(last=False)
+
+
+tmdb_cache = TTLCache()
+
+
+def cached(kind: str, namespace: str = ""):
+    """Decorador: cachea el resultado de un fetcher TMDb async según sus argumentos.
+    fn.refresh(*args) ignora la caché, vuelve a pedir el dato y lo guarda.
+    Los aciertos en memoria se sirven en el propio event loop; lo que toca
+    SQLite (fallo de memoria, escritura, caducada) va a un hilo."""
+    ttl = TTL_SECONDS[kind]
+
+    def decorator(fn):
+        def make_key(args, kwargs):
+            return f"{namespace}:{fn.__name__}:{json.dumps([args, kwargs], sort_keys=True)}"
+
+        async def stale(key, exc):
+            value = await asyncio.to_thread(tmdb_cache.get, key, _MISS, True)
+            if value is _MISS:
+                raise exc
+            CACHE_REQUESTS.inc(fetcher=fn.__name__, result="stale")
+            return value
+
+        async def lookup(key):
+            hit = tmdb_cache.get_memory(key, _MISS)
+            if hit is _MISS:
+                hit = await asyncio.to_thread(tmdb_cache.get, key, _MISS)
+            CACHE_REQUESTS.inc(fetcher=fn.__name__, result="miss" if hit is _MISS else "hit")
+            return hit
+
+        @wraps(fn)
+        async def wrapper(*args, **kwargs):
+            key = make_key(args, kwargs)
+            hit = await lookup(key)
+            if hit is not _MISS:
+                return hit
+            try:
+                value = await fn(*args, **kwargs)
+            except Exception as exc:
+                return await stale(key, exc)
+            await asyncio.to_thread(tmdb_cache.set, key, value, ttl)
+            return value
+
+        async def refresh(*args, **kwargs):
+            value = await fn(*args, **kwargs)
+            await asyncio.to_thread(tmdb_cache.set, make_key(args, kwargs), value, ttl)
+            return value
+
+        wrapper.refresh = refresh
+        return wrapper
+    return decorator
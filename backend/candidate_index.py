@@ -0,0 +1,167 @@
+import threading
+
+import numpy as np
+from sqlalchemy import select
+
+from database import SessionLocal
+from models import CatalogMovie, MovieGenre, MovieKeyword, MovieDirector
+
+# Índice invertido en memoria sobre el catálogo local:
+#   ("g", género) / ("k", keyword) / ("d", director) / ("c", colección) -> posiciones de películas
+# La generación de candidatas es una unión ponderada de listas de posting y un
+# top-k con argpartition, sin llamadas a TMDb.
+
+# Peso de cada tipo de señal (mismo orden de prioridad que las fuentes TMDb:
+# colección > director > keywords > género)
+KIND_WEIGHTS = {"c": 4.0, "d": 3.0, "k": 2.0, "g": 1.0}
+POPULARITY_WEIGHT = 0.5  # desempate por nº de votos (log), siempre < 1 señal
+
+
+def _features(m: dict) -> set[tuple[str, int]]:
+    feats = {("g", g) for g in m.get("genre_ids") or []}
+    feats |= {("k", k) for k in m.get("keyword_ids") or []}
+    feats |= {("d", d) for d in m.get("director_ids") or []}
+    if m.get("collection_id"):
+        feats.add(("c", m["collection_id"]))
+    return feats
+
+
+class CandidateIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pos = {}          # movie_id -> posición
+        self._ids = []          # posición -> movie_id
+        self._votes = []        # posición -> vote_count
+        self._features = []     # posición -> set de features
+        self._postings = {}     # feature -> set de posiciones
+        self._frozen = {}       # feature -> np.ndarray (caché de _postings)
+        self._arrays = None     # (ids, popularidad) como arrays
+        self._version = 0       # cambia con cada escritura; invalida lo calculado fuera del lock
+        self.ready = False
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def add_many(self, movies: list[dict]) -> None:
+        """Añade o actualiza películas (formato movie_enriched)."""
+        items = [(m["id"], _features(m), int(m.get("vote_count") or 0)) for m in movies]
+        with self._lock:
+            for mid, feats, votes in items:
+                self._apply(mid, feats, votes)
+            self._arrays = None
+            self._version += 1
+
+    def _apply(self, mid: int, feats: set, votes: int) -> None:
+        pos = self._pos.get(mid)
+        if pos is None:
+            pos = len(self._ids)
+            self._pos[mid] = pos
+            self._ids.append(mid)
+            self._votes.append(0)
+            self._features.append(set())
+        old = self._features[pos]
+        for f in old - feats:
+            self._postings[f].discard(pos)
+            self._frozen.pop(f, None)
+        for f in feats - old:
+            self._postings.setdefault(f, set()).add(pos)
+            self._frozen.pop(f, None)
+        self._features[pos] = feats
+        self._votes[pos] = votes
+
+    def build_from_db(self) -> None:
+        """Carga el catálogo completo con consultas planas (sin ORM por fila).
+
+        Se construye un índice aparte y se cambia de una vez: las consultas no esperan
+        a la carga, y lo añadido mientras tanto (más reciente) se vuelve a aplicar.
+        """
+        db = SessionLocal()
+        try:
+            movies = {}
+            for mid, coll, votes in db.execute(
+                    select(CatalogMovie.id, CatalogMovie.collection_id, CatalogMovie.vote_count)):
+                movies[mid] = {"id": mid, "collection_id": coll, "vote_count": votes,
+                               "genre_ids": [], "keyword_ids": [], "director_ids": []}
+            for model, col, key in ((MovieGenre, MovieGenre.genre_id, "genre_ids"),
+                                    (MovieKeyword, MovieKeyword.keyword_id, "keyword_ids"),
+                                    (MovieDirector, MovieDirector.person_id, "director_ids")):
+                for mid, value in db.execute(select(model.movie_id, col)):
+                    if mid in movies:
+                        movies[mid][key].append(value)
+        finally:
+            db.close()
+        fresh = CandidateIndex()
+        fresh.add_many(list(movies.values()))
+        with self._lock:
+            for pos, mid in enumerate(self._ids):
+                fresh._apply(mid, self._features[pos], self._votes[pos])
+            self._pos, self._ids, self._votes = fresh._pos, fresh._ids, fresh._votes
+            self._features, self._postings = fresh._features, fresh._postings
+            self._frozen, self._arrays = {}, None
+            self._version += 1
+        self.ready = True
+
+    def candidates(self, weights: dict[tuple[str, int], float], exclude: set[int], k: int) -> list[int]:
+        """Top-k ids por suma ponderada de features compartidas (+ desempate por votos)."""
+        # Bajo el lock solo se copian referencias y conjuntos; los arrays se montan fuera
+        with self._lock:
+            n = len(self._ids)
+            if n == 0 or not weights:
+                return []
+            version, arrays = self._version, self._arrays
+            if arrays is None:
+                ids, votes = self._ids[:], self._votes[:]
+            posts = {f: self._frozen.get(f) for f in weights}
+            raw = {f: set(self._postings.get(f, ())) for f, arr in posts.items() if arr is None}
+            excluded = [self._pos[mid] for mid in exclude if mid in self._pos]
+
+        if arrays is None:
+            votes = np.log1p(np.asarray(votes, dtype=np.float64))
+            top = votes.max() or 1.0
+            arrays = (np.asarray(ids, dtype=np.int64), POPULARITY_WEIGHT * votes / top)
+        for f, members in raw.items():
+            posts[f] = np.fromiter(members, dtype=np.int64, count=len(members))
+        with self._lock:
+            if self._version == version:  # nada ha cambiado: se guarda para la siguiente
+                self._arrays = arrays
+                for f in raw:
+                    self._frozen[f] = posts[f]
+
+        ids, popularity = arrays
+        scores = np.zeros(n)
+        for feature, w in weights.items():
+            post = posts[feature]
+            if post.size:
+                scores[post] += w
+        scores[excluded] = 0.0
+
+        hits = np.flatnonzero(scores > 0)
+        if hits.size == 0:
+            return []
+        scores = scores[hits] + popularity[hits]
+        if hits.size > k:
+            part = np.argpartition(-scores, k - 1)[:k]
+            hits, scores = hits[part], scores[part]
+        order = np.argsort(-scores, kind="stable")
+        return ids[hits[order]].tolist()
+
+
+def user_feature_weights(favs: list[dict],
+                         top_genres: int = 3,
+                         top_keywords: int = 10,
+                         top_directors: int = 5) -> dict[tuple[str, int], float]:
+    """Pesos de consulta: frecuencia de cada señal en los favoritos × peso de su tipo."""
+    counts = {}
+    for m in favs:
+        for f in _features(m):
+            counts[f] = counts.get(f, 0) + 1
+    limits = {"g": top_genres, "k": top_keywords, "d": top_directors, "c": None}
+    weights = {}
+    for kind, limit in limits.items():
+        ranked = sorted(((c, f) for f, c in counts.items() if f[0] == kind), reverse=True)
+        for c, f in ranked[:limit]:
+            weights[f] = KIND_WEIGHTS[kind] * c
+    return weights
+
+
+index = CandidateIndex()
@@ -0,0 +1,248 @@
+import os
+import time
+import logging
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import select, delete
+
+from database import SessionLocal, dialect_insert
+from models import CatalogMovie, MovieGenre, MovieKeyword, MovieDirector, SyncState, Favorite
+from tmdb import movie_enriched_many, movie_changes, popular_movies, discover_recent, fetch_many
+from candidate_index import index
+from title_index import index as title_index
+
+# Catálogo local de películas (tablas catalog_movies + movie_genres/keywords/directors).
+# Se rellena perezosamente con los resultados de movie_enriched y lo refresca
+# sync() (ver sync_catalog.py). El enriquecimiento lee primero de aquí: si TMDb
+# falla, una película ya conocida conserva keywords, directores y colección.
+
+log = logging.getLogger(__name__)
+
+CATALOG_MAX_AGE = float(os.getenv("CATALOG_MAX_AGE", str(7 * 24 * 3600)))
+SQL_CHUNK = 500           # ids por cláusula IN (límite de variables de SQLite)
+MAX_CHANGE_PAGES = 50     # páginas de /movie/changes por sincronización
+CHANGES_WINDOW_DAYS = 14  # TMDb no admite rangos mayores
+# Películas nuevas: sin esto el catálogo solo crece con lo que piden los usuarios y,
+# con suficientes candidatas locales, /recommendations deja de consultar TMDb
+NEW_TITLE_PAGES = int(os.getenv("CATALOG_NEW_TITLE_PAGES", "5"))  # páginas de populares y de estrenos
+NEW_RELEASE_DAYS = 90
+
+# Tablas hijas: (modelo, columna, clave en el dict de película)
+_CHILDREN = ((MovieGenre, MovieGenre.genre_id, "genre_ids"),
+             (MovieKeyword, MovieKeyword.keyword_id, "keyword_ids"),
+             (MovieDirector, MovieDirector.person_id, "director_ids"))
+
+
+def _chunks(ids: list[int]):
+    for i in range(0, len(ids), SQL_CHUNK):
+        yield ids[i:i + SQL_CHUNK]
+
+
+def minimal_movie(movie_id: int, title, poster_path, genre_ids,
+                  vote_average: float = 0.0, vote_count: int = 0) -> dict:
+    """Película en formato movie_enriched solo con lo ya conocido (no está en el catálogo y TMDb falla)."""
+    return {
+        "id": movie_id,
+        "title": title,
+        "poster_path": poster_path,
+        "genre_ids": genre_ids,
+        "keyword_ids": [],
+        "director_ids": [],
+        "collection_id": None,
+        "vote_average": vote_average,
+        "vote_count": vote_count,
+    }
+
+
+def fallback_favorite(f: Favorite) -> dict:
+    return minimal_movie(f.movie_id, f.movie_title, f.poster_path, f.genre_ids)
+
+
+def load_movies(ids: list[int], db=None) -> dict[int, tuple[dict, float]]:
+    """{id: (película, synced_at)} para los ids presentes en el catálogo."""
+    # Consultas planas (sin objetos ORM): es el camino caliente de /recommendations
+    own = db is None
+    db = db or SessionLocal()
+    try:
+        out = {}
+        for chunk in _chunks(list(dict.fromkeys(ids))):
+            movies = {}
+            for mid, title, poster, coll, avg, cnt, synced in db.execute(
+                    select(CatalogMovie.id, CatalogMovie.title, CatalogMovie.poster_path,
+                           CatalogMovie.collection_id, CatalogMovie.vote_average,
+                           CatalogMovie.vote_count, CatalogMovie.synced_at)
+                    .where(CatalogMovie.id.in_(chunk))):
+                movies[mid] = ({
+                    "id": mid,
+                    "title": title,
+                    "poster_path": poster,
+                    "genre_ids": [],
+                    "keyword_ids": [],
+                    "director_ids": [],
+                    "collection_id": coll,
+                    "vote_average": avg or 0.0,
+                    "vote_count": cnt or 0,
+                }, synced or 0.0)
+            for model, col, key in _CHILDREN:
+                for mid, value in db.execute(
+                        select(model.movie_id, col).where(model.movie_id.in_(chunk)).order_by(model.movie_id, col)):
+                    movies[mid][0][key].append(value)
+            out.update(movies)
+        return out
+    finally:
+        if own:
+            db.close()
+
+
+def store_movies(movies: list[dict]) -> None:
+    """Inserta o actualiza películas enriquecidas (formato movie_enriched).
+    Con ON CONFLICT: dos peticiones que guardan a la vez la misma película
+    nueva no chocan con la clave primaria."""
+    if not movies:
+        return
+    now = time.time()
+    by_id = {m["id"]: m for m in movies}
+    rows = [{"id": mid, "title": m.get("title"), "poster_path": m.get("poster_path"),
+             "collection_id": m.get("collection_id"), "vote_average": m.get("vote_average") or 0.0,
+             "vote_count": m.get("vote_count") or 0, "synced_at": now} for mid, m in by_id.items()]
+    upsert = dialect_insert(CatalogMovie)
+    upsert = upsert.on_conflict_do_update(
+        index_elements=["id"], set_={c: upsert.excluded[c] for c in rows[0] if c != "id"})
+    db = SessionLocal()
+    try:
+        db.execute(upsert, rows)
+        # Hijas: se borran solo las que sobran y se insertan las que faltan (sin tocar las iguales)
+        for model, col, key in _CHILDREN:
+            have = {}
+            for chunk in _chunks(list(by_id)):
+                for mid, value in db.execute(select(model.movie_id, col).where(model.movie_id.in_(chunk))):
+                    have.setdefault(mid, set()).add(value)
+            add = []
+            for mid, m in by_id.items():
+                new, old = set(m.get(key) or ()), have.get(mid, set())
+                if old - new:
+                    db.execute(delete(model).where(model.movie_id == mid, col.in_(old - new)))
+                add += [{"movie_id": mid, col.key: value} for value in new - old]
+            if add:
+                db.execute(dialect_insert(model).on_conflict_do_nothing(), add)
+        db.commit()
+    except BaseException:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+    index.add_many(list(by_id.values()))
+    title_index.add_many(list(by_id.values()))
+
+
+async def enrich_many(movie_ids: list[int], max_age: float = CATALOG_MAX_AGE) -> list:
+    """Como tmdb.movie_enriched_many, pero sirviendo desde el catálogo local.
+    Solo se pide a TMDb lo que falta o está caducado; si TMDb falla se usa la
+    copia local aunque esté caducada. None solo para películas nunca vistas."""
+    local = await asyncio.to_thread(load_movies, movie_ids)
+    now = time.time()
+    missing = [mid for mid in dict.fromkeys(movie_ids)
+               if mid not in local or now - local[mid][1] > max_age]
+    if missing:
+        fetched = [m for m in await movie_enriched_many(missing) if m is not None]
+        try:
+            await asyncio.to_thread(store_movies, fetched)
+        except Exception:
+            # Sin guardar en el catálogo la respuesta sigue valiendo: se sirve igual
+            log.exception("No se pudieron guardar %d películas en el catálogo", len(fetched))
+        for m in fetched:
+            local[m["id"]] = (m, now)
+    return [dict(local[mid][0]) if mid in local else None for mid in movie_ids]
+
+
+# ---------- Sincronización incremental ----------
+
+def _get_state(name: str):
+    db = SessionLocal()
+    try:
+        row = db.get(SyncState, name)
+        return row.value if row else None
+    finally:
+        db.close()
+
+
+def _set_state(name: str, value: str) -> None:
+    db = SessionLocal()
+    try:
+        db.merge(SyncState(name=name, value=value))
+        db.commit()
+    finally:
+        db.close()
+
+
+def _refresh_targets(changed: set[int], discovered: set[int], max_age: float, limit: int) -> list[int]:
+    """Prioridad: cambiadas en TMDb > favoritos aún no catalogados > populares/estrenos
+    nuevos > más antiguas."""
+    db = SessionLocal()
+    try:
+        known_changed = []
+        for chunk in _chunks(sorted(changed)):
+            known_changed += [r[0] for r in db.query(CatalogMovie.id).filter(CatalogMovie.id.in_(chunk))]
+        known = set()
+        for chunk in _chunks(sorted(discovered)):
+            known.update(r[0] for r in db.query(CatalogMovie.id).filter(CatalogMovie.id.in_(chunk)))
+        new_titles = sorted(discovered - known)
+        missing_favs = [r[0] for r in (
+            db.query(Favorite.movie_id).distinct()
+            .outerjoin(CatalogMovie, CatalogMovie.id == Favorite.movie_id)
+            .filter(CatalogMovie.id.is_(None))
+        )]
+        stale = [r[0] for r in (
+            db.query(CatalogMovie.id)
+            .filter(CatalogMovie.synced_at < time.time() - max_age)
+            .order_by(CatalogMovie.synced_at)
+            .limit(limit)
+        )]
+        return list(dict.fromkeys(known_changed + missing_favs + new_titles + stale))[:limit]
+    finally:
+        db.close()
+
+
+async def sync(max_age: float = CATALOG_MAX_AGE, limit: int = 5000, batch: int = 200) -> dict:
+    """Refresca el catálogo: películas cambiadas en TMDb desde la última
+    sincronización, favoritos sin catalogar, populares y estrenos que aún no
+    están y filas más antiguas que max_age."""
+    started = datetime.now(timezone.utc)
+    last = _get_state("catalog_changes")
+    oldest = started - timedelta(days=CHANGES_WINDOW_DAYS)
+    since = max(datetime.fromisoformat(last), oldest) if last else oldest
+
+    changed = set()
+    changes_ok = True
+    page, total_pages = 1, 1
+    while page <= min(total_pages, MAX_CHANGE_PAGES):
+        try:
+            ids, total_pages = await movie_changes(since.date().isoformat(), page=page)
+        except Exception:
+            changes_ok = False
+            break
+        changed.update(ids)
+        page += 1
+
+    # Títulos nuevos: páginas de populares y de estrenos recientes (solo los ids)
+    released_after = (started - timedelta(days=NEW_RELEASE_DAYS)).date().isoformat()
+    pages = range(1, NEW_TITLE_PAGES + 1)
+    discovered = set()
+    for movies in await fetch_many([(popular_movies, p) for p in pages] +
+                                   [(discover_recent, released_after, p) for p in pages]):
+        discovered.update(m["id"] for m in movies or [])
+
+    targets = await asyncio.to_thread(_refresh_targets, changed, discovered, max_age, limit)
+    refreshed = failed = 0
+    for i in range(0, len(targets), batch):
+        fetched = await movie_enriched_many(targets[i:i + batch], refresh=True)
+        ok = [m for m in fetched if m is not None]
+        await asyncio.to_thread(store_movies, ok)
+        refreshed += len(ok)
+        failed += len(fetched) - len(ok)
+
+    if changes_ok:
+        await asyncio.to_thread(_set_state, "catalog_changes", started.isoformat())
+    return {"changed_upstream": len(changed), "discovered": len(discovered),
+            "refreshed": refreshed, "failed": failed}
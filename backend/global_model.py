@@ -0,0 +1,177 @@
+"""
+Modelo global de embeddings de películas, aprendido de los favoritos de todos
+los usuarios (tabla favorites).
+
+    python global_model.py              # reentrena y guarda models/global_items.npy
+    python global_model.py --dim 32
+
+Factoriza la matriz usuarios x películas (binaria, filas normalizadas) con una
+SVD truncada aleatorizada; cada película es una fila de la matriz de
+embeddings y cada usuario, la media de los embeddings de sus favoritos.
+Puntuar candidatas es un producto matriz-vector. La matriz se abre con
+np.load(mmap_mode="r"): todos los workers comparten las páginas del fichero.
+"""
+import os
+import time
+import argparse
+import threading
+
+import numpy as np
+
+from database import SessionLocal
+from models import Favorite
+
+MODELS_DIR = "models"
+ITEMS_PATH = os.path.join(MODELS_DIR, "global_items.npy")  # float32 (películas x dim)
+IDS_PATH = os.path.join(MODELS_DIR, "global_ids.npy")      # int64 ordenado: fila -> movie_id
+GLOBAL_DIM = int(os.getenv("GLOBAL_MODEL_DIM", "64"))
+MIN_USERS = 2
+
+
+# ---------- Entrenamiento ----------
+
+def _xmul(rows, cols, vals, n_rows, M):
+    """X @ M con X dispersa dada por (rows, cols, vals)."""
+    out = np.zeros((n_rows, M.shape[1]))
+    np.add.at(out, rows, vals[:, None] * M[cols])
+    return out
+
+def _randomized_svd(rows, cols, vals, shape, dim, n_iter=4, oversample=10, seed=0):
+    """SVD truncada aleatorizada (Halko et al.) sin densificar X."""
+    n_users, n_items = shape
+    rng = np.random.default_rng(seed)
+    Q = _xmul(rows, cols, vals, n_users, rng.standard_normal((n_items, dim + oversample)))
+    Q, _ = np.linalg.qr(Q)
+    for _ in range(n_iter):
+        Z, _ = np.linalg.qr(_xmul(cols, rows, vals, n_items, Q))   # Xᵀ Q
+        Q, _ = np.linalg.qr(_xmul(rows, cols, vals, n_users, Z))   # X Z
+    B = _xmul(cols, rows, vals, n_items, Q).T                       # Qᵀ X
+    _, s, vt = np.linalg.svd(B, full_matrices=False)
+    return s[:dim], vt[:dim].T
+
+def _normalize_rows(M):
+    norms = np.linalg.norm(M, axis=1, keepdims=True)
+    return np.divide(M, norms, out=np.zeros_like(M), where=norms > 0)
+
+def train(pairs: list[tuple[str, int]], dim: int = GLOBAL_DIM, seed: int = 0) -> dict | None:
+    """Entrena con pares (user_id, movie_id) y guarda la matriz de forma atómica."""
+    t0 = time.perf_counter()
+    pairs = list(dict.fromkeys(pairs))
+    users = sorted({u for u, _ in pairs})
+    movie_ids = np.array(sorted({m for _, m in pairs}), dtype=np.int64)
+    if len(users) < MIN_USERS or len(movie_ids) < 2:
+        return None
+
+    user_pos = {u: i for i, u in enumerate(users)}
+    rows = np.fromiter((user_pos[u] for u, _ in pairs), np.int64, len(pairs))
+    cols = np.searchsorted(movie_ids, np.fromiter((m for _, m in pairs), np.int64, len(pairs)))
+    # Cada usuario pesa lo mismo aunque tenga muchos favoritos
+    vals = 1.0 / np.sqrt(np.bincount(rows, minlength=len(users)))[rows]
+
+    dim = max(1, min(dim, len(users), len(movie_ids) - 1))
+    s, v = _randomized_svd(rows, cols, vals, (len(users), len(movie_ids)), dim, seed=seed)
+    items = _normalize_rows(v * np.sqrt(s)).astype(np.float32)
+
+    os.makedirs(MODELS_DIR, exist_ok=True)
+    for path, arr in ((IDS_PATH, movie_ids), (ITEMS_PATH, items)):  # items al final: marca la versión
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            np.save(f, arr)
+        os.replace(tmp, path)
+    return {"users": len(users), "movies": len(movie_ids), "dim": dim,
+            "seconds": round(time.perf_counter() - t0, 3)}
+
+def train_from_db(dim: int = GLOBAL_DIM) -> dict | None:
+    db = SessionLocal()
+    try:
+        pairs = [(u, m) for u, m in db.query(Favorite.user_id, Favorite.movie_id)]
+    finally:
+        db.close()
+    return train(pairs, dim=dim)
+
+
+# ---------- Carga y puntuación ----------
+
+_lock = threading.Lock()
+_loaded = (None, None, None)  # (versión, ids, embeddings memmap)
+
+def version():
+    """Versión del modelo guardado (mtime en ns) o None si no existe."""
+    try:
+        return os.stat(ITEMS_PATH).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+def _model():
+    """(ids, embeddings) abiertos con mmap; se reabren si el fichero cambió."""
+    global _loaded
+    v = version()
+    if v is None:
+        return None, None
+    with _lock:
+        if _loaded[0] != v:
+            _loaded = (v, np.load(IDS_PATH), np.load(ITEMS_PATH, mmap_mode="r"))
+        return _loaded[1], _loaded[2]
+
+def available() -> bool:
+    return version() is not None
+
+def _positions(ids: np.ndarray, movie_ids) -> tuple[np.ndarray, np.ndarray]:
+    """(posición en la matriz, máscara de presentes) para cada movie_id."""
+    q = np.asarray(list(movie_ids), dtype=np.int64)
+    pos = np.minimum(np.searchsorted(ids, q), len(ids) - 1)
+    return pos, ids[pos] == q
+
+def user_vector(fav_ids) -> np.ndarray | None:
+    ids, emb = _model()
+    if ids is None:
+        return None
+    pos, found = _positions(ids, fav_ids)
+    if not found.any():
+        return None
+    u = np.asarray(emb[np.sort(pos[found])]).mean(axis=0)
+    norm = np.linalg.norm(u)
+    return u / norm if norm > 0 else None
+
+def score(fav_ids, movie_ids) -> list[float]:
+    """Similitud (coseno, recortada a ≥0) de cada película con el usuario; 0 si es desconocida."""
+    movie_ids = list(movie_ids)
+    u = user_vector(fav_ids)
+    if u is None or not movie_ids:
+        return [0.0] * len(movie_ids)
+    ids, emb = _model()
+    pos, found = _positions(ids, movie_ids)
+    out = np.zeros(len(movie_ids))
+    out[found] = np.asarray(emb[pos[found]]) @ u
+    return np.clip(out, 0.0, None).tolist()
+
+def neighbors(fav_ids, k: int) -> list[int]:
+    """Top-k películas del modelo más cercanas al usuario (sin sus favoritos)."""
+    u = user_vector(fav_ids)
+    if u is None:
+        return []
+    ids, emb = _model()
+    scores = np.asarray(emb @ u)
+    pos, found = _positions(ids, fav_ids)
+    scores[pos[found]] = -np.inf
+    k = min(k, int(np.isfinite(scores).sum()))
+    if k <= 0:
+        return []
+    top = np.argpartition(-scores, k - 1)[:k]
+    top = top[np.argsort(-scores[top], kind="stable")]
+    return ids[top[scores[top] > 0]].tolist()
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Entrena el modelo global de embeddings de películas")
+    parser.add_argument("--dim", type=int, default=GLOBAL_DIM)
+    args = parser.parse_args(argv)
+    info = train_from_db(dim=args.dim)
+    if info is None:
+        print(f"Se necesitan favoritos de al menos {MIN_USERS} usuarios")
+        return
+    print(f"{info['movies']} películas x {info['dim']} dims ({info['users']} usuarios) en {info['seconds']}s")
+
+
+if __name__ == "__main__":
+    main()
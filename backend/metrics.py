@@ -0,0 +1,148 @@
+import time
+import threading
+from bisect import bisect_left
+
+# Métricas en memoria con salida en formato de texto de Prometheus (GET /metrics).
+# Contadores e histogramas con etiquetas, más métricas "callback" que leen su
+# valor al exportar (estadísticas que ya llevan otros objetos, como el cliente
+# TMDb). Son por proceso: con varios workers de uvicorn, Prometheus ve cada uno
+# por separado.
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_metrics = {}   # nombre -> métrica, en orden de registro
+_lock = threading.Lock()
+
+
+def _register(metric):
+    with _lock:
+        _metrics[metric.name] = metric  # mismo nombre: sustituye (p. ej. al recargar el módulo)
+    return metric
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _number(v: float) -> str:
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}   # tupla de valores de etiquetas -> valor
+        self._lock = threading.Lock()
+        _register(self)
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def _header(self) -> list[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> list[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return self._header() + [f"{self.name}{_labels(self.labelnames, k)} {_number(v)}" for k, v in items]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            counts[0][i] += 1
+            counts[1] += value
+
+    def time(self, **labels) -> "_Timer":
+        """with hist.time(stage="x"): ... observa los segundos del bloque."""
+        return _Timer(self, labels)
+
+    def render(self) -> list[str]:
+        with self._lock:
+            items = sorted((k, (list(c), s)) for k, (c, s) in self._values.items())
+        lines = self._header()
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                cumulative += n
+                le = 'le="' + _number(bound) + '"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+class _Timer:
+    def __init__(self, histogram: Histogram, labels: dict):
+        self._histogram = histogram
+        self._labels = labels
+
+    def __enter__(self):
+        self._t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._histogram.observe(time.perf_counter() - self._t0, **self._labels)
+        return False
+
+
+class Callback(_Metric):
+    """Valor leído al exportar: fn() -> número o {tupla de etiquetas: número}."""
+
+    def __init__(self, name: str, help: str, fn, kind: str = "gauge", labelnames=()):
+        self.kind = kind
+        self._fn = fn
+        super().__init__(name, help, labelnames)
+
+    def render(self) -> list[str]:
+        try:
+            value = self._fn()
+        except Exception:
+            return []  # una estadística rota no debe tumbar /metrics
+        items = sorted(value.items()) if isinstance(value, dict) else [((), value)]
+        return self._header() + [f"{self.name}{_labels(self.labelnames, k)} {_number(v)}" for k, v in items]
+
+
+def render() -> str:
+    with _lock:
+        metrics = list(_metrics.values())
+    lines = []
+    for m in metrics:
+        lines += m.render()
+    return "\n".join(lines) + "\n"
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
@@ -0,0 +1,117 @@
+"""
+Migraciones del esquema de la base de datos (tabla schema_version).
+
+    python migrations.py            # aplica las pendientes
+    python migrations.py --status   # versión actual y pendientes
+
+Las tablas nuevas las crea Base.metadata.create_all; aquí solo van los cambios
+sobre tablas que ya existen. Una base de datos nueva nace con el esquema final
+y se marca directamente con la última versión. Se aplican dentro de un
+bloqueo (BEGIN IMMEDIATE en SQLite, advisory lock en PostgreSQL): con varios
+workers arrancando a la vez, solo uno migra.
+"""
+import argparse
+from contextlib import contextmanager
+
+from sqlalchemy import inspect, text
+
+import models  # registra las tablas en Base.metadata
+from database import Base, engine, IS_SQLITE
+
+_LOCK_ID = 720_531  # advisory lock de PostgreSQL
+
+
+def _favorite_genres(conn) -> None:
+    """favorites.genre_ids ("28,12") -> tabla favorite_genres."""
+    columns = {c["name"] for c in inspect(conn).get_columns("favorites")}
+    if "genre_ids" not in columns:
+        return
+    rows = conn.execute(text("SELECT id, genre_ids FROM favorites WHERE genre_ids IS NOT NULL AND genre_ids != ''"))
+    pairs = {(fid, int(g)) for fid, genres in rows for g in genres.split(",") if g.strip().isdigit()}
+    if pairs:
+        conn.execute(text("INSERT INTO favorite_genres (favorite_id, genre_id) VALUES (:f, :g)"),
+                     [{"f": f, "g": g} for f, g in sorted(pairs)])
+    conn.execute(text("ALTER TABLE favorites DROP COLUMN genre_ids"))
+
+
+def _drop_single_column_indexes(conn) -> None:
+    """user_id ya está cubierto por el índice único (user_id, movie_id); id es la clave primaria."""
+    for name in ("ix_favorites_user_id", "ix_favorites_id"):
+        conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
+
+
+# (versión, descripción, función). Solo se añaden al final.
+MIGRATIONS = [
+    (1, "géneros de favoritos normalizados (favorite_genres)", _favorite_genres),
+    (2, "índices redundantes de favorites", _drop_single_column_indexes),
+]
+HEAD = MIGRATIONS[-1][0]
+
+
+@contextmanager
+def _locked():
+    with engine.connect() as conn:
+        if IS_SQLITE:
+            conn.exec_driver_sql("BEGIN IMMEDIATE")
+        else:
+            conn.execute(text("SELECT pg_advisory_xact_lock(:id)"), {"id": _LOCK_ID})
+        try:
+            yield conn
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+
+
+def _version(conn) -> int:
+    conn.execute(text("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER PRIMARY KEY,"
+                      " description TEXT, applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)"))
+    return conn.execute(text("SELECT COALESCE(MAX(version), 0) FROM schema_version")).scalar()
+
+
+def _stamp(conn, version: int, description: str) -> None:
+    conn.execute(text("INSERT INTO schema_version (version, description) VALUES (:v, :d)"),
+                 {"v": version, "d": description})
+
+
+def upgrade() -> list[int]:
+    """Crea las tablas que falten y aplica las migraciones pendientes. Devuelve las aplicadas."""
+    applied = []
+    with _locked() as conn:
+        fresh = not inspect(conn).has_table("favorites")
+        current = _version(conn)
+        Base.metadata.create_all(bind=conn)
+        if fresh and current == 0:
+            for version, description, _ in MIGRATIONS:
+                _stamp(conn, version, description)
+            return applied
+        for version, description, fn in MIGRATIONS:
+            if version > current:
+                fn(conn)
+                _stamp(conn, version, description)
+                applied.append(version)
+    return applied
+
+
+def status() -> tuple[int, list[int]]:
+    with engine.connect() as conn:
+        if not inspect(conn).has_table("schema_version"):
+            return 0, [v for v, _, _ in MIGRATIONS]
+        current = conn.execute(text("SELECT COALESCE(MAX(version), 0) FROM schema_version")).scalar()
+    return current, [v for v, _, _ in MIGRATIONS if v > current]
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Migraciones del esquema")
+    parser.add_argument("--status", action="store_true", help="solo muestra la versión")
+    args = parser.parse_args(argv)
+    if args.status:
+        current, pending = status()
+        print(f"Versión {current}; pendientes: {pending or 'ninguna'}")
+        return
+    applied = upgrade()
+    print(f"Aplicadas: {applied or 'ninguna'} (versión {HEAD})")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,110 +1,193 @@
 # backend/ml.py
 import os
-import json
-import random
-from collections import Counter
+import time
+import zlib
+from itertools import chain
 import numpy as np
 
+from model_registry import ModelRegistry
+from model_store import store
+from tokenizer import movie_tokens
+from optim import OPTIMIZERS
+from metrics import Histogram, Callback
+
 MODELS_DIR = "models"
 os.makedirs(MODELS_DIR, exist_ok=True)
 
-# --- Tokenización (misma idea que en app.movie_tokens) ---
-def _movie_tokens(m: dict) -> set[str]:
-    toks = set()
-    for g in m.get("genre_ids") or []:
-        toks.add(f"g{g}")
-    for k in m.get("keyword_ids") or []:
-        toks.add(f"k{k}")
-    for d in m.get("director_ids") or []:
-        toks.add(f"d{d}")
-    cid = m.get("collection_id")
-    if cid:
-        toks.add(f"c{cid}")
-    title = (m.get("title") or "").lower()
-    for w in title.replace(":", " ").replace("-", " ").split():
-        if len(w) >= 5:
-            toks.add(f"t{w}")
-    return toks
-
-def _build_vocab(movies: list[dict], max_vocab: int = 2000) -> dict[str, int]:
-    cnt = Counter()
-    for m in movies:
-        cnt.update(_movie_tokens(m))
-    most = [t for t, _ in cnt.most_common(max_vocab)]
-    return {t: i for i, t in enumerate(most)}
-
-def _vectorize(movies: list[dict], vocab: dict[str, int]) -> np.ndarray:
-    X = np.zeros((len(movies), len(vocab)), dtype=np.float32)
-    for i, m in enumerate(movies):
-        for t in _movie_tokens(m):
-            j = vocab.get(t)
-            if j is not None:
-                X[i, j] = 1.0
-    return X
+# Modelos ya cargados (tokens + pesos); ver model_registry.py y model_store.py
+registry = ModelRegistry()
+
+TRAINING_SECONDS = Histogram("training_seconds", "Duración de train_user_model (vocabulario + optimización + guardado)",
+                             ("optimizer",))
+Callback("model_registry_requests_total", "Consultas al registro de modelos en memoria",
+         lambda: {("hit",): registry.hits, ("miss",): registry.misses}, kind="counter", labelnames=("result",))
+Callback("model_registry_bytes", "Memoria ocupada por los modelos cargados", lambda: registry.stats()["bytes"])
+
+# --- Tokenización: tokens enteros cacheados por película (ver tokenizer.py) ---
+def _flat_tokens(movies: list[dict]) -> tuple[np.ndarray, np.ndarray]:
+    """(tokens de todas las películas concatenados, fila de cada token)."""
+    per_movie = [movie_tokens(m) for m in movies]
+    lengths = np.fromiter(map(len, per_movie), np.int64, len(per_movie))
+    flat = np.fromiter(chain.from_iterable(per_movie), np.int64, int(lengths.sum()))
+    return flat, np.repeat(np.arange(len(movies)), lengths)
+
+def _build_vocab(movies: list[dict], max_vocab: int = 2000) -> np.ndarray:
+    """Los max_vocab tokens más frecuentes, ordenados (columna j = vocab[j])."""
+    tokens, counts = np.unique(_flat_tokens(movies)[0], return_counts=True)
+    if len(tokens) > max_vocab:
+        tokens = tokens[np.argsort(-counts, kind="stable")[:max_vocab]]
+    return np.sort(tokens)
+
+# --- Matriz binaria dispersa estilo CSR ---
+# X se representa como (indices, indptr): las columnas activas de la fila i son
+# indices[indptr[i]:indptr[i+1]]. Memoria y coste por época ~ nº de tokens activos.
+
+def _vectorize(movies: list[dict], vocab: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    flat, rows = _flat_tokens(movies)
+    pos = np.minimum(np.searchsorted(vocab, flat), max(len(vocab) - 1, 0))
+    found = vocab[pos] == flat if len(vocab) else np.zeros(len(flat), bool)
+    indptr = np.zeros(len(movies) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows[found], minlength=len(movies)), out=indptr[1:])
+    return pos[found].astype(np.int64), indptr
+
+def _row_ids(indptr: np.ndarray) -> np.ndarray:
+    """Fila de cada no-cero (para los scatter-add)."""
+    return np.repeat(np.arange(len(indptr) - 1), np.diff(indptr))
+
+def _matvec(indices: np.ndarray, rows: np.ndarray, n_rows: int, w: np.ndarray) -> np.ndarray:
+    """X @ w"""
+    return np.bincount(rows, weights=w[indices], minlength=n_rows)
+
+def _rmatvec(indices: np.ndarray, rows: np.ndarray, n_cols: int, r: np.ndarray) -> np.ndarray:
+    """X.T @ r (scatter-add de r sobre las columnas activas)"""
+    return np.bincount(indices, weights=r[rows], minlength=n_cols)
 
 def _sigmoid(z: np.ndarray) -> np.ndarray:
     return 1.0 / (1.0 + np.exp(-z))
 
+def _logistic_loss(indices, rows, n, d, y, l2):
+    """fun(w) -> (log-loss medio + l2/2·|w|², gradiente) sobre la matriz dispersa."""
+    def fun(w):
+        z = _matvec(indices, rows, n, w)
+        loss = np.mean(np.logaddexp(0.0, z) - y * z) + 0.5 * l2 * (w @ w)
+        grad = _rmatvec(indices, rows, d, _sigmoid(z) - y) / n + l2 * w
+        return loss, grad
+    return fun
+
+def _lookup(ids: np.ndarray, weights: np.ndarray, tokens: np.ndarray) -> np.ndarray:
+    """Peso de cada token en un modelo empaquetado (0 si no lo tiene)."""
+    if len(ids) == 0:
+        return np.zeros(len(tokens))
+    pos = np.minimum(np.searchsorted(ids, tokens), len(ids) - 1)
+    return np.where(ids[pos] == tokens, weights[pos], 0.0)
+
+def _warm_start(user_id: str, vocab: np.ndarray) -> np.ndarray | None:
+    """Pesos previos del usuario reordenados al vocabulario nuevo (tokens comunes)."""
+    ids_old, w_old = load_user_model(user_id)
+    if ids_old is None:
+        return None
+    w0 = _lookup(ids_old, w_old, vocab)
+    return w0 if w0.any() else None
+
 # ----------------- API pública -----------------
 
 def train_user_model(user_id: str,
                      positives: list[dict],
                      negatives_pool: list[dict],
                      neg_ratio: int = 5,
-                     epochs: int = 250,
-                     lr: float = 0.2,
-                     l2: float = 1e-4,
-                     max_vocab: int = 2000) -> None:
+                     optimizer: str = "lbfgs",
+                     max_iter: int = 250,
+                     tol: float = 1e-6,
+                     l2: float = 1e-2,
+                     max_vocab: int = 2000,
+                     warm_start: bool = True,
+                     **optimizer_kwargs) -> dict | None:
     """
     Entrena una regresión logística binaria por usuario:
     - Positivos = favoritos enriquecidos.
     - Negativos = muestra aleatoria de candidatas NO favoritas.
-    Guarda pesos y vocabulario en /models.
+    - optimizer: "lbfgs" (por defecto), "adam" o "gd" (ver optim.py); para al
+      alcanzar `tol`. Con warm_start parte de los pesos anteriores del usuario.
+    - l2: elegido para el óptimo convergido. Con 1e-4 (pensado para 250 épocas de
+      gd que nunca convergían) lbfgs saturaba las probabilidades; 1e-2 reproduce
+      la dispersión de puntuaciones anterior.
+    Guarda el modelo en el almacén empaquetado (model_store.py). Devuelve un resumen
+    (optimizer, iterations, loss, seconds, warm_start) o None si no hay datos suficientes.
     """
+    t0 = time.perf_counter()
     # Construir negativos
     neg_pool = [m for m in negatives_pool if m["id"] not in {p["id"] for p in positives}]
     n_pos = len(positives)
     n_neg = min(len(neg_pool), max(n_pos * neg_ratio, 20))
     if n_neg == 0 or n_pos == 0:
         # Datos insuficientes: no entrenamos
-        return
-    negatives = random.sample(neg_pool, n_neg)
+        return None
+    # Muestra estable por usuario (hash de user_id + película): al reentrenar se
+    # repiten los mismos negativos y el warm start parte de casi el óptimo
+    negatives = sorted(neg_pool, key=lambda m: zlib.crc32(f"{user_id}:{m['id']}".encode()))[:n_neg]
 
-    # Vocabulario y matrices
+    # Vocabulario y matriz dispersa
     vocab = _build_vocab(positives + negatives, max_vocab=max_vocab)
-    X_pos = _vectorize(positives, vocab)
-    X_neg = _vectorize(negatives, vocab)
-    X = np.vstack([X_pos, X_neg])
-    y = np.concatenate([np.ones(len(X_pos), dtype=np.float32),
-                        np.zeros(len(X_neg), dtype=np.float32)])
-
-    # Entrenamiento por GD
-    w = np.zeros(X.shape[1], dtype=np.float32)
-    for _ in range(epochs):
-        z = X @ w
-        p = _sigmoid(z)
-        grad = (X.T @ (p - y)) / X.shape[0] + l2 * w
-        w -= lr * grad
-
-    # Guardar modelo
-    np.save(os.path.join(MODELS_DIR, f"{user_id}_w.npy"), w)
-    with open(os.path.join(MODELS_DIR, f"{user_id}_vocab.json"), "w", encoding="utf-8") as f:
-        json.dump(vocab, f)
+    indices, indptr = _vectorize(positives + negatives, vocab)
+    rows = _row_ids(indptr)
+    n, d = len(indptr) - 1, len(vocab)
+    y = np.concatenate([np.ones(n_pos), np.zeros(n_neg)])
+
+    # Entrenamiento (desde los pesos anteriores si el vocabulario se solapa)
+    w0 = _warm_start(user_id, vocab) if warm_start else None
+    fun = _logistic_loss(indices, rows, n, d, y, l2)
+    w, iterations, loss = OPTIMIZERS[optimizer](
+        fun, w0 if w0 is not None else np.zeros(d),
+        max_iter=max_iter, tol=tol, **optimizer_kwargs)
+    w = w.astype(np.float32)
+
+    # Guardar modelo (registro nuevo en el almacén) y publicarlo en el registro
+    version = store.save(user_id, vocab, w)
+    ids, weights, _ = store.load(user_id)
+    registry.put(user_id, (ids, weights), ids.nbytes + weights.nbytes, version)
+    seconds = time.perf_counter() - t0
+    TRAINING_SECONDS.observe(seconds, optimizer=optimizer)
+    return {
+        "optimizer": optimizer,
+        "iterations": iterations,
+        "loss": loss,
+        "seconds": seconds,
+        "warm_start": w0 is not None,
+    }
 
 def load_user_model(user_id: str):
-    w_path = os.path.join(MODELS_DIR, f"{user_id}_w.npy")
-    v_path = os.path.join(MODELS_DIR, f"{user_id}_vocab.json")
-    if not (os.path.exists(w_path) and os.path.exists(v_path)):
+    """(tokens, pesos) del usuario, desde memoria si ya está cargado."""
+    model = registry.get(user_id, version_fn=lambda: _stored_version(user_id))
+    if model is not None:
+        return model
+    if _stored_version(user_id) is None:
         return None, None
-    w = np.load(w_path)
-    with open(v_path, "r", encoding="utf-8") as f:
-        vocab = json.load(f)
-    return w, vocab
+    ids, weights, version = store.load(user_id)
+    registry.put(user_id, (ids, weights), ids.nbytes + weights.nbytes, version)
+    return ids, weights
+
+def model_version(user_id: str):
+    """Versión del modelo o None si no existe. Si está en memoria, la del registro
+    (revisada contra el almacén cada MODEL_RECHECK_SECONDS); si no, el almacén."""
+    version = registry.version(user_id, version_fn=lambda: _stored_version(user_id))
+    return version if version is not None else _stored_version(user_id)
+
+# Usuarios cuyos ficheros del formato antiguo ya se buscaron en este proceso
+_legacy_checked = set()
+
+def _stored_version(user_id: str):
+    """Versión en el almacén; la primera vez que falta se migra el formato antiguo."""
+    version = store.version(user_id)
+    if version is None and user_id not in _legacy_checked:
+        _legacy_checked.add(user_id)
+        if store.migrate_user(user_id):
+            version = store.version(user_id)
+    return version
 
 def score_movies_for_user(user_id: str, movies: list[dict]) -> list[float]:
-    w, vocab = load_user_model(user_id)
-    if w is None or vocab is None or not movies:
+    ids, weights = load_user_model(user_id)
+    if ids is None or not movies:
         return []
-    X = _vectorize(movies, vocab)
-    probs = _sigmoid(X @ w)
-    return probs.tolist()
+    flat, rows = _flat_tokens(movies)
+    z = np.bincount(rows, weights=_lookup(ids, weights, flat), minlength=len(movies))
+    return _sigmoid(z).tolist()
@@ -0,0 +1,79 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+
+# Registro de modelos en memoria (uno por proceso).
+# LRU con presupuesto de memoria en bytes: un usuario "caliente" se puntúa sin
+# tocar disco. Las entradas se sustituyen atómicamente al terminar un reentreno
+# y, cada RECHECK_SECONDS, se comprueba la versión en el almacén por si otro proceso
+# (otro worker de uvicorn, el job batch) ha escrito un modelo más nuevo.
+
+MODEL_CACHE_BYTES = int(os.getenv("MODEL_CACHE_BYTES", str(256 * 1024 * 1024)))
+RECHECK_SECONDS = float(os.getenv("MODEL_RECHECK_SECONDS", "30"))
+
+
+class ModelRegistry:
+    def __init__(self, max_bytes: int = MODEL_CACHE_BYTES, recheck_seconds: float = RECHECK_SECONDS):
+        self.max_bytes = max_bytes
+        self.recheck_seconds = recheck_seconds
+        self._items = OrderedDict()  # key -> [model, nbytes, version, checked_at]
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str, version_fn=None):
+        """Modelo en memoria o None. version_fn() se consulta como mucho cada
+        recheck_seconds; si la versión ya no coincide, la entrada se descarta."""
+        with self._lock:
+            item = self._fresh(key, version_fn)
+            if item is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def version(self, key: str, version_fn=None):
+        """Versión del modelo en memoria o None, con la misma comprobación que get()."""
+        with self._lock:
+            item = self._fresh(key, version_fn)
+            return None if item is None else item[2]
+
+    def _fresh(self, key: str, version_fn):
+        item = self._items.get(key)
+        if item is None:
+            return None
+        now = time.monotonic()
+        if version_fn is not None and now - item[3] >= self.recheck_seconds:
+            if version_fn() != item[2]:
+                self._drop(key)
+                return None
+            item[3] = now
+        return item
+
+    def put(self, key: str, model, nbytes: int, version) -> None:
+        """Sustituye (o añade) el modelo de forma atómica para los lectores."""
+        with self._lock:
+            if key in self._items:
+                self._drop(key)
+            self._items[key] = [model, nbytes, version, time.monotonic()]
+            self._bytes += nbytes
+            while self._bytes > self.max_bytes and len(self._items) > 1:
+                oldest = next(iter(self._items))
+                self._drop(oldest)
+
+    def invalidate(self, key: str) -> None:
+        with self._lock:
+            if key in self._items:
+                self._drop(key)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"models": len(self._items), "bytes": self._bytes,
+                    "hits": self.hits, "misses": self.misses}
+
+    def _drop(self, key):
+        _, nbytes, _, _ = self._items.pop(key)
+        self._bytes -= nbytes
@@ -0,0 +1,245 @@
+"""
+Almacén empaquetado de modelos por usuario.
+
+    python model_store.py --migrate            # importa models/*_w.npy + *_vocab.json
+    python model_store.py --migrate --remove   # ... y borra los ficheros antiguos
+    python model_store.py --compact            # reescribe sin registros obsoletos
+
+En vez de dos ficheros por usuario (pesos .npy + vocab JSON de strings):
+  - models/store.db (SQLite): índice user_id -> (offset, longitud, versión).
+  - models/store.{gen}.ids / store.{gen}.w: todos los modelos concatenados como
+    arrays int64 (tokens enteros de tokenizer.py, ordenados) y float32 (pesos),
+    abiertos con mmap.
+Cargar un usuario es leer su fila del índice y cortar los dos arrays.
+
+Los registros se añaden al final (append-only) dentro de una transacción
+BEGIN IMMEDIATE, que serializa a los escritores de todos los procesos
+(workers de uvicorn, pool de train_all). compact() reescribe los ficheros con
+una generación nueva; los lectores detectan el cambio y vuelven a mapear.
+save() compacta solo cuando lo obsoleto supera COMPACT_RATIO de lo vigente.
+"""
+import os
+import glob
+import json
+import time
+import sqlite3
+import argparse
+import threading
+
+import numpy as np
+
+from tokenizer import legacy_token
+
+MODELS_DIR = "models"
+COMPACT_RATIO = 0.5       # pesos obsoletos / vigentes a partir del cual save() compacta
+COMPACT_MIN = 100_000     # ... y nunca por debajo de estos pesos obsoletos (~1.2 MB)
+
+
+def _legacy_tokens(tokens: list[str], weights: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Tokens de texto -> enteros (ordenados). Los que colapsan en uno suman su peso."""
+    ids = np.fromiter((legacy_token(t) or -1 for t in tokens), np.int64, len(tokens))
+    keep = ids >= 0
+    ids, inverse = np.unique(ids[keep], return_inverse=True)
+    return ids, np.bincount(inverse, weights=np.asarray(weights)[keep], minlength=len(ids)).astype(np.float32)
+
+
+class ModelStore:
+    def __init__(self, directory: str = MODELS_DIR):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+        self._maps = None       # (generación, tokens memmap, pesos memmap)
+
+    # ---------- SQLite ----------
+
+    def _db(self) -> sqlite3.Connection:
+        # Una conexión por proceso (no se hereda a través de fork)
+        if self._conn is None or self._pid != os.getpid():
+            os.makedirs(self.directory, exist_ok=True)
+            conn = sqlite3.connect(os.path.join(self.directory, "store.db"),
+                                   check_same_thread=False, isolation_level=None, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS users ("
+                         " user_id TEXT PRIMARY KEY, offset INTEGER NOT NULL,"
+                         " length INTEGER NOT NULL, version INTEGER NOT NULL)")
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+            conn.execute("INSERT OR IGNORE INTO meta VALUES ('generation', 0), ('size', 0)")
+            conn.execute("INSERT OR IGNORE INTO meta SELECT 'live', COALESCE(SUM(length), 0) FROM users")
+            self._conn, self._pid, self._maps = conn, os.getpid(), None
+        return self._conn
+
+    def _meta(self, db, key: str) -> int:
+        row = db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _paths(self, generation: int) -> tuple[str, str]:
+        base = os.path.join(self.directory, f"store.{generation}")
+        return base + ".ids", base + ".w"
+
+    def _rewrite(self, db) -> tuple[int, int, int]:
+        """Copia los registros vigentes a una generación nueva (dentro de la
+        transacción del llamador)."""
+        generation = self._meta(db, "generation")
+        old_size = self._meta(db, "size")
+        rows = db.execute("SELECT user_id, offset, length FROM users ORDER BY offset").fetchall()
+        old = [np.memmap(p, dtype=dt, mode="r") if old_size else np.empty(0, dt)
+               for p, dt in zip(self._paths(generation), (np.int64, np.float32))]
+        size = 0
+        new_ids, new_w = self._paths(generation + 1)
+        with open(new_ids, "wb") as f_ids, open(new_w, "wb") as f_w:
+            for user_id, offset, length in rows:
+                f_ids.write(old[0][offset:offset + length].tobytes())
+                f_w.write(old[1][offset:offset + length].tobytes())
+                db.execute("UPDATE users SET offset = ? WHERE user_id = ?", (size, user_id))
+                size += length
+            for f in (f_ids, f_w):
+                f.flush()
+                os.fsync(f.fileno())
+        db.execute("UPDATE meta SET value = ? WHERE key IN ('size', 'live')", (size,))
+        db.execute("UPDATE meta SET value = ? WHERE key = 'generation'", (generation + 1,))
+        return generation, old_size, size
+
+    def _dead(self, db) -> tuple[int, int]:
+        """(pesos obsoletos, pesos vigentes)."""
+        live = self._meta(db, "live")
+        return self._meta(db, "size") - live, live
+
+    def _drop_generation(self, generation: int) -> None:
+        for path in self._paths(generation):
+            try:
+                os.remove(path)
+            except OSError:
+                pass  # p. ej. aún mapeado en Windows; se puede borrar más tarde
+
+    # ---------- Modelos ----------
+
+    def save(self, user_id: str, tokens: np.ndarray, weights: np.ndarray) -> int:
+        """Guarda el modelo (tokens[i] -> weights[i]) y devuelve su versión."""
+        tokens = np.asarray(tokens, dtype=np.int64)
+        order = np.argsort(tokens, kind="stable")
+        tokens = tokens[order]
+        weights = np.asarray(weights, dtype=np.float32)[order]
+        version = time.time_ns()
+        with self._lock:
+            db = self._db()
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                size = self._meta(db, "size")
+                for path, arr in zip(self._paths(self._meta(db, "generation")), (tokens, weights)):
+                    with open(path, "r+b" if os.path.exists(path) else "wb") as f:
+                        f.seek(size * arr.itemsize)
+                        f.write(arr.tobytes())
+                        f.flush()
+                        os.fsync(f.fileno())
+                old = db.execute("SELECT length FROM users WHERE user_id = ?", (user_id,)).fetchone()
+                db.execute("INSERT OR REPLACE INTO users VALUES (?, ?, ?, ?)", (user_id, size, len(tokens), version))
+                db.execute("UPDATE meta SET value = ? WHERE key = 'size'", (size + len(tokens),))
+                db.execute("UPDATE meta SET value = value + ? WHERE key = 'live'",
+                           (len(tokens) - (old[0] if old else 0),))
+                dead, live = self._dead(db)
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+        if dead > COMPACT_MIN and dead > COMPACT_RATIO * live:
+            self.compact(min_ratio=COMPACT_RATIO)
+        return version
+
+    def version(self, user_id: str):
+        with self._lock:
+            row = self._db().execute("SELECT version FROM users WHERE user_id = ?", (user_id,)).fetchone()
+        return row[0] if row else None
+
+    def load(self, user_id: str):
+        """(tokens int64 ordenados, pesos float32, versión) o None. Vistas sobre el mmap."""
+        with self._lock:
+            db = self._db()
+            row = db.execute(
+                "SELECT offset, length, version, (SELECT value FROM meta WHERE key = 'generation')"
+                " FROM users WHERE user_id = ?", (user_id,)).fetchone()
+            if row is None:
+                return None
+            offset, length, version, generation = row
+            if length == 0:
+                return np.empty(0, np.int64), np.empty(0, np.float32), version
+            maps = self._maps
+            if maps is None or maps[0] != generation or len(maps[1]) < offset + length:
+                ids_path, w_path = self._paths(generation)
+                maps = (generation,
+                        np.memmap(ids_path, dtype=np.int64, mode="r"),
+                        np.memmap(w_path, dtype=np.float32, mode="r"))
+                self._maps = maps
+        return maps[1][offset:offset + length], maps[2][offset:offset + length], version
+
+    def users(self) -> list[str]:
+        with self._lock:
+            return [r[0] for r in self._db().execute("SELECT user_id FROM users")]
+
+    def compact(self, min_ratio: float | None = None) -> dict | None:
+        """Reescribe los ficheros solo con los registros vigentes (generación nueva).
+        Con min_ratio no hace nada (None) si lo obsoleto ya no lo supera: otro
+        proceso puede haber compactado mientras tanto."""
+        with self._lock:
+            db = self._db()
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                dead, live = self._dead(db)
+                if min_ratio is not None and dead <= min_ratio * live:
+                    db.execute("COMMIT")
+                    return None
+                generation, before, after = self._rewrite(db)
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+            self._maps = None
+        self._drop_generation(generation)
+        return {"users": len(self.users()), "before": before, "after": after}
+
+    # ---------- Migración desde el formato antiguo ----------
+
+    def _legacy_paths(self, user_id: str) -> tuple[str, str]:
+        return (os.path.join(self.directory, f"{user_id}_w.npy"),
+                os.path.join(self.directory, f"{user_id}_vocab.json"))
+
+    def migrate_user(self, user_id: str, remove: bool = False) -> bool:
+        """Importa models/{user}_w.npy + _vocab.json si existen. True si migró."""
+        w_path, v_path = self._legacy_paths(user_id)
+        if not (os.path.exists(w_path) and os.path.exists(v_path)):
+            return False
+        w = np.load(w_path)
+        with open(v_path, "r", encoding="utf-8") as f:
+            vocab = json.load(f)
+        tokens = sorted(vocab, key=vocab.get)
+        self.save(user_id, *_legacy_tokens(tokens, w[[vocab[t] for t in tokens]]))
+        if remove:
+            os.remove(w_path)
+            os.remove(v_path)
+        return True
+
+    def migrate_legacy(self, remove: bool = False) -> int:
+        users = [os.path.basename(p)[:-len("_w.npy")]
+                 for p in glob.glob(os.path.join(self.directory, "*_w.npy"))]
+        return sum(self.migrate_user(u, remove=remove) for u in sorted(users))
+
+
+store = ModelStore()
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Mantenimiento del almacén de modelos")
+    parser.add_argument("--migrate", action="store_true", help="importa los modelos en formato antiguo")
+    parser.add_argument("--remove", action="store_true", help="con --migrate, borra los ficheros antiguos")
+    parser.add_argument("--compact", action="store_true", help="elimina registros obsoletos")
+    args = parser.parse_args(argv)
+    if args.migrate:
+        print(f"Migrados {store.migrate_legacy(remove=args.remove)} modelos")
+    if args.compact:
+        info = store.compact()
+        print(f"{info['users']} modelos; {info['before']} -> {info['after']} pesos")
+
+
+if __name__ == "__main__":
+    main()
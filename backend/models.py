@@ -1,18 +1,72 @@
-from sqlalchemy import Column, Integer, String, UniqueConstraint
+from sqlalchemy import Column, Integer, String, Float, ForeignKey, UniqueConstraint
 from sqlalchemy.orm import relationship
 from database import Base
 
 
 class Favorite(Base):
     __tablename__ = "favorites"
-    id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(String, index=True)
-    movie_id = Column(Integer, index=True)
+    id = Column(Integer, primary_key=True)
+    user_id = Column(String, nullable=False)
+    movie_id = Column(Integer, nullable=False, index=True)
     movie_title = Column(String)
     poster_path = Column(String, nullable=True)
-    genre_ids = Column(String, nullable=True) # coma-separado, p.ej. "28,12"
 
+    genres = relationship("FavoriteGenre", cascade="all, delete-orphan", lazy="selectin",
+                          order_by="FavoriteGenre.genre_id")
 
+    # El índice único (user_id, movie_id) sirve tanto para "favoritos del usuario"
+    # como para buscar un favorito concreto
     __table_args__ = (
         UniqueConstraint('user_id', 'movie_id', name='uq_user_movie'),
-    )
\ No newline at end of file
+    )
+
+    @property
+    def genre_ids(self) -> list[int]:
+        return [g.genre_id for g in self.genres]
+
+
+class FavoriteGenre(Base):
+    __tablename__ = "favorite_genres"
+    favorite_id = Column(Integer, ForeignKey("favorites.id", ondelete="CASCADE"), primary_key=True)
+    genre_id = Column(Integer, primary_key=True)
+
+
+# ---------- Catálogo local de películas (normalizado) ----------
+
+class CatalogMovie(Base):
+    __tablename__ = "catalog_movies"
+    id = Column(Integer, primary_key=True)  # id TMDb
+    title = Column(String)
+    poster_path = Column(String, nullable=True)
+    collection_id = Column(Integer, nullable=True, index=True)  # una película pertenece a ≤1 colección
+    vote_average = Column(Float, default=0.0)
+    vote_count = Column(Integer, default=0)
+    synced_at = Column(Float, index=True)  # epoch de la última sincronización con TMDb
+
+    genres = relationship("MovieGenre", cascade="all, delete-orphan", lazy="selectin")
+    keywords = relationship("MovieKeyword", cascade="all, delete-orphan", lazy="selectin")
+    directors = relationship("MovieDirector", cascade="all, delete-orphan", lazy="selectin")
+
+
+class MovieGenre(Base):
+    __tablename__ = "movie_genres"
+    movie_id = Column(Integer, ForeignKey("catalog_movies.id", ondelete="CASCADE"), primary_key=True)
+    genre_id = Column(Integer, primary_key=True, index=True)
+
+
+class MovieKeyword(Base):
+    __tablename__ = "movie_keywords"
+    movie_id = Column(Integer, ForeignKey("catalog_movies.id", ondelete="CASCADE"), primary_key=True)
+    keyword_id = Column(Integer, primary_key=True, index=True)
+
+
+class MovieDirector(Base):
+    __tablename__ = "movie_directors"
+    movie_id = Column(Integer, ForeignKey("catalog_movies.id", ondelete="CASCADE"), primary_key=True)
+    person_id = Column(Integer, primary_key=True, index=True)
+
+
+class SyncState(Base):
+    __tablename__ = "sync_state"
+    name = Column(String, primary_key=True)
+    value = Column(String)
\ No newline at end of file
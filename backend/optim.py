@@ -0,0 +1,108 @@
+import numpy as np
+
+# Optimizadores para funciones convexas suaves (la regresión logística de ml.py).
+# Todos reciben fun(w) -> (loss, grad) y paran cuando la mejora relativa de la
+# pérdida baja de `tol` o el gradiente es ~0. Devuelven (w, iteraciones, loss).
+#
+# - "lbfgs": L-BFGS con búsqueda lineal de Armijo. Por defecto: converge en
+#   decenas de iteraciones. El primer paso se escala con un gradiente de prueba
+#   (par s, y inicial) en vez de ir a ciegas con longitud 1. Con warm start y
+#   los mismos datos basta 1 iteración; con un favorito nuevo el óptimo se
+#   mueve y ahorra poco (~1 iteración de ~14).
+# - "adam":  Adam con paso fijo.
+# - "gd":    descenso de gradiente clásico (el comportamiento anterior).
+
+GTOL = 1e-5
+
+
+def _converged(f_prev: float, f: float, g: np.ndarray, tol: float) -> bool:
+    return abs(f_prev - f) <= tol * max(1.0, abs(f)) or np.max(np.abs(g)) <= GTOL
+
+
+def lbfgs(fun, w: np.ndarray, max_iter: int = 100, tol: float = 1e-6, memory: int = 10, probe: float = 1e-3):
+    f, g = fun(w)
+    s_hist, y_hist = [], []
+    if probe and np.any(g):
+        # Curvatura a lo largo del gradiente: escala del primer paso
+        s = -probe * g / np.linalg.norm(g)
+        y = fun(w + s)[1] - g
+        if s @ y > 1e-12:
+            s_hist.append(s)
+            y_hist.append(y)
+    it = 0
+    for it in range(1, max_iter + 1):
+        # Dirección: recursión de dos bucles sobre el historial (s, y)
+        q = g.copy()
+        alphas = []
+        for s, y in reversed(list(zip(s_hist, y_hist))):
+            rho = 1.0 / (y @ s)
+            a = rho * (s @ q)
+            q -= a * y
+            alphas.append((rho, a))
+        if y_hist:
+            q *= (s_hist[-1] @ y_hist[-1]) / (y_hist[-1] @ y_hist[-1])
+        else:
+            q /= max(1.0, np.linalg.norm(g))
+        for (s, y), (rho, a) in zip(zip(s_hist, y_hist), reversed(alphas)):
+            q += s * (a - rho * (y @ q))
+        d = -q
+        slope = g @ d
+        if slope >= 0:
+            d, slope = -g, -(g @ g)
+
+        # Búsqueda lineal con backtracking (condición de Armijo)
+        t = 1.0
+        while True:
+            w_new = w + t * d
+            f_new, g_new = fun(w_new)
+            if f_new <= f + 1e-4 * t * slope or t < 1e-10:
+                break
+            t *= 0.5
+
+        s, y = w_new - w, g_new - g
+        if s @ y > 1e-10:
+            s_hist.append(s)
+            y_hist.append(y)
+            if len(s_hist) > memory:
+                s_hist.pop(0)
+                y_hist.pop(0)
+
+        done = _converged(f, f_new, g_new, tol)
+        w, f, g = w_new, f_new, g_new
+        if done:
+            break
+    return w, it, float(f)
+
+
+def adam(fun, w: np.ndarray, max_iter: int = 500, tol: float = 1e-6, lr: float = 0.05,
+         beta1: float = 0.9, beta2: float = 0.999, eps: float = 1e-8):
+    m = np.zeros_like(w)
+    v = np.zeros_like(w)
+    f, g = fun(w)
+    it = 0
+    for it in range(1, max_iter + 1):
+        m = beta1 * m + (1 - beta1) * g
+        v = beta2 * v + (1 - beta2) * g * g
+        m_hat = m / (1 - beta1 ** it)
+        v_hat = v / (1 - beta2 ** it)
+        w = w - lr * m_hat / (np.sqrt(v_hat) + eps)
+        f_prev = f
+        f, g = fun(w)
+        if _converged(f_prev, f, g, tol):
+            break
+    return w, it, float(f)
+
+
+def gd(fun, w: np.ndarray, max_iter: int = 250, tol: float = 1e-6, lr: float = 0.2):
+    f, g = fun(w)
+    it = 0
+    for it in range(1, max_iter + 1):
+        w = w - lr * g
+        f_prev = f
+        f, g = fun(w)
+        if _converged(f_prev, f, g, tol):
+            break
+    return w, it, float(f)
+
+
+OPTIMIZERS = {"lbfgs": lbfgs, "adam": adam, "gd": gd}
@@ -0,0 +1,64 @@
+import numpy as np
+
+# Ranking final de candidatas, vectorizado con NumPy:
+#   score = ml_weight * ml + (1 - ml_weight) * rating_norm
+# donde rating_norm = vote_average / 10 solo si hay ≥ min_votes votos.
+# El top-k se obtiene con argpartition sobre un ranking parcial, y el límite de
+# películas por colección se aplica sobre ese ranking parcial (ampliándolo si
+# la diversidad descarta demasiadas).
+
+
+def _rank_within_group(groups: np.ndarray) -> np.ndarray:
+    """Para cada posición, cuántas anteriores comparten grupo (0, 1, 2...)."""
+    order = np.argsort(groups, kind="stable")
+    g = groups[order]
+    idx = np.arange(len(g))
+    starts = np.maximum.accumulate(np.where(np.r_[True, g[1:] != g[:-1]], idx, 0))
+    rank = np.empty_like(idx)
+    rank[order] = idx - starts
+    return rank
+
+
+def top_order(scores: np.ndarray, m: int) -> np.ndarray:
+    """Índices de las m mejores por score descendente y, a igualdad, por posición.
+    Si hay empates en el corte se devuelven todos: argpartition elegiría uno cualquiera."""
+    n = len(scores)
+    if m < n:
+        kth = np.partition(scores, n - m)[n - m]
+        part = np.flatnonzero(scores >= kth)
+    else:
+        part = np.arange(n)
+    return part[np.lexsort((part, -scores[part]))]
+
+
+def blend_scores(candidates: list[dict], ml_scores, ml_weight: float, min_votes: int) -> np.ndarray:
+    n = len(candidates)
+    ml = np.asarray(ml_scores, dtype=np.float64)
+    rating = np.fromiter((float(c.get("vote_average") or 0.0) for c in candidates), np.float64, n)
+    votes = np.fromiter((int(c.get("vote_count") or 0) for c in candidates), np.int64, n)
+    rating_norm = np.where(votes >= min_votes, rating / 10.0, 0.0)
+    return ml_weight * ml + (1.0 - ml_weight) * rating_norm
+
+
+def rank(candidates: list[dict],
+         ml_scores,
+         k: int,
+         ml_weight: float,
+         min_votes: int,
+         max_per_collection: int) -> list[dict]:
+    """Top-k candidatas por score mezclado, con como mucho max_per_collection por saga."""
+    n = len(candidates)
+    if n == 0 or k <= 0:
+        return []
+    scores = blend_scores(candidates, ml_scores, ml_weight, min_votes)
+    collections = np.fromiter((c.get("collection_id") or 0 for c in candidates), np.int64, n)
+
+    m = min(n, 2 * k)
+    while True:
+        ordered = top_order(scores, m)
+        cols = collections[ordered]
+        keep = (cols == 0) | (_rank_within_group(cols) < max_per_collection)
+        top = ordered[keep][:k]
+        if len(top) >= k or m == n:
+            return [candidates[i] for i in top]
+        m = min(n, 2 * m)
@@ -0,0 +1,64 @@
+import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+from metrics import Counter
+
+# Caché de resultados de /recommendations por usuario.
+# La clave combina la huella de los favoritos y la versión del modelo: si
+# ninguna cambia, el resultado tampoco. El TTL cubre los cambios del catálogo.
+
+RECO_CACHE_USERS = int(os.getenv("RECO_CACHE_USERS", "10000"))
+RECO_CACHE_TTL = float(os.getenv("RECO_CACHE_TTL", "3600"))
+
+RECO_CACHE_REQUESTS = Counter("reco_cache_requests_total", "Consultas a la caché de recomendaciones", ("result",))
+
+
+def favorites_fingerprint(movie_ids) -> str:
+    return hashlib.sha1(",".join(map(str, sorted(movie_ids))).encode()).hexdigest()[:16]
+
+
+def make_key(movie_ids, model_version, *extra) -> str:
+    return ":".join([favorites_fingerprint(movie_ids), str(model_version), *map(str, extra)])
+
+
+def etag_for(payload: dict) -> str:
+    ids = ",".join(str(m["id"]) for m in payload.get("results", []))
+    return '"' + hashlib.sha1(ids.encode()).hexdigest()[:20] + '"'
+
+
+class RecoCache:
+    def __init__(self, max_users: int = RECO_CACHE_USERS, ttl: float = RECO_CACHE_TTL):
+        self.max_users = max_users
+        self.ttl = ttl
+        self._items = OrderedDict()  # user_id -> (key, etag, payload, expires_at)
+        self._lock = threading.Lock()
+
+    def get(self, user_id: str, key: str):
+        """(etag, payload) si hay resultado válido para esta clave, si no None."""
+        with self._lock:
+            item = self._items.get(user_id)
+            if item is None or item[0] != key or item[3] <= time.time():
+                RECO_CACHE_REQUESTS.inc(result="miss")
+                return None
+            self._items.move_to_end(user_id)
+            RECO_CACHE_REQUESTS.inc(result="hit")
+            return item[1], item[2]
+
+    def put(self, user_id: str, key: str, payload: dict) -> str:
+        etag = etag_for(payload)
+        with self._lock:
+            self._items[user_id] = (key, etag, payload, time.time() + self.ttl)
+            self._items.move_to_end(user_id)
+            while len(self._items) > self.max_users:
+                self._items.popitem(last=False)
+        return etag
+
+    def invalidate(self, user_id: str) -> None:
+        with self._lock:
+            self._items.pop(user_id, None)
+
+
+reco_cache = RecoCache()
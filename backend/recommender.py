@@ -33,13 +33,21 @@ def movie_to_vec(m: Dict, index):
 
 
 
+def genre_matrix(movies: List[Dict], index) -> np.ndarray:
+	"""Matriz one-hot (películas x géneros), construida de una vez."""
+	M = np.zeros((len(movies), len(index)), dtype=float)
+	rows = [i for i, m in enumerate(movies) for g in (m.get("genre_ids") or []) if g in index]
+	cols = [index[g] for m in movies for g in (m.get("genre_ids") or []) if g in index]
+	M[rows, cols] = 1.0
+	return M
+
+
+
+
 def user_profile(favorites: List[Dict], index):
 	if not favorites:
 		return None
-	vecs = [movie_to_vec(m, index) for m in favorites]
-	if not vecs:
-		return None
-	u = np.mean(np.stack(vecs, axis=0), axis=0)
+	u = genre_matrix(favorites, index).mean(axis=0)
 	# normalizar
 	norm = np.linalg.norm(u)
 	if norm > 0:
@@ -59,18 +67,23 @@ def cosine(a, b):
 
 
 
-def rank_candidates(favorites: List[Dict], candidates: List[Dict]):
+def cosine_scores(favorites: List[Dict], candidates: List[Dict]) -> np.ndarray:
+	"""Coseno de cada candidata con el perfil del usuario (un producto matriz-vector)."""
 	genres, index = build_genre_space([favorites, candidates])
 	u = user_profile(favorites, index)
-	if u is None:
+	if u is None or not candidates:
+		return np.zeros(len(candidates))
+	C = genre_matrix(candidates, index)
+	norms = np.linalg.norm(C, axis=1) * np.linalg.norm(u)
+	return np.divide(C @ u, norms, out=np.zeros(len(candidates)), where=norms > 0)
+
+
+
+
+def rank_candidates(favorites: List[Dict], candidates: List[Dict]):
+	if not favorites:
 		return []
-	scored = []
 	fav_ids = {m["id"] for m in favorites}
-	for c in candidates:
-		if c["id"] in fav_ids:
-			continue
-		v = movie_to_vec(c, index)
-		s = cosine(u, v)
-		scored.append((s, c))
-	scored.sort(key=lambda x: x[0], reverse=True)
-	return [c for s, c in scored]
\ No newline at end of file
+	candidates = [c for c in candidates if c["id"] not in fav_ids]
+	scores = cosine_scores(favorites, candidates)
+	return [candidates[i] for i in np.argsort(-scores, kind="stable")]
\ No newline at end of file
@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import List, Optional
 
 
@@ -21,6 +21,42 @@ class FavoriteOut(Movie):
 	pass
 
 
+class MovieRef(BaseModel):
+	"""Película a importar: basta el id; lo que falte se completa con el catálogo o TMDb."""
+	id: int = Field(gt=0)
+	title: Optional[str] = None
+	poster_path: Optional[str] = None
+	genre_ids: Optional[list[int]] = None
+
+
+class BulkError(BaseModel):
+	row: int
+	line: Optional[int] = None  # línea del CSV (None en JSON)
+	id: Optional[int] = None
+	error: str
+
+
+class FavoritesBulkOut(BaseModel):
+	user_id: str
+	received: int
+	inserted: int
+	updated: int
+	unchanged: int
+	errors: List[BulkError]
+	training: str  # "queued" si se encoló un reentreno, si no "skipped"
+
+
 class RecoResponse(BaseModel):
 	count: int
-	results: List[Movie]
\ No newline at end of file
+	results: List[Movie]
+
+
+class TrainingStatus(BaseModel):
+	user_id: str
+	state: str
+	version: Optional[int] = None
+	queued_at: Optional[float] = None
+	started_at: Optional[float] = None
+	finished_at: Optional[float] = None
+	error: Optional[str] = None
+	last_training: Optional[dict] = None  # optimizer, iterations, loss, seconds
\ No newline at end of file
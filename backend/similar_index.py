@@ -0,0 +1,179 @@
+"""
+Índice de películas similares ("más como esta") con MinHash + LSH.
+
+    python similar_index.py        # reconstruye el índice desde el catálogo
+
+Cada película del catálogo se representa por sus tokens (los enteros de
+tokenizer.movie_tokens: géneros, keywords, directores, colección, título). Su firma
+MinHash de NUM_PERM valores se parte en BANDS bandas; dos películas son
+candidatas si coinciden en alguna banda. Las candidatas se ordenan por la
+similitud de Jaccard estimada (fracción de valores de la firma iguales).
+
+Todo se guarda como .npy en models/ y se abre con mmap: una consulta son
+BANDS búsquedas binarias sobre arrays ordenados más una comparación de firmas.
+"""
+import os
+import time
+import threading
+
+import numpy as np
+from sqlalchemy import select
+
+from database import SessionLocal
+from models import CatalogMovie
+from catalog import load_movies
+from tokenizer import movie_tokens
+
+MODELS_DIR = "models"
+NUM_PERM = 64
+BANDS = 16                # 16 bandas x 4 filas: umbral de Jaccard ≈ (1/16)^(1/4) ≈ 0.5
+ROWS = NUM_PERM // BANDS
+MAX_BUCKET = 200          # candidatas por banda como mucho (buckets enormes = tokens muy comunes)
+BUILD_CHUNK = 5000        # películas por bloque al calcular firmas
+
+_rng = np.random.default_rng(20240601)
+_A = _rng.integers(1, 2**63, NUM_PERM, dtype=np.uint64) | np.uint64(1)  # multiplicadores impares
+_B = _rng.integers(0, 2**63, NUM_PERM, dtype=np.uint64)
+_BAND_MULT = _rng.integers(1, 2**63, ROWS, dtype=np.uint64) | np.uint64(1)
+
+INDEX_FORMAT = 2          # cambia si cambian los tokens o el hashing (obliga a reconstruir)
+
+_PATHS = {name: os.path.join(MODELS_DIR, f"similar.v{INDEX_FORMAT}.{name}.npy")
+          for name in ("ids", "sigs", "keys", "pos")}
+
+
+def _token_hashes(m: dict) -> np.ndarray:
+    return np.fromiter(movie_tokens(m), np.uint64)
+
+def signatures(token_hashes: list[np.ndarray]) -> np.ndarray:
+    """Firmas MinHash (n x NUM_PERM, uint32) con hashing multiply-shift."""
+    out = np.empty((len(token_hashes), NUM_PERM), dtype=np.uint32)
+    lengths = np.array([len(h) for h in token_hashes])
+    flat = np.concatenate(token_hashes) if len(token_hashes) else np.empty(0, np.uint64)
+    starts = np.r_[0, np.cumsum(lengths)[:-1]]
+    with np.errstate(over="ignore"):
+        hashed = ((flat[:, None] * _A + _B) >> np.uint64(32)).astype(np.uint32)
+    out[:] = np.minimum.reduceat(hashed, starts, axis=0) if len(flat) else 0
+    return out
+
+def band_keys(sigs: np.ndarray) -> np.ndarray:
+    """Clave de cada banda (n x BANDS, uint64)."""
+    bands = sigs.reshape(len(sigs), BANDS, ROWS).astype(np.uint64)
+    with np.errstate(over="ignore"):
+        return (bands * _BAND_MULT).sum(axis=2, dtype=np.uint64)
+
+
+# ---------- Construcción ----------
+
+def _catalog_movies() -> list[dict]:
+    db = SessionLocal()
+    try:
+        ids = [r[0] for r in db.execute(select(CatalogMovie.id))]
+        return [m for m, _ in load_movies(ids, db=db).values()]
+    finally:
+        db.close()
+
+def build(movies: list[dict] | None = None) -> dict:
+    """Calcula firmas y tablas de bandas y las guarda de forma atómica."""
+    t0 = time.perf_counter()
+    movies = _catalog_movies() if movies is None else movies
+    hashes = [(m["id"], _token_hashes(m)) for m in movies]
+    hashes = sorted((mid, h) for mid, h in hashes if len(h))  # sin tokens no hay similitud
+    ids = np.array([mid for mid, _ in hashes], dtype=np.int64)
+    sigs = np.empty((len(ids), NUM_PERM), dtype=np.uint32)
+    for i in range(0, len(ids), BUILD_CHUNK):
+        sigs[i:i + BUILD_CHUNK] = signatures([h for _, h in hashes[i:i + BUILD_CHUNK]])
+
+    keys = band_keys(sigs).T                                   # BANDS x n
+    pos = np.argsort(keys, axis=1, kind="stable").astype(np.int32)
+    keys = np.take_along_axis(keys, pos, axis=1)
+
+    os.makedirs(MODELS_DIR, exist_ok=True)
+    for name, arr in (("sigs", sigs), ("keys", keys), ("pos", pos), ("ids", ids)):  # ids al final: versión
+        tmp = _PATHS[name] + ".tmp"
+        with open(tmp, "wb") as f:
+            np.save(f, arr)
+        os.replace(tmp, _PATHS[name])
+    index.reload()
+    return {"movies": len(ids), "seconds": round(time.perf_counter() - t0, 3)}
+
+
+# ---------- Consulta ----------
+
+class SimilarIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._arrays = None   # (ids, sigs, keys, pos) con mmap
+        self._version = None
+
+    @property
+    def ready(self) -> bool:
+        return self._arrays is not None
+
+    def __len__(self) -> int:
+        return len(self._arrays[0]) if self._arrays is not None else 0
+
+    def reload(self) -> bool:
+        """Abre (o reabre si cambió) el índice guardado. False si no existe."""
+        try:
+            version = os.stat(_PATHS["ids"]).st_mtime_ns
+        except FileNotFoundError:
+            return False
+        with self._lock:
+            if version != self._version:
+                self._arrays = tuple(np.load(_PATHS[n], mmap_mode="r") for n in ("ids", "sigs", "keys", "pos"))
+                self._version = version
+        return True
+
+    def signature_of(self, movie_id: int) -> np.ndarray | None:
+        if self._arrays is None:
+            return None
+        ids = self._arrays[0]
+        i = int(np.searchsorted(ids, movie_id))
+        if i < len(ids) and ids[i] == movie_id:
+            return np.asarray(self._arrays[1][i])
+        return None
+
+    def similar(self, movie_id: int, k: int = 10, movie: dict | None = None) -> list[tuple[int, float]]:
+        """[(movie_id, jaccard estimado)] de las k más parecidas. Si la película
+        no está indexada, se usa `movie` (formato movie_enriched) para la firma."""
+        arrays = self._arrays
+        if arrays is None:
+            return []
+        ids, sigs, keys, pos = arrays
+        sig = self.signature_of(movie_id)
+        if sig is None:
+            if movie is None:
+                return []
+            h = _token_hashes(movie)
+            if not len(h):
+                return []
+            sig = signatures([h])[0]
+
+        qkeys = band_keys(sig[None, :])[0]
+        found = []
+        for b in range(BANDS):
+            lo = np.searchsorted(keys[b], qkeys[b], side="left")
+            hi = min(np.searchsorted(keys[b], qkeys[b], side="right"), lo + MAX_BUCKET)
+            if hi > lo:
+                found.append(pos[b, lo:hi])
+        if not found:
+            return []
+        cand = np.unique(np.concatenate(found))
+        cand = cand[ids[cand] != movie_id]
+        if cand.size == 0:
+            return []
+        sim = (np.asarray(sigs[cand]) == sig).mean(axis=1)
+        if cand.size > k:
+            top = np.argpartition(-sim, k - 1)[:k]
+            cand, sim = cand[top], sim[top]
+        order = np.lexsort((ids[cand], -sim))
+        return [(int(ids[cand[i]]), float(sim[i])) for i in order]
+
+
+index = SimilarIndex()
+
+
+if __name__ == "__main__":
+    info = build()
+    print(f"Índice de similares: {info['movies']} películas en {info['seconds']}s")
@@ -0,0 +1,44 @@
+"""
+Sincronización incremental del catálogo local con TMDb.
+
+    python sync_catalog.py                  # cambios recientes, títulos nuevos y filas caducadas
+    python sync_catalog.py --limit 20000    # máximo de películas a refrescar
+
+Pensado para ejecutarse periódicamente (cron/systemd timer).
+"""
+import time
+import asyncio
+import argparse
+
+from migrations import upgrade
+from catalog import sync, CATALOG_MAX_AGE
+from tmdb import close_client
+from similar_index import build as build_similar_index
+
+
+async def _run(max_age: float, limit: int) -> dict:
+    try:
+        return await sync(max_age=max_age, limit=limit)
+    finally:
+        await close_client()
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Sincroniza el catálogo local con TMDb")
+    parser.add_argument("--max-age", type=float, default=CATALOG_MAX_AGE,
+                        help="segundos tras los que una película se considera caducada")
+    parser.add_argument("--limit", type=int, default=5000)
+    args = parser.parse_args(argv)
+
+    upgrade()
+    t0 = time.perf_counter()
+    stats = asyncio.run(_run(args.max_age, args.limit))
+    print(f"Cambiadas en TMDb: {stats['changed_upstream']}, populares/estrenos vistos: {stats['discovered']}, "
+          f"refrescadas: {stats['refreshed']}, "
+          f"fallidas: {stats['failed']} ({time.perf_counter() - t0:.1f}s)")
+    info = build_similar_index()
+    print(f"Índice de similares: {info['movies']} películas en {info['seconds']}s")
+
+
+if __name__ == "__main__":
+    main()
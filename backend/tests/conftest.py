@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Los módulos del backend se importan planos (como con `uvicorn app:app` desde backend/)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
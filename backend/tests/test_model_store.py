@@ -0,0 +1,92 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+import model_store
+from model_store import ModelStore
+from tokenizer import legacy_token
+
+
+@pytest.fixture
+def store(tmp_path):
+    return ModelStore(str(tmp_path))
+
+
+def _files(store):
+    # Ficheros de datos (store.{generación}.ids / .w), sin el índice SQLite
+    return sorted(f for f in os.listdir(store.directory) if f.endswith((".ids", ".w")))
+
+
+def test_save_load_round_trip_sorts_tokens_with_their_weights(store):
+    version = store.save("ana", np.array([30, 10, 20]), np.array([3.0, 1.0, 2.0]))
+    ids, w, loaded_version = store.load("ana")
+    assert ids.tolist() == [10, 20, 30]
+    assert w.tolist() == [1.0, 2.0, 3.0]
+    assert ids.dtype == np.int64 and w.dtype == np.float32
+    assert loaded_version == version == store.version("ana")
+
+
+def test_missing_and_empty_models(store):
+    assert store.load("nadie") is None
+    assert store.version("nadie") is None
+    store.save("vacio", np.array([], dtype=np.int64), np.array([], dtype=np.float32))
+    ids, w, _ = store.load("vacio")
+    assert len(ids) == len(w) == 0
+
+
+def test_a_new_save_replaces_the_previous_model(store):
+    v1 = store.save("ana", np.array([1, 2]), np.array([1.0, 1.0]))
+    v2 = store.save("ana", np.array([5]), np.array([9.0]))
+    ids, w, version = store.load("ana")
+    assert (ids.tolist(), w.tolist(), version) == ([5], [9.0], v2)
+    assert v2 > v1
+    assert store.users() == ["ana"]
+
+
+def test_compact_keeps_live_models_and_drops_the_old_generation(store):
+    for i in range(5):
+        store.save("ana", np.arange(10) + i, np.full(10, i, np.float32))
+    store.save("luis", np.array([7]), np.array([0.5]))
+    before = _files(store)
+    info = store.compact()
+    assert info == {"users": 2, "before": 51, "after": 11}
+    assert _files(store) != before and len(_files(store)) == 2
+    ids, w, _ = store.load("ana")
+    assert ids.tolist() == list(range(4, 14)) and set(w.tolist()) == {4.0}
+    assert store.load("luis")[0].tolist() == [7]
+    # Sin obsoletos no hay nada que hacer con min_ratio
+    assert store.compact(min_ratio=model_store.COMPACT_RATIO) is None
+
+
+def test_save_compacts_once_dead_weights_pass_the_ratio(store, monkeypatch):
+    monkeypatch.setattr(model_store, "COMPACT_MIN", 0)
+    for i in range(20):
+        store.save(f"u{i % 2}", np.arange(100) + i, np.full(100, i, np.float32))
+        db = store._db()
+        size, live = store._meta(db, "size"), store._meta(db, "live")
+        assert live == 200 if i else live == 100
+        assert size - live <= model_store.COMPACT_RATIO * live
+    assert store._meta(store._db(), "generation") > 0
+    assert store.load("u0")[1][0] == 18.0 and store.load("u1")[1][0] == 19.0
+
+
+def test_live_count_survives_reopening(store):
+    store.save("ana", np.arange(4), np.ones(4))
+    store.save("ana", np.arange(3), np.ones(3))
+    reopened = ModelStore(store.directory)
+    db = reopened._db()
+    assert (reopened._meta(db, "size"), reopened._meta(db, "live")) == (7, 3)
+
+
+def test_migrate_user_imports_the_legacy_files(store):
+    np.save(os.path.join(store.directory, "ana_w.npy"), np.array([0.5, 0.25, 1.0]))
+    with open(os.path.join(store.directory, "ana_vocab.json"), "w", encoding="utf-8") as f:
+        json.dump({"g12": 0, "ttorrente": 1, "tel": 2}, f)
+    assert store.migrate_user("ana", remove=True)
+    ids, w, _ = store.load("ana")
+    expected = sorted([(legacy_token("g12"), 0.5), (legacy_token("ttorrente"), 0.25)])
+    assert list(zip(ids.tolist(), w.tolist())) == expected
+    assert not os.path.exists(os.path.join(store.directory, "ana_w.npy"))
+    assert not store.migrate_user("ana")
@@ -0,0 +1,46 @@
+import numpy as np
+
+from ranking import top_order, rank
+
+
+def _reference(scores, m):
+    # Orden completo estable por score descendente; a igualdad, por posición
+    order = sorted(range(len(scores)), key=lambda i: (-scores[i], i))
+    if m >= len(scores):
+        return order
+    kth = scores[order[m - 1]]
+    return [i for i in order if scores[i] >= kth]
+
+
+def test_ties_at_the_cut_are_all_returned_in_position_order():
+    scores = np.array([1.0, 3.0, 2.0, 2.0, 2.0, 0.0])
+    assert top_order(scores, 2).tolist() == [1, 2, 3, 4]
+    assert top_order(scores, 4).tolist() == [1, 2, 3, 4]
+    assert top_order(scores, 5).tolist() == [1, 2, 3, 4, 0]
+
+
+def test_m_at_least_n_orders_everything():
+    scores = np.array([0.5, 0.5, 0.9])
+    assert top_order(scores, 3).tolist() == [2, 0, 1]
+    assert top_order(scores, 10).tolist() == [2, 0, 1]
+
+
+def test_matches_a_stable_sort_on_random_ties():
+    rng = np.random.default_rng(0)
+    for _ in range(500):
+        n = int(rng.integers(1, 40))
+        scores = rng.integers(0, 5, n).astype(np.float64)  # muchos empates
+        m = int(rng.integers(1, n + 3))
+        assert top_order(scores, m).tolist() == _reference(scores.tolist(), m)
+
+
+def test_rank_breaks_ties_by_candidate_position():
+    candidates = [{"id": i, "vote_average": 0.0, "vote_count": 0} for i in range(6)]
+    top = rank(candidates, [0.5] * 6, k=3, ml_weight=1.0, min_votes=0, max_per_collection=2)
+    assert [c["id"] for c in top] == [0, 1, 2]
+
+
+def test_rank_caps_each_collection_after_the_tie_break():
+    candidates = [{"id": i, "collection_id": 7 if i < 3 else None} for i in range(5)]
+    top = rank(candidates, [0.9, 0.9, 0.9, 0.1, 0.1], k=4, ml_weight=1.0, min_votes=0, max_per_collection=2)
+    assert [c["id"] for c in top] == [0, 1, 3, 4]
@@ -0,0 +1,51 @@
+import tokenizer
+from tokenizer import movie_tokens, title_token, legacy_token, normalize_title
+
+
+def _movie(**fields):
+    return {"id": 1, "title": None, **fields}
+
+
+def test_same_id_in_each_namespace_is_a_different_token():
+    toks = [movie_tokens(_movie(genre_ids=[12])), movie_tokens(_movie(keyword_ids=[12])),
+            movie_tokens(_movie(director_ids=[12])), movie_tokens(_movie(collection_id=12))]
+    assert all(len(t) == 1 for t in toks)
+    assert len({t[0] for t in toks}) == 4
+    assert {t[0] >> tokenizer.ID_BITS for t in toks} == {
+        tokenizer.NS_GENRE, tokenizer.NS_KEYWORD, tokenizer.NS_DIRECTOR, tokenizer.NS_COLLECTION}
+
+
+def test_title_tokens_live_in_their_own_namespace():
+    tok = title_token("torrente")
+    assert tok >> tokenizer.ID_BITS == tokenizer.NS_TITLE
+    assert tok not in movie_tokens(_movie(genre_ids=[tok & ((1 << tokenizer.ID_BITS) - 1)]))
+
+
+def test_titles_are_folded_and_short_words_dropped():
+    assert normalize_title("¡El Señor de los Anillos!") == ["senor", "anillos"]
+    assert movie_tokens(_movie(title="Amélie")) == movie_tokens(_movie(id=2, title="AMELIE"))
+
+
+def test_cache_key_covers_the_ids_not_just_their_count():
+    # Mismo id y mismo número de keywords: antes se devolvían los tokens en caché
+    a = movie_tokens(_movie(keyword_ids=[1, 2]))
+    b = movie_tokens(_movie(keyword_ids=[3, 4]))
+    assert set(a) != set(b)
+    # Candidata de discover (sin keywords) y luego enriquecida
+    bare = movie_tokens(_movie(genre_ids=[28]))
+    full = movie_tokens(_movie(genre_ids=[28], keyword_ids=[7], director_ids=[9]))
+    assert set(bare) < set(full)
+
+
+def test_tokens_are_unique():
+    toks = movie_tokens(_movie(title="Rocky Rocky", genre_ids=[1, 1]))
+    assert len(toks) == len(set(toks)) == 2
+
+
+def test_legacy_tokens_map_to_the_integer_namespaces():
+    assert legacy_token("g12") == movie_tokens(_movie(genre_ids=[12]))[0]
+    assert legacy_token("c5") == movie_tokens(_movie(collection_id=5))[0]
+    assert legacy_token("ttorrente,") == title_token("torrente")
+    assert legacy_token("tel") is None       # palabra corta: ya no es token
+    assert legacy_token("x1") is None
+    assert legacy_token("gabc") is None
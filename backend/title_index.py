@@ -0,0 +1,263 @@
+import os
+import time
+import math
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from sqlalchemy import select
+
+from database import SessionLocal
+from models import CatalogMovie, MovieGenre
+from tokenizer import fold_words
+
+# Índice de títulos en memoria para el autocompletado de /search:
+#   prefijo de palabra normalizada (sin acentos, minúsculas) -> posiciones por popularidad
+# Cada palabra de la consulta debe ser prefijo de alguna palabra del título
+# ("senor anil" encuentra "El señor de los anillos"). Las listas de la foto
+# están ordenadas por popularidad y se intersecan empezando por la más corta,
+# así que una consulta rara no recorre miles de títulos. La foto es inmutable:
+# se construye fuera del lock y se publica de una vez; lo que llega después
+# (catálogo, resultados de TMDb) va a un delta pequeño hasta la siguiente.
+
+SEARCH_MIN_LOCAL = int(os.getenv("SEARCH_MIN_LOCAL", "5"))        # menos resultados: se pregunta a TMDb
+SEARCH_CACHE_SIZE = int(os.getenv("SEARCH_CACHE_SIZE", "5000"))   # consultas normalizadas en caché
+SEARCH_CACHE_TTL = float(os.getenv("SEARCH_CACHE_TTL", "600"))
+TITLE_DELTA_MAX = int(os.getenv("TITLE_DELTA_MAX", "2000"))       # títulos sueltos antes de rehacer la foto
+
+MAX_PREFIX = 12           # prefijos más largos se comprueban contra el título
+SCAN_FACTOR = 4           # coincidencias que se reordenan por cada resultado pedido
+MASK_MIN = 1024          # a partir de aquí la intersección usa una máscara por posición
+START_BONUS = 2.0         # título que empieza por la consulta (en unidades de log1p(votos))
+
+
+def normalize_query(query: str | None) -> str:
+    """Clave de caché: palabras sin acentos ni puntuación separadas por un espacio."""
+    return " ".join(fold_words(query))
+
+
+def _prefixes(words) -> set[str]:
+    return {w[:i] for w in words for i in range(1, min(len(w), MAX_PREFIX) + 1)}
+
+
+def _matches(words, tokens) -> bool:
+    return all(any(w.startswith(t) for w in words) for t in tokens)
+
+
+def _starts_with(words, tokens) -> bool:
+    return len(words) >= len(tokens) and all(w.startswith(t) for w, t in zip(words, tokens))
+
+
+class _Snapshot:
+    """Foto inmutable del índice: posiciones ordenadas por (-score, id) en formato CSR."""
+
+    def __init__(self, entries: dict):
+        self.entries = entries  # movie_id -> (película, palabras, score); no se modifica
+        # Orden con numpy: sorted() con tuplas no suelta el GIL en 100k comparaciones
+        ids = np.fromiter(entries, dtype=np.int64, count=len(entries))
+        scores = np.fromiter((entries[mid][2] for mid in entries), dtype=np.float64, count=len(entries))
+        self.ids = ids[np.lexsort((ids, -scores))].tolist()
+        lists = {}
+        for pos, mid in enumerate(self.ids):
+            for p in _prefixes(entries[mid][1]):
+                lists.setdefault(p, []).append(pos)
+        # Lista a lista (no con un solo fromiter) para soltar el GIL a las búsquedas
+        self.flat = np.empty(sum(map(len, lists.values())), dtype=np.int32)
+        self.spans = {}
+        start = 0
+        for p, post in lists.items():
+            self.spans[p] = (start, start + len(post))
+            self.flat[start:start + len(post)] = post
+            start += len(post)
+
+    def candidates(self, tokens: list[str]) -> np.ndarray:
+        """Posiciones (ya por popularidad) presentes en las listas de todos los prefijos."""
+        spans = [self.spans.get(t[:MAX_PREFIX]) for t in tokens]
+        if not all(spans):
+            return self.flat[:0]
+        posts = sorted((self.flat[a:b] for a, b in spans), key=len)
+        found = posts[0]
+        for post in posts[1:]:
+            if not len(found):
+                break
+            if len(found) > MASK_MIN:
+                # Listas largas: marcar una y filtrar la otra es más barato que buscar cada posición
+                mask = np.zeros(len(self.ids), dtype=bool)
+                mask[post] = True
+                found = found[mask[found]]
+            else:
+                i = np.minimum(np.searchsorted(post, found), len(post) - 1)
+                found = found[post[i] == found]
+        return found
+
+
+class TitleIndex:
+    def __init__(self):
+        self._lock = threading.Lock()         # protege el delta y la publicación de la foto
+        self._build_lock = threading.Lock()   # una reconstrucción a la vez, para no perder títulos
+        self._snap = _Snapshot({})
+        self._delta = {}        # movie_id -> (película, palabras, score) posteriores a la foto
+        self._delta_postings = {}   # prefijo -> {movie_id} del delta
+        self._rebuilding = False
+        self.ready = False
+
+    def __len__(self) -> int:
+        snap = self._snap
+        with self._lock:
+            return len(snap.entries) + sum(1 for mid in self._delta if mid not in snap.entries)
+
+    def _current(self, mid: int):
+        return self._delta.get(mid) or self._snap.entries.get(mid)
+
+    def add_many(self, movies: list[dict]) -> None:
+        """Añade o actualiza películas (resultados de búsqueda o formato movie_enriched)."""
+        movies = [m for m in movies if m and m.get("title")]
+        with self._lock:
+            for m in movies:
+                old = self._current(m["id"])
+                mid, words, score = self._parse(m, old)
+                if old is not None and words == old[1] and score == old[2]:
+                    old[0].update(self._entry(m, old[0]))
+                    continue
+                self._put_delta(mid, (self._entry(m, old[0] if old else {}), words, score))
+            start = len(self._delta) > TITLE_DELTA_MAX and not self._rebuilding
+            self._rebuilding = self._rebuilding or start
+        if start:
+            threading.Thread(target=self._rebuild, daemon=True).start()
+
+    def _put_delta(self, mid: int, item: tuple) -> None:
+        self._drop_delta(mid)
+        self._delta[mid] = item
+        for p in _prefixes(item[1]):
+            self._delta_postings.setdefault(p, set()).add(mid)
+
+    def _drop_delta(self, mid: int) -> None:
+        old = self._delta.pop(mid, None)
+        if old is None:
+            return
+        for p in _prefixes(old[1]):
+            post = self._delta_postings[p]
+            post.discard(mid)
+            if not post:
+                del self._delta_postings[p]
+
+    def _rebuild(self, base: dict | None = None) -> None:
+        """Construye una foto nueva fuera del lock y la publica; el delta pasa a ella."""
+        try:
+            with self._build_lock:
+                self._swap(base)
+        finally:
+            with self._lock:
+                self._rebuilding = False
+
+    def _swap(self, base: dict | None) -> None:
+        with self._lock:
+            snap, taken = self._snap, dict(self._delta)
+        entries = dict(snap.entries)
+        entries.update(base or {})
+        entries.update(taken)
+        new = _Snapshot(entries)
+        with self._lock:
+            self._snap = new
+            for mid, item in taken.items():
+                if self._delta.get(mid) is item:
+                    self._drop_delta(mid)
+
+    def _parse(self, m: dict, old) -> tuple[int, tuple, float]:
+        votes = m.get("vote_count")
+        score = math.log1p(votes) if votes is not None else (old[2] if old else 0.0)
+        return m["id"], tuple(fold_words(m["title"])), score
+
+    @staticmethod
+    def _entry(m: dict, old: dict) -> dict:
+        # Lo que no trae la fuente nueva (póster, géneros) se conserva
+        return {"id": m["id"], "title": m["title"],
+                "poster_path": m.get("poster_path") or old.get("poster_path"),
+                "genre_ids": list(m.get("genre_ids") or old.get("genre_ids") or [])}
+
+    def build_from_db(self) -> None:
+        """Carga los títulos del catálogo con consultas planas, sin bloquear las búsquedas."""
+        db = SessionLocal()
+        try:
+            movies = {mid: {"id": mid, "title": title, "poster_path": poster, "vote_count": votes or 0,
+                            "genre_ids": []}
+                      for mid, title, poster, votes in db.execute(
+                          select(CatalogMovie.id, CatalogMovie.title, CatalogMovie.poster_path,
+                                 CatalogMovie.vote_count))
+                      if title}
+            for mid, genre in db.execute(select(MovieGenre.movie_id, MovieGenre.genre_id)
+                                         .order_by(MovieGenre.movie_id, MovieGenre.genre_id)):
+                if mid in movies:
+                    movies[mid]["genre_ids"].append(genre)
+        finally:
+            db.close()
+        base = {}
+        for m in movies.values():
+            mid, words, score = self._parse(m, None)
+            base[mid] = (self._entry(m, {}), words, score)
+        self._rebuild(base)
+        self.ready = True
+
+    def search(self, query: str, k: int = 20) -> list[dict]:
+        """Top-k películas cuyo título contiene, como prefijos de palabra, todas las de la consulta."""
+        tokens = fold_words(query)
+        if not tokens or k <= 0:
+            return []
+        limit = k * SCAN_FACTOR
+        check = any(len(t) > MAX_PREFIX for t in tokens)  # los prefijos cortos ya bastan
+        snap = self._snap
+        hits = []
+        with self._lock:
+            # Delta: pocas películas, conjuntos pequeños
+            posts = [self._delta_postings.get(t[:MAX_PREFIX]) for t in tokens]
+            if all(posts):
+                for mid in set.intersection(*sorted(posts, key=len)):
+                    item = self._delta[mid]
+                    if not check or _matches(item[1], tokens):
+                        hits.append(item)
+            shadowed = set(self._delta)
+        found = 0
+        candidates = snap.candidates(tokens)
+        for start in range(0, len(candidates), limit):   # por tramos: casi nunca hace falta más de uno
+            for pos in candidates[start:start + limit].tolist():
+                mid = snap.ids[pos]
+                item = snap.entries[mid]
+                if mid in shadowed or (check and not _matches(item[1], tokens)):
+                    continue
+                hits.append(item)
+                found += 1
+            if found >= limit:
+                break
+        # Entre las más populares, primero las que empiezan por la consulta
+        hits.sort(key=lambda item: (-item[2] - START_BONUS * _starts_with(item[1], tokens), item[0]["id"]))
+        return [dict(item[0]) for item in hits[:k]]
+
+
+class SearchCache:
+    """Resultados de /search por consulta normalizada (LRU con TTL)."""
+
+    def __init__(self, max_items: int = SEARCH_CACHE_SIZE, ttl: float = SEARCH_CACHE_TTL):
+        self.max_items = max_items
+        self.ttl = ttl
+        self._items = OrderedDict()  # consulta -> (resultados, expires_at)
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None or item[1] <= time.time():
+                return None
+            self._items.move_to_end(key)
+            return item[0]
+
+    def put(self, key: str, results: list) -> None:
+        with self._lock:
+            self._items[key] = (results, time.time() + self.ttl)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+
+
+index = TitleIndex()
+search_cache = SearchCache()
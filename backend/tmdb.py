@@ -1,223 +1,279 @@
-import os
-import requests
-from dotenv import load_dotenv
-
-load_dotenv()
-
-TMDB_API_KEY = os.getenv("TMDB_API_KEY")
-TMDB_LANG = os.getenv("TMDB_LANG", "es-ES")
-TMDB_REGION = os.getenv("TMDB_REGION", "ES")
-TMDB_BASE = "https://api.themoviedb.org/3"
-
-if not TMDB_API_KEY:
-    raise RuntimeError("TMDB_API_KEY no está configurada. Copia .env.example a .env y edita tu clave.")
-
-session = requests.Session()
-
-
-def search_movies(query: str):
-    url = f"{TMDB_BASE}/search/movie"
-    params = {
-        "api_key": TMDB_API_KEY,
-        "query": query,
-        "include_adult": False,
-        "language": TMDB_LANG,
-        "region": TMDB_REGION,
-        "page": 1,
-    }
-    r = session.get(url, params=params, timeout=20)
-    r.raise_for_status()
-    data = r.json()
-    results = []
-    for m in data.get("results", []):
-        results.append({
-            "id": m["id"],
-            "title": m.get("title") or m.get("name"),
-            "poster_path": m.get("poster_path"),
-            "genre_ids": m.get("genre_ids", []),
-        })
-    return results
-
-
-def popular_movies(page: int = 1):
-    url = f"{TMDB_BASE}/movie/popular"
-    params = {
-        "api_key": TMDB_API_KEY,
-        "language": TMDB_LANG,
-        "region": TMDB_REGION,
-        "page": page,
-    }
-    r = session.get(url, params=params, timeout=20)
-    r.raise_for_status()
-    data = r.json()
-    results = []
-    for m in data.get("results", []):
-        results.append({
-            "id": m["id"],
-            "title": m.get("title"),
-            "poster_path": m.get("poster_path"),
-            "genre_ids": m.get("genre_ids", []),
-        })
-    return results
-
-
-def movie_details(movie_id: int):
-    """Detalles básicos para asegurar genre_ids."""
-    url = f"{TMDB_BASE}/movie/{movie_id}"
-    params = {"api_key": TMDB_API_KEY, "language": TMDB_LANG}
-    r = session.get(url, params=params, timeout=20)
-    r.raise_for_status()
-    m = r.json()
-    return {
-        "id": m["id"],
-        "title": m.get("title"),
-        "poster_path": m.get("poster_path"),
-        "genre_ids": [g["id"] for g in m.get("genres", [])],
-    }
-
-
-def discover_by_genres(genre_ids: list[int], page: int = 1):
-    """Candidatas usando géneros del usuario (incluye voto)."""
-    url = f"{TMDB_BASE}/discover/movie"
-    params = {
-        "api_key": TMDB_API_KEY,
-        "language": TMDB_LANG,
-        "region": TMDB_REGION,
-        "include_adult": False,
-        "sort_by": "popularity.desc",
-        "with_genres": ",".join(map(str, genre_ids)) if genre_ids else "",
-        "page": page,
-    }
-    r = session.get(url, params=params, timeout=20)
-    r.raise_for_status()
-    data = r.json()
-    results = []
-    for m in data.get("results", []):
-        results.append({
-            "id": m["id"],
-            "title": m.get("title"),
-            "poster_path": m.get("poster_path"),
-            "genre_ids": m.get("genre_ids", []),
-            "vote_average": m.get("vote_average", 0.0),
-            "vote_count": m.get("vote_count", 0),
-        })
-    return results
-
-
-def movie_enriched(movie_id: int):
-    """Detalles enriquecidos: géneros, keywords, directores y colección + voto."""
-    url = f"{TMDB_BASE}/movie/{movie_id}"
-    params = {
-        "api_key": TMDB_API_KEY,
-        "language": TMDB_LANG,
-        "append_to_response": "keywords,credits",
-    }
-    r = session.get(url, params=params, timeout=20)
-    r.raise_for_status()
-    m = r.json()
-
-    genres = [g["id"] for g in m.get("genres", [])]
-
-    kw_container = m.get("keywords", {})
-    if isinstance(kw_container, dict):
-        keyword_ids = [k["id"] for k in kw_container.get("keywords", [])]
-    elif isinstance(kw_container, list):
-        keyword_ids = [k["id"] for k in kw_container]
-    else:
-        keyword_ids = []
-
-    directors = []
-    credits = m.get("credits", {})
-    for crew in credits.get("crew", []) or []:
-        if crew.get("job") == "Director":
-            directors.append(crew["id"])
-
-    collection_id = None
-    col = m.get("belongs_to_collection")
-    if isinstance(col, dict):
-        collection_id = col.get("id")
-
-    return {
-        "id": m["id"],
-        "title": m.get("title"),
-        "poster_path": m.get("poster_path"),
-        "genre_ids": genres,
-        "keyword_ids": keyword_ids,
-        "director_ids": directors,
-        "collection_id": collection_id,
-        "vote_average": m.get("vote_average", 0.0),
-        "vote_count": m.get("vote_count", 0),
-    }
-
-
-def collection_movies(collection_id: int):
-    """Películas de una colección/franquicia (incluye voto)."""
-    if not collection_id:
-        return []
-    url = f"{TMDB_BASE}/collection/{collection_id}"
-    params = {"api_key": TMDB_API_KEY, "language": TMDB_LANG}
-    r = session.get(url, params=params, timeout=20)
-    r.raise_for_status()
-    data = r.json()
-    out = []
-    for m in data.get("parts", []):
-        out.append({
-            "id": m["id"],
-            "title": m.get("title"),
-            "poster_path": m.get("poster_path"),
-            "genre_ids": m.get("genre_ids", []),
-            "vote_average": m.get("vote_average", 0.0),
-            "vote_count": m.get("vote_count", 0),
-        })
-    return out
-
-
-def discover_by_keywords(keyword_ids: list[int], page: int = 1):
-    """Candidatas por palabras clave (temas/personajes/franquicias) con voto."""
-    if not keyword_ids:
-        return []
-    url = f"{TMDB_BASE}/discover/movie"
-    params = {
-        "api_key": TMDB_API_KEY,
-        "language": TMDB_LANG,
-        "region": TMDB_REGION,
-        "include_adult": False,
-        "sort_by": "popularity.desc",
-        "with_keywords": ",".join(map(str, keyword_ids)),
-        "page": page,
-    }
-    r = session.get(url, params=params, timeout=20)
-    r.raise_for_status()
-    data = r.json()
-    results = []
-    for m in data.get("results", []):
-        results.append({
-            "id": m["id"],
-            "title": m.get("title"),
-            "poster_path": m.get("poster_path"),
-            "genre_ids": m.get("genre_ids", []),
-            "vote_average": m.get("vote_average", 0.0),
-            "vote_count": m.get("vote_count", 0),
-        })
-    return results
-
-
-def person_directed_movies(person_id: int):
-    """Filmografía como director (incluye voto)."""
-    url = f"{TMDB_BASE}/person/{person_id}/movie_credits"
-    params = {"api_key": TMDB_API_KEY, "language": TMDB_LANG}
-    r = session.get(url, params=params, timeout=20)
-    r.raise_for_status()
-    data = r.json()
-    out = []
-    for c in data.get("crew", []):
-        if c.get("job") == "Director":
-            out.append({
-                "id": c["id"],
-                "title": c.get("title"),
-                "poster_path": c.get("poster_path"),
-                "genre_ids": c.get("genre_ids", []),
-                "vote_average": c.get("vote_average", 0.0),
-                "vote_count": c.get("vote_count", 0),
-            })
-    return out
+import os
+import asyncio
+
+from dotenv import load_dotenv
+
+from cache import cached
+from tmdb_client import TMDbClient
+from metrics import Callback
+
+load_dotenv()
+
+TMDB_API_KEY = os.getenv("TMDB_API_KEY")
+TMDB_LANG = os.getenv("TMDB_LANG", "es-ES")
+TMDB_REGION = os.getenv("TMDB_REGION", "ES")
+TMDB_BASE = os.getenv("TMDB_BASE", "https://api.themoviedb.org/3")  # otro servidor: ver bench/
+
+MAX_CONCURRENCY = int(os.getenv("TMDB_MAX_CONCURRENCY", "8"))
+
+client = TMDbClient(TMDB_BASE, TMDB_API_KEY)
+
+Callback("tmdb_requests_total", "Peticiones a TMDb: lanzadas, agrupadas con otra en vuelo o rechazadas por el breaker",
+         lambda: {(k,): client.stats()[k] for k in ("issued", "coalesced", "rejected")},
+         kind="counter", labelnames=("result",))
+Callback("tmdb_in_flight", "Peticiones a TMDb en vuelo", lambda: client.stats()["in_flight"])
+Callback("tmdb_limiter_waiting", "Peticiones esperando turno en el limitador", lambda: client.stats()["limiter"]["waiting"])
+Callback("tmdb_breaker_open", "1 si el circuit breaker no está cerrado", lambda: int(client.breaker.state != "closed"))
+
+
+async def close_client() -> None:
+    await client.aclose()
+
+
+def _cached(kind: str):
+    # El idioma/región forman parte de la clave: cambian la respuesta de TMDb
+    return cached(kind, namespace=f"{TMDB_LANG}-{TMDB_REGION}")
+
+
+@_cached("search")
+async def search_movies(query: str):
+    path = "/search/movie"
+    params = {
+        "query": query,
+        "include_adult": False,
+        "language": TMDB_LANG,
+        "region": TMDB_REGION,
+        "page": 1,
+    }
+    data = await client.get_json(path, params)
+    results = []
+    for m in data.get("results", []):
+        results.append({
+            "id": m["id"],
+            "title": m.get("title") or m.get("name"),
+            "poster_path": m.get("poster_path"),
+            "genre_ids": m.get("genre_ids", []),
+            "vote_count": m.get("vote_count", 0),
+        })
+    return results
+
+
+@_cached("popular")
+async def popular_movies(page: int = 1):
+    path = "/movie/popular"
+    params = {
+        "language": TMDB_LANG,
+        "region": TMDB_REGION,
+        "page": page,
+    }
+    data = await client.get_json(path, params)
+    results = []
+    for m in data.get("results", []):
+        results.append({
+            "id": m["id"],
+            "title": m.get("title"),
+            "poster_path": m.get("poster_path"),
+            "genre_ids": m.get("genre_ids", []),
+        })
+    return results
+
+
+@_cached("movie")
+async def movie_details(movie_id: int):
+    """Detalles básicos para asegurar genre_ids."""
+    path = f"/movie/{movie_id}"
+    params = {"language": TMDB_LANG}
+    m = await client.get_json(path, params)
+    return {
+        "id": m["id"],
+        "title": m.get("title"),
+        "poster_path": m.get("poster_path"),
+        "genre_ids": [g["id"] for g in m.get("genres", [])],
+    }
+
+
+@_cached("discover")
+async def discover_by_genres(genre_ids: list[int], page: int = 1):
+    """Candidatas usando géneros del usuario (incluye voto)."""
+    path = "/discover/movie"
+    params = {
+        "language": TMDB_LANG,
+        "region": TMDB_REGION,
+        "include_adult": False,
+        "sort_by": "popularity.desc",
+        "with_genres": ",".join(map(str, genre_ids)) if genre_ids else "",
+        "page": page,
+    }
+    data = await client.get_json(path, params)
+    results = []
+    for m in data.get("results", []):
+        results.append({
+            "id": m["id"],
+            "title": m.get("title"),
+            "poster_path": m.get("poster_path"),
+            "genre_ids": m.get("genre_ids", []),
+            "vote_average": m.get("vote_average", 0.0),
+            "vote_count": m.get("vote_count", 0),
+        })
+    return results
+
+
+@_cached("discover")
+async def discover_recent(released_after: str, page: int = 1):
+    """Estrenos desde released_after (YYYY-MM-DD), los más populares primero."""
+    path = "/discover/movie"
+    params = {
+        "language": TMDB_LANG,
+        "region": TMDB_REGION,
+        "include_adult": False,
+        "sort_by": "popularity.desc",
+        "primary_release_date.gte": released_after,
+        "page": page,
+    }
+    data = await client.get_json(path, params)
+    return [{"id": m["id"], "title": m.get("title")} for m in data.get("results", [])]
+
+
+@_cached("movie")
+async def movie_enriched(movie_id: int):
+    """Detalles enriquecidos: géneros, keywords, directores y colección + voto."""
+    path = f"/movie/{movie_id}"
+    params = {
+        "language": TMDB_LANG,
+        "append_to_response": "keywords,credits",
+    }
+    m = await client.get_json(path, params)
+
+    genres = [g["id"] for g in m.get("genres", [])]
+
+    kw_container = m.get("keywords", {})
+    if isinstance(kw_container, dict):
+        keyword_ids = [k["id"] for k in kw_container.get("keywords", [])]
+    elif isinstance(kw_container, list):
+        keyword_ids = [k["id"] for k in kw_container]
+    else:
+        keyword_ids = []
+
+    directors = []
+    credits = m.get("credits", {})
+    for crew in credits.get("crew", []) or []:
+        if crew.get("job") == "Director":
+            directors.append(crew["id"])
+
+    collection_id = None
+    col = m.get("belongs_to_collection")
+    if isinstance(col, dict):
+        collection_id = col.get("id")
+
+    return {
+        "id": m["id"],
+        "title": m.get("title"),
+        "poster_path": m.get("poster_path"),
+        "genre_ids": genres,
+        "keyword_ids": keyword_ids,
+        "director_ids": directors,
+        "collection_id": collection_id,
+        "vote_average": m.get("vote_average", 0.0),
+        "vote_count": m.get("vote_count", 0),
+    }
+
+
+@_cached("collection")
+async def collection_movies(collection_id: int):
+    """Películas de una colección/franquicia (incluye voto)."""
+    if not collection_id:
+        return []
+    path = f"/collection/{collection_id}"
+    params = {"language": TMDB_LANG}
+    data = await client.get_json(path, params)
+    out = []
+    for m in data.get("parts", []):
+        out.append({
+            "id": m["id"],
+            "title": m.get("title"),
+            "poster_path": m.get("poster_path"),
+            "genre_ids": m.get("genre_ids", []),
+            "vote_average": m.get("vote_average", 0.0),
+            "vote_count": m.get("vote_count", 0),
+        })
+    return out
+
+
+@_cached("discover")
+async def discover_by_keywords(keyword_ids: list[int], page: int = 1):
+    """Candidatas por palabras clave (temas/personajes/franquicias) con voto."""
+    if not keyword_ids:
+        return []
+    path = "/discover/movie"
+    params = {
+        "language": TMDB_LANG,
+        "region": TMDB_REGION,
+        "include_adult": False,
+        "sort_by": "popularity.desc",
+        "with_keywords": ",".join(map(str, keyword_ids)),
+        "page": page,
+    }
+    data = await client.get_json(path, params)
+    results = []
+    for m in data.get("results", []):
+        results.append({
+            "id": m["id"],
+            "title": m.get("title"),
+            "poster_path": m.get("poster_path"),
+            "genre_ids": m.get("genre_ids", []),
+            "vote_average": m.get("vote_average", 0.0),
+            "vote_count": m.get("vote_count", 0),
+        })
+    return results
+
+
+@_cached("person")
+async def person_directed_movies(person_id: int):
+    """Filmografía como director (incluye voto)."""
+    path = f"/person/{person_id}/movie_credits"
+    params = {"language": TMDB_LANG}
+    data = await client.get_json(path, params)
+    out = []
+    for c in data.get("crew", []):
+        if c.get("job") == "Director":
+            out.append({
+                "id": c["id"],
+                "title": c.get("title"),
+                "poster_path": c.get("poster_path"),
+                "genre_ids": c.get("genre_ids", []),
+                "vote_average": c.get("vote_average", 0.0),
+                "vote_count": c.get("vote_count", 0),
+            })
+    return out
+
+
+async def movie_changes(start_date: str, page: int = 1):
+    """Ids de películas modificadas en TMDb desde start_date (YYYY-MM-DD, máx. 14 días).
+    Sin caché: es la fuente de la sincronización incremental del catálogo."""
+    data = await client.get_json("/movie/changes", {"start_date": start_date, "page": page})
+    ids = [m["id"] for m in data.get("results", []) if not m.get("adult")]
+    return ids, data.get("total_pages", 1)
+
+
+async def fetch_many(calls: list[tuple], max_concurrency: int = MAX_CONCURRENCY) -> list:
+    """Ejecuta [(fn, arg1, ...), ...] concurrentemente con concurrencia acotada.
+    Devuelve los resultados en el mismo orden; None donde la llamada falló."""
+    sem = asyncio.Semaphore(max(1, max_concurrency))
+
+    async def run(fn, *args):
+        async with sem:
+            try:
+                return await fn(*args)
+            except Exception:
+                return None
+
+    return await asyncio.gather(*(run(*c) for c in calls))
+
+
+async def movie_enriched_many(movie_ids: list[int],
+                              max_concurrency: int = MAX_CONCURRENCY,
+                              refresh: bool = False) -> list:
+    """movie_enriched en lote; None en las posiciones cuya petición falló.
+    Con refresh=True se ignora la caché (sincronización del catálogo)."""
+    fn = movie_enriched.refresh if refresh else movie_enriched
+    return await fetch_many([(fn, mid) for mid in movie_ids], max_concurrency=max_concurrency)
@@ -0,0 +1,288 @@
+import os
+import re
+import json
+import time
+import heapq
+import random
+import asyncio
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+import httpx
+
+from metrics import Histogram
+
+# Cliente HTTP asíncrono para TMDb: conexiones keep-alive reutilizadas,
+# timeouts y reintentos con backoff exponencial (429, 5xx y errores de red).
+# Peticiones idénticas simultáneas (mismo path y parámetros) comparten una sola
+# petición en vuelo ("single-flight").
+# Todas las peticiones pasan por un token bucket con carriles de prioridad
+# (favoritos > candidatas > tareas de fondo) y un circuit breaker: si TMDb
+# falla repetidamente, se deja de llamar durante un tiempo y los fetchers
+# sirven lo que haya en caché aunque esté caducado (ver cache.cached).
+
+TMDB_TIMEOUT = float(os.getenv("TMDB_TIMEOUT", "10"))
+TMDB_MAX_CONNECTIONS = int(os.getenv("TMDB_MAX_CONNECTIONS", "32"))
+TMDB_RETRIES = int(os.getenv("TMDB_RETRIES", "3"))
+TMDB_BACKOFF = float(os.getenv("TMDB_BACKOFF", "0.3"))
+TMDB_RATE = float(os.getenv("TMDB_RATE", "40"))            # peticiones/segundo sostenidas
+TMDB_BURST = int(os.getenv("TMDB_BURST", "40"))
+TMDB_BREAKER_FAILURES = int(os.getenv("TMDB_BREAKER_FAILURES", "5"))  # fallos seguidos para abrir
+TMDB_BREAKER_COOLDOWN = float(os.getenv("TMDB_BREAKER_COOLDOWN", "30"))
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+TMDB_SECONDS = Histogram("tmdb_request_seconds", "Duración de cada intento de petición HTTP a TMDb",
+                         ("endpoint", "status"))
+_ID = re.compile(r"/\d+")
+
+# Carriles de prioridad (menor = antes)
+HIGH, NORMAL, LOW = 0, 1, 2
+_priority = ContextVar("tmdb_priority", default=NORMAL)
+
+
+@contextmanager
+def priority(level: int):
+    """Prioridad de las peticiones a TMDb hechas dentro del bloque (y de sus tareas hijas)."""
+    token = _priority.set(level)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def current_priority() -> int:
+    return _priority.get()
+
+
+class TMDbUnavailable(RuntimeError):
+    """El circuit breaker está abierto: no se llama a TMDb."""
+
+    def __init__(self, message: str, retry_after: float = 0.0):
+        super().__init__(message)
+        self.retry_after = retry_after  # segundos hasta la siguiente prueba
+
+
+class TokenBucket:
+    """Token bucket asíncrono; los que esperan salen por (prioridad, orden de llegada)."""
+
+    def __init__(self, rate: float = TMDB_RATE, burst: int = TMDB_BURST):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._waiters = []   # heap de (prioridad, seq, future)
+        self._seq = 0
+        self._timer = None
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, level: int = NORMAL) -> None:
+        now = time.monotonic()
+        self._refill(now)
+        if not self._waiters and self._tokens >= 1 and now >= self._paused_until:
+            self._tokens -= 1
+            return
+        fut = asyncio.get_running_loop().create_future()
+        self._seq += 1
+        heapq.heappush(self._waiters, (level, self._seq, fut))
+        self._schedule()
+        await fut  # si se cancela, _dispatch la descarta
+
+    def pause(self, seconds: float) -> None:
+        """Nadie sale durante `seconds` (Retry-After de TMDb)."""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = min(self._tokens, 0.0)
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        self._schedule()
+
+    def _dispatch(self) -> None:
+        self._timer = None
+        now = time.monotonic()
+        self._refill(now)
+        while self._waiters and self._tokens >= 1 and now >= self._paused_until:
+            _, _, fut = heapq.heappop(self._waiters)
+            if not fut.done():
+                self._tokens -= 1
+                fut.set_result(None)
+        self._schedule()
+
+    def _schedule(self) -> None:
+        while self._waiters and self._waiters[0][2].done():
+            heapq.heappop(self._waiters)
+        if self._timer is None and self._waiters:
+            now = time.monotonic()
+            delay = max(self._paused_until - now, (1 - self._tokens) / self.rate, 0.0)
+            self._timer = asyncio.get_running_loop().call_later(delay, self._dispatch)
+
+    def stats(self) -> dict:
+        return {"tokens": round(self._tokens, 2), "waiting": len(self._waiters),
+                "paused_for": round(max(0.0, self._paused_until - time.monotonic()), 2)}
+
+
+class CircuitBreaker:
+    """closed -> open tras `failures` fallos seguidos. Pasado `cooldown` deja salir
+    una petición de prueba (half-open): si va bien se cierra; si no, otro cooldown."""
+
+    def __init__(self, failures: int = TMDB_BREAKER_FAILURES, cooldown: float = TMDB_BREAKER_COOLDOWN):
+        self.failures = failures
+        self.cooldown = cooldown
+        self._count = 0
+        self._opened_at = None
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return "closed"
+        return "half-open" if time.monotonic() - self._opened_at >= self.cooldown else "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "half-open":
+            self._opened_at = time.monotonic()  # solo una prueba por cooldown
+        return state != "open"
+
+    def retry_after(self) -> float:
+        if self._opened_at is None:
+            return 0.0
+        return max(0.0, self.cooldown - (time.monotonic() - self._opened_at))
+
+    def success(self) -> None:
+        self._count = 0
+        self._opened_at = None
+
+    def failure(self) -> None:
+        self._count += 1
+        if self._count >= self.failures:
+            self._opened_at = time.monotonic()
+
+
+class TMDbClient:
+    def __init__(self,
+                 base_url: str,
+                 api_key: str | None,
+                 timeout: float = TMDB_TIMEOUT,
+                 max_connections: int = TMDB_MAX_CONNECTIONS,
+                 retries: int = TMDB_RETRIES,
+                 backoff: float = TMDB_BACKOFF,
+                 rate: float = TMDB_RATE,
+                 burst: int = TMDB_BURST):
+        self.base_url = base_url
+        self.api_key = api_key
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self.retries = retries
+        self.backoff = backoff
+        self.rate = rate
+        self.burst = burst
+        self.breaker = CircuitBreaker()
+        self._limiter = TokenBucket(rate, burst)
+        self._client = None
+        self._loop = None
+        self._inflight = {}    # (path, params) -> Task compartida
+        self.issued = 0        # peticiones lanzadas a TMDb (sin contar reintentos)
+        self.coalesced = 0     # peticiones servidas por una ya en vuelo
+        self.rejected = 0      # rechazadas con el circuit breaker abierto
+
+    def _http(self) -> httpx.AsyncClient:
+        # httpx.AsyncClient va ligado al event loop que lo creó
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._loop is not loop:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=httpx.Timeout(self.timeout, connect=min(self.timeout, 5.0)),
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections,
+                ),
+            )
+            self._loop = loop
+            self._inflight = {}
+            self._limiter = TokenBucket(self.rate, self.burst)  # sus futures van ligados al loop
+        return self._client
+
+    def _delay(self, attempt: int, response=None) -> float:
+        if response is not None:
+            retry_after = response.headers.get("Retry-After")
+            if retry_after and retry_after.isdigit():
+                return float(retry_after)
+        return self.backoff * (2 ** attempt) * (1 + random.random())
+
+    async def get_json(self, path: str, params: dict | None = None) -> dict:
+        """JSON de TMDb. El resultado puede estar compartido entre llamadores: no modificarlo."""
+        if not self.api_key:
+            # Se comprueba aquí y no al importar: la app arranca (y se puede medir) sin clave
+            raise RuntimeError("TMDB_API_KEY no está configurada. Copia .env.example a .env y edita tu clave.")
+        self._http()
+        key = (path, json.dumps(params or {}, sort_keys=True))
+        task = self._inflight.get(key)
+        if task is None:
+            self.issued += 1
+            # Task propia: si el primer llamador se cancela, los demás siguen esperando
+            task = asyncio.ensure_future(self._fetch(path, params))
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._done(key, t))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def _done(self, key, task) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            task.exception()  # marcada como recogida aunque ya no la espere nadie
+
+    def stats(self) -> dict:
+        return {"issued": self.issued, "coalesced": self.coalesced, "rejected": self.rejected,
+                "in_flight": len(self._inflight),
+                "breaker": self.breaker.state, "limiter": self._limiter.stats()}
+
+    async def _fetch(self, path: str, params: dict | None) -> dict:
+        if not self.breaker.allow():
+            self.rejected += 1
+            raise TMDbUnavailable(f"TMDb no disponible (circuit breaker {self.breaker.state})",
+                                  retry_after=self.breaker.retry_after())
+        params = {"api_key": self.api_key, **(params or {})}
+        level = _priority.get()
+        endpoint = _ID.sub("/{id}", path)
+        for attempt in range(self.retries + 1):
+            last = attempt == self.retries
+            await self._limiter.acquire(level)
+            t0 = time.perf_counter()
+            try:
+                r = await self._http().get(path, params=params)
+            except httpx.TransportError:
+                TMDB_SECONDS.observe(time.perf_counter() - t0, endpoint=endpoint, status="error")
+                if last:
+                    self.breaker.failure()
+                    raise
+                await asyncio.sleep(self._delay(attempt))
+                continue
+            TMDB_SECONDS.observe(time.perf_counter() - t0, endpoint=endpoint, status=r.status_code)
+            if r.status_code in RETRY_STATUS:
+                if last:
+                    self.breaker.failure()
+                    r.raise_for_status()
+                if r.status_code == 429:
+                    # Límite superado: se frena a todos, no solo a esta petición
+                    self._limiter.pause(self._delay(attempt, r))
+                else:
+                    await asyncio.sleep(self._delay(attempt, r))
+                continue
+            self.breaker.success()
+            r.raise_for_status()
+            return r.json()
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            # Un cliente de otro event loop (ya cerrado) solo se descarta
+            if self._loop is asyncio.get_running_loop():
+                await self._client.aclose()
+            self._client = None
+            self._loop = None
+            self._inflight = {}
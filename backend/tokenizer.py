@@ -0,0 +1,89 @@
+import re
+import zlib
+import unicodedata
+from functools import lru_cache
+
+# Tokens de película como enteros de 64 bits: (espacio << 40) | id.
+# Géneros, keywords, directores y colección usan directamente su id de TMDb;
+# las palabras del título, un hash estable (crc32) de la palabra normalizada.
+# Así no se construye ningún string por película y el vocabulario es un array.
+
+NS_GENRE = 1
+NS_KEYWORD = 2
+NS_DIRECTOR = 3
+NS_COLLECTION = 4
+NS_TITLE = 5
+ID_BITS = 40
+
+MIN_TITLE_WORD = 5        # palabras más cortas (artículos, preposiciones) no aportan
+TOKEN_CACHE_SIZE = 100_000
+
+_WORD = re.compile(r"[^\W_]+")
+# Letras latinas acentuadas -> letra base (camino rápido; el resto pasa por NFKD)
+_FOLD = {c: unicodedata.normalize("NFKD", chr(c))[0] for c in range(0xC0, 0x250)
+         if unicodedata.normalize("NFKD", chr(c))[0].isascii()}
+_LEGACY_NS = {"g": NS_GENRE, "k": NS_KEYWORD, "d": NS_DIRECTOR, "c": NS_COLLECTION}
+
+
+def fold_words(text: str | None) -> list[str]:
+    """Todas las palabras del texto en minúsculas, sin acentos ni puntuación."""
+    text = (text or "").casefold().translate(_FOLD)
+    if not text.isascii():
+        text = "".join(ch for ch in unicodedata.normalize("NFKD", text) if not unicodedata.combining(ch))
+    return _WORD.findall(text)
+
+
+def normalize_title(title: str | None) -> list[str]:
+    """Palabras del título en minúsculas, sin acentos ni puntuación."""
+    return [w for w in fold_words(title) if len(w) >= MIN_TITLE_WORD]
+
+
+def title_token(word: str) -> int:
+    return (NS_TITLE << ID_BITS) | zlib.crc32(word.encode())
+
+
+_G, _K, _D, _C = (ns << ID_BITS for ns in (NS_GENRE, NS_KEYWORD, NS_DIRECTOR, NS_COLLECTION))
+
+
+@lru_cache(maxsize=TOKEN_CACHE_SIZE)
+def _title_tokens(title: str | None) -> tuple[int, ...]:
+    return tuple(title_token(w) for w in normalize_title(title))
+
+
+def _tokens(m: dict) -> tuple[int, ...]:
+    toks = [_G | g for g in m.get("genre_ids") or ()]
+    toks += [_K | k for k in m.get("keyword_ids") or ()]
+    toks += [_D | d for d in m.get("director_ids") or ()]
+    if m.get("collection_id"):
+        toks.append(_C | m["collection_id"])
+    toks += _title_tokens(m.get("title"))
+    return tuple(set(toks))
+
+
+# Caché por película. La clave incluye todo lo que entra en los tokens: una
+# candidata de discover aún no trae keywords ni directores, y una sincronización
+# del catálogo puede cambiar los ids sin cambiar cuántos hay.
+_cache = {}
+
+def movie_tokens(m: dict) -> tuple[int, ...]:
+    """Tokens únicos de la película (sin orden)."""
+    key = (m.get("id"), m.get("title"), tuple(m.get("genre_ids") or ()), tuple(m.get("keyword_ids") or ()),
+           tuple(m.get("director_ids") or ()), m.get("collection_id"))
+    toks = _cache.get(key)
+    if toks is None:
+        if len(_cache) >= TOKEN_CACHE_SIZE:
+            _cache.clear()
+        toks = _cache[key] = _tokens(m)
+    return toks
+
+
+def legacy_token(tok: str) -> int | None:
+    """Token de texto del formato antiguo ("g12", "ttorrente,") a entero; None si no aplica."""
+    if tok[:1] == "t":
+        words = normalize_title(tok[1:])
+        return title_token(words[0]) if len(words) == 1 else None
+    ns = _LEGACY_NS.get(tok[:1])
+    try:
+        return (ns << ID_BITS) | int(tok[1:]) if ns else None
+    except ValueError:
+        return None
@@ -0,0 +1,132 @@
+"""
+Reentrena los modelos de todos los usuarios de movies.db.
+
+    python train_all.py                 # todos los usuarios con ≥5 favoritos
+    python train_all.py --users a b     # solo algunos
+    python train_all.py --workers 8     # tamaño del pool de procesos
+
+Enriquece una sola vez la unión de películas necesarias (favoritos de todos
+los usuarios), pide cada página discover una sola vez por combinación de
+géneros y entrena las regresiones logísticas en paralelo en un pool de
+procesos. Escribe en el mismo almacén que el entrenamiento online
+(models/store.*, ver model_store.py).
+"""
+import os
+import time
+import asyncio
+import argparse
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from database import SessionLocal
+from models import Favorite
+from catalog import enrich_many, fallback_favorite
+from tmdb import discover_by_genres, popular_movies, fetch_many, close_client
+from ml import train_user_model
+
+MIN_FAVORITES = 5
+
+
+def load_favorites(users: list[str] | None = None) -> dict[str, list[Favorite]]:
+    db = SessionLocal()
+    try:
+        q = db.query(Favorite)
+        if users:
+            q = q.filter(Favorite.user_id.in_(users))
+        by_user = defaultdict(list)
+        for f in q.order_by(Favorite.user_id, Favorite.id).all():
+            by_user[f.user_id].append(f)
+        return dict(by_user)
+    finally:
+        db.close()
+
+
+def _top_genres(favs: list[dict]) -> tuple[int, ...]:
+    counts = Counter(g for m in favs for g in (m.get("genre_ids") or []))
+    return tuple(g for g, _ in counts.most_common(3))
+
+
+async def build_training_sets(by_user: dict[str, list[Favorite]]) -> dict[str, tuple[list, list]]:
+    """(positivos, pool de negativos) por usuario, con peticiones deduplicadas."""
+    # 1) Enriquecer la unión de favoritos una sola vez (catálogo local primero)
+    movie_ids = sorted({f.movie_id for rows in by_user.values() for f in rows})
+    enriched = dict(zip(movie_ids, await enrich_many(movie_ids)))
+
+    positives = {}
+    for user_id, rows in by_user.items():
+        positives[user_id] = [enriched.get(f.movie_id) or fallback_favorite(f) for f in rows]
+
+    # 2) Candidatas por combinación de géneros (deduplicada) + populares
+    triples = sorted({_top_genres(favs) for favs in positives.values()} - {()})
+    calls = [(discover_by_genres, list(t), p) for t in triples for p in (1, 2)]
+    calls.append((popular_movies, 1))
+    results = await fetch_many(calls)
+    by_triple = defaultdict(list)
+    for (_, genres, *_), movies in zip(calls[:-1], results[:-1]):
+        by_triple[tuple(genres)].extend(movies or [])
+    popular = results[-1] or []
+
+    sets = {}
+    for user_id, favs in positives.items():
+        fav_ids = {m["id"] for m in favs}
+        seen = set()
+        pool = []
+        for c in by_triple.get(_top_genres(favs), []) + popular:
+            if c["id"] in fav_ids or c["id"] in seen:
+                continue
+            seen.add(c["id"])
+            pool.append(c)
+        sets[user_id] = (favs, pool)
+    return sets
+
+
+async def _build(by_user):
+    try:
+        return await build_training_sets(by_user)
+    finally:
+        await close_client()
+
+
+def _train(user_id: str, positives: list[dict], negatives_pool: list[dict]):
+    return user_id, train_user_model(user_id, positives=positives, negatives_pool=negatives_pool)
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Reentrena los modelos de todos los usuarios")
+    parser.add_argument("--users", nargs="*", help="solo estos user_id")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--min-favorites", type=int, default=MIN_FAVORITES)
+    args = parser.parse_args(argv)
+
+    t0 = time.perf_counter()
+    by_user = {u: rows for u, rows in load_favorites(args.users).items()
+               if len(rows) >= args.min_favorites}
+    if not by_user:
+        print("No hay usuarios con suficientes favoritos")
+        return
+
+    sets = asyncio.run(_build(by_user))
+    t_fetch = time.perf_counter() - t0
+    print(f"{len(sets)} usuarios, datos preparados en {t_fetch:.1f}s")
+
+    trained = skipped = failed = 0
+    with ProcessPoolExecutor(max_workers=args.workers) as ex:
+        futures = [ex.submit(_train, u, pos, neg) for u, (pos, neg) in sets.items()]
+        for fut in as_completed(futures):
+            try:
+                user_id, info = fut.result()
+            except Exception as e:
+                failed += 1
+                print(f"  error: {e}")
+                continue
+            if info is None:
+                skipped += 1
+            else:
+                trained += 1
+
+    print(f"Entrenados {trained}, omitidos {skipped}, fallidos {failed} "
+          f"en {time.perf_counter() - t0:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+import time
+import asyncio
+
+from metrics import Histogram
+
+# Cola de reentrenamiento en segundo plano.
+# - Un usuario aparece como mucho una vez en la cola: los cambios que llegan
+#   mientras espera se fusionan en el mismo reentrenamiento.
+# - Si llegan cambios mientras se está entrenando, se programa UNA repetición.
+# - Antes de entrenar se espera DEBOUNCE_SECONDS desde el último cambio, para que
+#   una ráfaga de favoritos provoque un solo entrenamiento.
+
+DEBOUNCE_SECONDS = 1.0
+
+RETRAIN_SECONDS = Histogram("retrain_seconds", "Duración de cada reentreno en segundo plano (datos + entrenamiento)",
+                            ("state",))
+
+
+class TrainingQueue:
+    def __init__(self, train_fn, workers: int = 2, debounce: float = DEBOUNCE_SECONDS):
+        """train_fn: corrutina (user_id) -> resumen del entrenamiento con "version",
+        o None si no se entrenó."""
+        self._train_fn = train_fn
+        self._workers = workers
+        self._debounce = debounce
+        self._queue = None
+        self._loop = None
+        self._tasks = []
+        self._pending = set()   # en cola, esperando worker
+        self._running = set()   # entrenando ahora mismo
+        self._dirty = set()     # cambiaron mientras entrenaban
+        self._status = {}       # user_id -> dict
+        self._listeners = []
+
+    def start(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self._workers)]
+
+    async def stop(self) -> None:
+        for t in self._tasks:
+            t.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def on_trained(self, callback) -> None:
+        """Registra una corrutina callback(user_id, result) tras cada entrenamiento
+        (se omite si ya hay otro reentreno pendiente para ese usuario)."""
+        self._listeners.append(callback)
+
+    def enqueue(self, user_id: str) -> None:
+        """Pide reentrenar al usuario. Seguro desde el event loop y desde hilos."""
+        try:
+            in_loop = asyncio.get_running_loop() is self._loop
+        except RuntimeError:
+            in_loop = False
+        if in_loop:
+            self._enqueue(user_id)
+        elif self._loop is not None:
+            self._loop.call_soon_threadsafe(self._enqueue, user_id)
+
+    def stats(self) -> dict:
+        return {"pending": len(self._pending), "running": len(self._running)}
+
+    def status(self, user_id: str) -> dict | None:
+        st = self._status.get(user_id)
+        return dict(st) if st else None
+
+    def _enqueue(self, user_id: str) -> None:
+        st = self._status.setdefault(user_id, {"state": "idle", "version": None, "error": None})
+        st["last_change"] = time.time()
+        if user_id in self._pending:
+            return
+        if user_id in self._running:
+            self._dirty.add(user_id)
+            return
+        self._pending.add(user_id)
+        st["state"] = "queued"
+        st["queued_at"] = time.time()
+        self._queue.put_nowait(user_id)
+
+    async def _worker(self) -> None:
+        while True:
+            user_id = await self._queue.get()
+            st = self._status[user_id]
+            # Debounce: esperar a que la ráfaga de cambios termine
+            while (wait := st["last_change"] + self._debounce - time.time()) > 0:
+                await asyncio.sleep(wait)
+
+            self._pending.discard(user_id)
+            self._running.add(user_id)
+            st["state"] = "running"
+            st["started_at"] = time.time()
+            result = None
+            try:
+                result = await self._train_fn(user_id)
+                st["state"] = "done" if result is not None else "skipped"
+                st["error"] = None
+                if result is not None:
+                    st["version"] = result["version"]
+                    st["last_training"] = result
+            except Exception as e:
+                st["state"] = "failed"
+                st["error"] = str(e)
+            finally:
+                st["finished_at"] = time.time()
+                RETRAIN_SECONDS.observe(st["finished_at"] - st["started_at"], state=st["state"])
+                self._running.discard(user_id)
+                self._queue.task_done()
+                if user_id in self._dirty:
+                    self._dirty.discard(user_id)
+                    self._enqueue(user_id)
+
+            if result is not None and user_id not in self._pending:
+                for cb in self._listeners:
+                    try:
+                        await cb(user_id, result)
+                    except Exception:
+                        pass
@@ -56,7 +56,7 @@ btnSearch.addEventListener("click", () => {
 // Búsqueda en tiempo real con debounce
 queryInput.addEventListener("input", () => {
   clearTimeout(searchTimer);
-  searchTimer = setTimeout(() => doSearch(queryInput.value.trim()), 350);
+  searchTimer = setTimeout(() => doSearch(queryInput.value.trim()), 150);
 });
 
 // Enter busca al instante
@@ -74,23 +74,44 @@ btnReco.addEventListener("click", async () => {
   if (!userId) return showToast("Introduce tu usuario");
   setLoading(true);
   try{
+    // NDJSON: primero un ranking provisional (local), después el definitivo (ML)
     const res = await fetch(
-      `${API}/recommendations?user_id=${encodeURIComponent(userId)}&_=${Date.now()}`,
+      `${API}/recommendations/stream?user_id=${encodeURIComponent(userId)}`,
       { cache: "no-store" }
     );
     if (!res.ok){
       const err = await res.json();
       return showToast(err.detail || "No se pudo recomendar");
     }
-    const data = await res.json();
-    renderResults(data.results || []);
+    await readNdjson(res, (data) => renderResults(data.results || []));
   }catch(e){
-    showToast("Error cargando recomendaciones");
+    // Si ya llegó el ranking provisional se queda en pantalla, pero avisado
+    showToast(e.fromServer ? e.message : "Error cargando recomendaciones");
   }finally{
     setLoading(false);
   }
 });
 
+async function readNdjson(res, onLine){
+  const reader = res.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = "";
+  for (;;){
+    const { done, value } = await reader.read();
+    buffer += decoder.decode(value || new Uint8Array(), { stream: !done });
+    let nl;
+    while ((nl = buffer.indexOf("\n")) >= 0){
+      const line = buffer.slice(0, nl).trim();
+      buffer = buffer.slice(nl + 1);
+      if (!line) continue;
+      const data = JSON.parse(line);
+      if (data.stage === "error") throw Object.assign(new Error(data.detail || "No se pudo recomendar"), { fromServer: true });
+      onLine(data);
+    }
+    if (done) break;
+  }
+}
+
 async function loadFavs(){
   const userId = $("#userId").value.trim();
   if (!userId) return showToast("Introduce tu usuario");